@@ -1,27 +1,91 @@
 """
 Sound analyser logging.
+Log records are put on a queue by the logging thread (or process),
+and written to the log file by a single listener thread, so that
+logging does not do any disk I/O on the audio and analysis paths.
 """
 
+import atexit
+from collections import defaultdict
+import itertools
 import logging
 import logging.config
 import logging.handlers
+import multiprocessing
 import time
+from typing import Optional
 
 import dotsi  # type: ignore
 
 from sounder import app_settings
 
+# Queue of log records, and listener writing them to the log file.
+_log_queue: Optional[multiprocessing.Queue] = None
+_listener: Optional[logging.handlers.QueueListener] = None
 
-def setup_logging(name: str) -> None:
+# Arguments for worker processes to log to the same queue.
+_worker_args: tuple = (None, "", logging.NOTSET, {})
+
+
+class SampleFilter(logging.Filter):
+    """
+    Log filter to only pass 1 in N records for each stage.
+    Records are given a stage with extra={"stage": <stage>},
+    and records without a stage are always passed.
+    """
+
+    def __init__(self, sample_every: Optional[dict[str, int]]) -> None:
+        """
+        Log sample filter initialisation.
+        Args:
+            sample_every:   Dictionary of stage names and the sampling rate (N).
+        """
+
+        super().__init__()
+
+        self._sample_every = dict(sample_every or {})
+        self._counts: defaultdict[str, itertools.count] = defaultdict(itertools.count)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """
+        Determine if the log record is to be passed.
+        Args:
+            record: Log record.
+        Returns:
+            True to pass the record.
+        """
+
+        # Always pass records without a stage, or stages not being sampled.
+        stage: Optional[str] = getattr(record, "stage", None)
+        if stage is None:
+            return True
+        every = self._sample_every.get(stage, 1)
+        if every <= 1:
+            return True
+
+        # Pass the first record of every N for the stage.
+        return next(self._counts[stage]) % every == 0
+
+
+def setup_logging(name: str, settings: Optional[dotsi.Dict] = None, log_file: Optional[str] = None) -> None:
     """
     Sets up the logging handle.
+    Starts the listener thread writing queued log records to file.
 
     Args:
-        name:   Name for logger
+        name:       Name for logger
+        settings:   Application settings, loaded from the default settings file if None.
+        log_file:   Log file name, the logger name with ".log" added if None.
     """
 
+    global _log_queue, _listener, _worker_args
+
     # Load application settings.
-    settings = dotsi.Dict(app_settings.load("./sounder/settings.yaml"))
+    if settings is None:
+        settings = dotsi.Dict(app_settings.load())
+
+    # Only one listener; stop any previous one.
+    stop_logging()
 
     # Create logger.
     log = logging.getLogger(name)
@@ -29,7 +93,7 @@ def setup_logging(name: str) -> None:
     log.setLevel(settings.log.DEF_LEVEL)
     # Setup log handler for rotating files.
     handler = logging.handlers.RotatingFileHandler(
-        name + ".log", maxBytes=settings.log.MAX_SIZE, backupCount=settings.log.MAX_FILES
+        log_file or name + ".log", maxBytes=settings.log.MAX_SIZE, backupCount=settings.log.MAX_FILES
     )
     # Assign formatter to the log handler.
     handler.setFormatter(
@@ -40,5 +104,85 @@ def setup_logging(name: str) -> None:
         )
     )
     logging.Formatter.converter = time.localtime
-    # Add log handler to logger.
-    log.addHandler(handler)
+
+    # Start the listener thread writing to the log file.
+    # Queue can be shared with worker processes.
+    _log_queue = multiprocessing.Queue(-1)
+    _listener = logging.handlers.QueueListener(_log_queue, handler, respect_handler_level=True)
+    _listener.start()
+    atexit.unregister(stop_logging)
+    atexit.register(stop_logging)
+
+    # Add queue handler to logger, sampling any hot loop logging.
+    # Replace the handler for any previous queue.
+    for old_handler in [h for h in log.handlers if isinstance(h, logging.handlers.QueueHandler)]:
+        log.removeHandler(old_handler)
+    sample_every = settings.log.get("SAMPLE_EVERY")
+    log.addHandler(_queue_handler(_log_queue, sample_every))
+    _worker_args = (_log_queue, name, settings.log.DEF_LEVEL, dict(sample_every or {}))
+
+
+def stop_logging() -> None:
+    """
+    Stops the listener thread, writing out any queued log records.
+    Records logged after this are queued, but not written.
+    """
+
+    global _listener
+
+    if _listener:
+        _listener.stop()
+        # Close the log file.
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def worker_logging_args() -> tuple:
+    """
+    Gets the arguments for setting up logging in worker processes.
+    Pass to a process pool as initargs with initializer=worker_logging.
+
+    Returns:
+        Tuple of arguments for worker_logging.
+    """
+
+    return _worker_args
+
+
+def worker_logging(queue: Optional[multiprocessing.Queue], name: str, level: int, sample_every: dict) -> None:
+    """
+    Sets up logging in a worker process to log to the main process log queue.
+    Does nothing if logging is not set up in the main process.
+
+    Args:
+        queue:          Log queue from the main process.
+        name:           Name for logger
+        level:          Logging level.
+        sample_every:   Dictionary of stage names and the sampling rate.
+    """
+
+    if queue is None:
+        return
+
+    # Replace any handlers inherited from the main process.
+    log = logging.getLogger(name)
+    log.setLevel(level)
+    log.handlers.clear()
+    log.addHandler(_queue_handler(queue, sample_every))
+
+
+def _queue_handler(queue: multiprocessing.Queue, sample_every: Optional[dict[str, int]]) -> logging.Handler:
+    """
+    Creates a handler to put log records on the log queue.
+
+    Args:
+        queue:          Log queue.
+        sample_every:   Dictionary of stage names and the sampling rate.
+    Returns:
+        Queue log handler.
+    """
+
+    handler = logging.handlers.QueueHandler(queue)
+    handler.addFilter(SampleFilter(sample_every))
+    return handler
@@ -2,15 +2,21 @@
 Sounder application settings.
 """
 
+import os
+
 import dotsi  # type: ignore
 import yaml  # type: ignore
 
+# Default settings file, in the application package.
+SETTINGS_FILE = os.path.join(os.path.dirname(__file__), "settings.yaml")
+
 
-def load(settings_file: str) -> dotsi.Dict:
+def load(settings_file: str = SETTINGS_FILE) -> dotsi.Dict:
     """
     Load yaml settings file and return settings dictionary.
     Args:
-        settings_file:  Name (including path) of yaml settings file.
+        settings_file:  Name (including path) of yaml settings file,
+                        the application settings file if not given.
     Returns:
         Returns dictionary of settings.
     """
@@ -0,0 +1,363 @@
+"""
+Audio device stream profiles, and measurement of the audio latency.
+Profiles in the settings set the block size, latency and device used
+for recording and playback, so they can be tuned for the lowest
+stable latency.
+Recording by opening the input stream for the recording, and also
+an always armed recorder, keeping the input stream open and
+capturing to a ring buffer, so recording starts without any device
+start up and can include samples from before it was started.
+"""
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Optional
+
+import dotsi  # type: ignore
+import numpy as np  # type: ignore
+import sounddevice as sd  # type: ignore
+
+log = logging.getLogger(__name__)
+
+# Longest interval between polls of the armed recorder for the end of a recording (seconds).
+POLL_SECS = 0.01
+
+
+def stream_kwargs(settings: dotsi.Dict, profile: Optional[str] = None) -> dict[str, Any]:
+    """
+    Function to get the stream arguments of an audio profile.
+    Args:
+        settings:   Application settings.
+        profile:    Name of the audio profile, the selected profile if None.
+    Returns:
+        Dictionary of blocksize, latency and device stream arguments.
+    """
+
+    profile_settings = settings.audio.PROFILES[profile or settings.audio.PROFILE]
+
+    return {
+        "blocksize": profile_settings.BLOCKSIZE,
+        "latency": profile_settings.LATENCY,
+        "device": profile_settings.DEVICE,
+    }
+
+
+def measure_latency(
+    settings: dotsi.Dict, profile: Optional[str] = None, stream_factory: Callable[..., Any] = sd.Stream
+) -> dotsi.Dict:
+    """
+    Function to measure the latency of the audio device.
+    A pulse is played through a duplex stream, and the round trip latency
+    is the number of samples until the pulse is captured, which needs the
+    output to be looped back (or heard by the microphone).
+    Also reports the latency reported by the device, and counts the
+    callbacks that had underruns or overruns.
+    Args:
+        settings:       Application settings.
+        profile:        Name of the audio profile, the selected profile if None.
+        stream_factory: Function to create the duplex stream, sounddevice Stream
+                        if not given, or a simulated stream for testing.
+    Returns:
+        Dictionary of the latency measurements, latencies in milliseconds.
+        Round trip latency is None if the pulse was not captured.
+    """
+
+    profile = profile or settings.audio.PROFILE
+    log.info(f"Measuring audio latency of profile: {profile}")
+
+    sample_rate = settings.sound.SAMPLE_RATE
+    total = int(settings.audio.MEASURE_SECS * sample_rate)
+    pulse_at = total // 4
+
+    # Captured input, and counts of frames and stream problems.
+    captured = np.zeros(total, dtype=np.float32)
+    state = {"frames": 0, "underruns": 0, "overruns": 0, "callbacks": 0}
+    done = threading.Event()
+
+    def callback(indata: np.ndarray, outdata: np.ndarray, frames: int, time_info: Any, status: Any) -> None:
+        # Count any underruns or overruns in this callback.
+        if status.input_underflow or status.output_underflow:
+            state["underruns"] += 1
+        if status.input_overflow or status.output_overflow:
+            state["overruns"] += 1
+        state["callbacks"] += 1
+
+        # Output the pulse when it falls in this block.
+        start = state["frames"]
+        outdata.fill(0)
+        if start <= pulse_at < start + frames:
+            outdata[pulse_at - start, :] = settings.audio.PULSE_LEVEL
+
+        # Keep the input, until enough has been captured.
+        count = min(frames, total - start)
+        if count > 0:
+            captured[start : start + count] = indata[:count, 0]
+        state["frames"] = start + frames
+        if state["frames"] >= total:
+            done.set()
+
+    stream = stream_factory(
+        samplerate=sample_rate, channels=1, dtype="float32", callback=callback, **stream_kwargs(settings, profile)
+    )
+    with stream:
+        done.wait(timeout=settings.audio.MEASURE_SECS * 4 + 1)
+        reported_input, reported_output = stream.latency
+
+    # Pulse is the first captured sample over half the pulse level after it was played.
+    found = np.flatnonzero(np.abs(captured[pulse_at:]) > settings.audio.PULSE_LEVEL / 2)
+    round_trip = int(found[0]) if len(found) else None
+
+    results = dotsi.Dict(
+        {
+            "profile": profile,
+            "blocksize": stream_kwargs(settings, profile)["blocksize"],
+            "input_ms": reported_input * 1000,
+            "output_ms": reported_output * 1000,
+            "round_trip_samples": round_trip,
+            "round_trip_ms": round_trip * 1000 / sample_rate if round_trip is not None else None,
+            "callbacks": state["callbacks"],
+            "underruns": state["underruns"],
+            "overruns": state["overruns"],
+        }
+    )
+    log.info(f"Audio latency measurements: {dict(results)}")
+
+    return results
+
+
+def record_stream(settings: dotsi.Dict, secs: float, progress: Optional[Callable[[int], None]] = None) -> np.ndarray:
+    """
+    Function to record a sound sample, opening the input stream
+    for the recording.
+    Note only recording 1 channel (the left) if more than 1 channel available.
+    Stream block size, latency and device are from the audio profile.
+    Args:
+        settings:   Application settings.
+        secs:       Duration of the recording (seconds).
+        progress:   Function called with the percent of the recording done.
+    Returns:
+        Recorded samples.
+    """
+
+    # Start recorder with the given values of duration and sample frequency.
+    num_samples = int(settings.sound.SAMPLE_RATE * secs)
+    recording = sd.rec(num_samples, samplerate=settings.sound.SAMPLE_RATE, channels=1, **stream_kwargs(settings))
+
+    # Progress in integer percents, waiting 1 percent of the recording duration each.
+    if progress:
+        for idx in range(101):
+            progress(idx)
+            time.sleep(secs / 100)
+
+    # Make sure that the recording is complete.
+    # If not quite complete this will block until done.
+    sd.wait()
+
+    return recording
+
+
+class RingBuffer:
+    """
+    Fixed size ring buffer of samples.
+    Samples are addressed by their position in all the samples written,
+    so readers can ask for a range of samples while the writer continues.
+    Only one thread is to write to the buffer.
+    """
+
+    def __init__(self, size: int, dtype: type = np.float32) -> None:
+        """
+        Ring buffer initialisation.
+        Args:
+            size:   Number of samples in the buffer.
+            dtype:  Type of the samples.
+        """
+
+        self._buffer: np.ndarray = np.zeros(size, dtype=dtype)
+        self._size = size
+        self._written = 0
+        self._writing = 0
+
+    @property
+    def size(self) -> int:
+        """
+        Number of samples in the buffer.
+        """
+
+        return self._size
+
+    @property
+    def written(self) -> int:
+        """
+        Total number of samples written to the buffer.
+        """
+
+        return self._written
+
+    def write(self, data: np.ndarray) -> None:
+        """
+        Function to write samples to the buffer, overwriting the oldest.
+        Args:
+            data:   Samples to write.
+        """
+
+        # Only the newest samples fit if more than the buffer size.
+        count = len(data)
+        if count > self._size:
+            data = data[-self._size :]
+        start = (self._written + count - len(data)) % self._size
+
+        # Publish the end of this write before copying, so readers
+        # can tell if their samples are being overwritten.
+        self._writing = self._written + count
+
+        # Copy in up to 2 parts, if wrapping around the end of the buffer.
+        first = min(len(data), self._size - start)
+        self._buffer[start : start + first] = data[:first]
+        self._buffer[: len(data) - first] = data[first:]
+
+        # Update the count last, so readers only see complete writes.
+        self._written = self._writing
+
+    def read(self, start: int, count: int) -> np.ndarray:
+        """
+        Function to read a copy of a range of samples from the buffer.
+        Args:
+            start:  Position of the first sample in all the samples written.
+            count:  Number of samples to read.
+        Returns:
+            Copy of the samples.
+        """
+
+        if start + count > self._written:
+            raise ValueError("Samples not yet written to ring buffer.")
+        if start < self._written - self._size:
+            raise ValueError("Samples already overwritten in ring buffer.")
+
+        # Copy out in up to 2 parts, if wrapping around the end of the buffer.
+        first_idx = start % self._size
+        first = min(count, self._size - first_idx)
+        samples = np.concatenate((self._buffer[first_idx : first_idx + first], self._buffer[: count - first]))
+
+        # Check the writer did not overwrite the samples while copying,
+        # including a write still in progress.
+        if start < self._writing - self._size:
+            raise ValueError("Samples overwritten in ring buffer while reading.")
+
+        return samples
+
+
+class ArmedRecorder:
+    """
+    Recorder keeping the input stream open, capturing to a ring buffer.
+    """
+
+    def __init__(self, settings: dotsi.Dict, stream_factory: Callable[..., Any] = sd.InputStream) -> None:
+        """
+        Armed recorder initialisation.
+        Args:
+            settings:       Application settings.
+            stream_factory: Function to create the input stream, sounddevice
+                            InputStream if not given, or a simulated stream for testing.
+        """
+
+        log.info("Initialising armed recorder.")
+
+        # Initialise application settings to use.
+        self._settings = settings
+        self._sample_rate = settings.sound.SAMPLE_RATE
+
+        # Ring buffer to capture to, count of callbacks with overruns,
+        # and the largest block captured.
+        self._ring = RingBuffer(int(settings.capture.BUFFER_SECS * self._sample_rate))
+        self.overruns = 0
+        self._max_block = 0
+
+        self._stream = stream_factory(
+            samplerate=self._sample_rate,
+            channels=1,
+            dtype="float32",
+            callback=self._callback,
+            **stream_kwargs(settings),
+        )
+
+    def _callback(self, indata: np.ndarray, frames: int, time_info: Any, status: Any) -> None:
+        """
+        Input stream callback, capturing the input to the ring buffer.
+        """
+
+        if status.input_overflow:
+            self.overruns += 1
+        self._max_block = max(self._max_block, frames)
+        self._ring.write(indata[:frames, 0])
+
+    def start(self) -> None:
+        """
+        Start capturing from the input stream.
+        """
+
+        log.info("Starting armed recorder input stream.")
+        self._stream.start()
+
+    def stop(self) -> None:
+        """
+        Stop capturing, and close the input stream.
+        """
+
+        log.info("Stopping armed recorder input stream.")
+        self._stream.stop()
+        self._stream.close()
+
+    def __enter__(self) -> "ArmedRecorder":
+        self.start()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.stop()
+
+    def record(
+        self, secs: float, pre_roll: Optional[float] = None, progress: Optional[Callable[[int], None]] = None
+    ) -> np.ndarray:
+        """
+        Function to record from now, including the pre-roll samples
+        captured before now.
+        Args:
+            secs:       Duration of the recording from now (seconds).
+            pre_roll:   Duration of the recording before now (seconds),
+                        from the settings if None.
+            progress:   Function called with the percent of the recording done.
+        Returns:
+            Recorded samples.
+        """
+
+        if pre_roll is None:
+            pre_roll = self._settings.capture.PRE_ROLL_SECS
+
+        # Trigger the recording from the samples captured so far.
+        # Pre-roll is limited to what has been captured.
+        trigger = self._ring.written
+        start = max(0, trigger - int(pre_roll * self._sample_rate))
+        end = trigger + int(secs * self._sample_rate)
+        if end <= trigger:
+            raise ValueError("Recording duration less than one sample.")
+
+        # Leave room for the blocks captured while polling for the end and
+        # while reading, so the start is not overwritten before it is read.
+        poll_secs = min(POLL_SECS, secs / 100)
+        headroom = 2 * self._max_block + int(poll_secs * self._sample_rate)
+        if end - start > self._ring.size - headroom:
+            raise ValueError("Recording longer than the capture ring buffer.")
+
+        # Wait until all the samples have been captured,
+        # unless the input stream stops calling back.
+        deadline = time.monotonic() + secs + self._settings.capture.TIMEOUT_SECS
+        while self._ring.written < end:
+            if time.monotonic() > deadline:
+                raise TimeoutError("Armed recorder input stream stopped capturing.")
+            if progress:
+                progress(100 * (self._ring.written - trigger) // (end - trigger))
+            time.sleep(poll_secs)
+        if progress:
+            progress(100)
+
+        return self._ring.read(start, end - start)
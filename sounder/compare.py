@@ -0,0 +1,164 @@
+"""
+Functions to compare two or more sounder recordings against the first.
+Recordings are aligned in time by FFT cross correlation of their energy
+envelopes, so that notes can be matched, and the spectra are compared
+on the semitone grid.
+Spectra come from the analysis pipeline, so are reused if already analysed.
+"""
+
+import logging
+from typing import Optional
+
+import dotsi  # type: ignore
+import numpy as np  # type: ignore
+from scipy.signal import correlate  # type: ignore
+from scipy.signal import correlation_lags  # type: ignore
+
+import sounder.file_analysis as fa
+import sounder.trim as trim
+
+log = logging.getLogger(__name__)
+
+
+def align_offset(ref_data: np.ndarray, other_data: np.ndarray, frame_size: int) -> int:
+    """
+    Function to find the offset of one recording relative to another,
+    by the peak of the cross correlation of their energy envelopes,
+    calculated by FFT.
+    Envelopes are used rather than the samples so that recordings of
+    the same notes at slightly different pitch still line up.
+    Args:
+        ref_data:   Single channel sound samples of the reference.
+        other_data: Single channel sound samples to align to the reference.
+        frame_size: Number of samples in each envelope frame.
+    Returns:
+        Number of samples the other recording is later than the reference,
+        to the nearest frame.
+    """
+
+    # Energy envelopes, with the mean removed so that the length of
+    # the overlap does not bias the correlation.
+    ref = 10.0 ** (trim.frame_energy_db(ref_data, frame_size) / 10.0)
+    other = 10.0 ** (trim.frame_energy_db(other_data, frame_size) / 10.0)
+    ref -= ref.mean()
+    other -= other.mean()
+
+    # Cross correlation by FFT is O(n log n).
+    xcorr = correlate(other, ref, mode="full", method="fft")
+    lags = correlation_lags(len(other), len(ref), mode="full")
+
+    return int(lags[np.argmax(xcorr)]) * frame_size
+
+
+def cents(freq: float, ref_freq: float) -> float:
+    """
+    Function to get the difference between frequencies in cents.
+    Args:
+        freq:       Frequency (Hz).
+        ref_freq:   Reference frequency (Hz).
+    Returns:
+        Difference in cents, positive if sharp of the reference.
+    """
+
+    return float(1200 * np.log2(freq / ref_freq))
+
+
+def match_notes(
+    ref_notes: list[dotsi.Dict], other_notes: list[dotsi.Dict], offset_secs: float, tolerance: float
+) -> list[dotsi.Dict]:
+    """
+    Function to match the notes of a recording to the reference notes,
+    after allowing for the offset between the recordings.
+    Args:
+        ref_notes:      Note analysis of the reference.
+        other_notes:    Note analysis of the other recording.
+        offset_secs:    Offset of the other recording from the reference (seconds).
+        tolerance:      Maximum difference in note start to match (seconds).
+    Returns:
+        List of matched notes, with the shift in cents from the reference.
+    """
+
+    matched: list[dotsi.Dict] = []
+    if not ref_notes:
+        return matched
+
+    # Find the nearest reference note to the start of each note.
+    ref_starts = np.array([note.start for note in ref_notes])
+    for note in other_notes:
+        idx = int(np.argmin(np.abs(ref_starts - (note.start - offset_secs))))
+        if abs(ref_starts[idx] - (note.start - offset_secs)) <= tolerance:
+            ref_note = ref_notes[idx]
+            matched.append(
+                dotsi.Dict(
+                    {
+                        "start": ref_note.start,
+                        "ref_note": ref_note.note,
+                        "ref_freq": ref_note.freq,
+                        "freq": note.freq,
+                        "shift": cents(note.freq, ref_note.freq),
+                    }
+                )
+            )
+
+    return matched
+
+
+def compare_files(
+    s_files: list[str], settings: dotsi.Dict, pipeline: Optional[fa.AnalysisPipeline] = None
+) -> list[dotsi.Dict]:
+    """
+    Function to compare recordings against the first (reference) recording.
+    Args:
+        s_files:    Filenames of the sound sample files, the first is the reference.
+        settings:   Application settings.
+        pipeline:   Analysis pipeline to use, the default pipeline if None.
+    Returns:
+        List of comparisons of each recording, the first is the reference.
+    """
+
+    log.info(f"Comparing sound recordings: {s_files}")
+
+    pipeline = pipeline or fa.default_pipeline()
+
+    # Analyse the reference recording.
+    ref_file = s_files[0]
+    ref = fa.analyse_file(ref_file, settings, pipeline)
+    ref_notes = fa.analyse_notes(ref_file, settings, pipeline)
+    _, (ref_rate, ref_data) = pipeline.load(ref_file)
+    _, (ref_start, ref_end) = pipeline.trim(ref_file, settings)
+    align_samples = int(settings.compare.ALIGN_SECS * ref_rate)
+
+    comparisons = [dotsi.Dict({"file": ref_file, "analysis": ref, "offset": 0.0, "peak_shift": 0.0, "notes": []})]
+
+    for s_file in s_files[1:]:
+        analysis = fa.analyse_file(s_file, settings, pipeline)
+        notes = fa.analyse_notes(s_file, settings, pipeline)
+        _, (sample_rate, sound_data) = pipeline.load(s_file)
+        _, (start, end) = pipeline.trim(s_file, settings)
+        if sample_rate != ref_rate:
+            raise ValueError(f"Sample rate of {s_file} differs from {ref_file}.")
+
+        # Align the start of the active regions of the recordings.
+        offset = align_offset(
+            ref_data[ref_start : min(ref_end, ref_start + align_samples)],
+            sound_data[start : min(end, start + align_samples)],
+            max(1, int(settings.trim.FRAME_SECS * sample_rate)),
+        )
+        offset_secs = (start - ref_start + offset) / sample_rate
+        log.info(f"Recording {s_file} offset from reference by {offset_secs:.3f}s.")
+
+        comparisons.append(
+            dotsi.Dict(
+                {
+                    "file": s_file,
+                    "analysis": analysis,
+                    "offset": offset_secs,
+                    # Difference in the spectra on the semitone grid.
+                    "difference": analysis.semitone_power - ref.semitone_power,
+                    "peak_shift": cents(analysis.peak_freq, ref.peak_freq),
+                    "notes": match_notes(ref_notes, notes, offset_secs, settings.compare.NOTE_TOLERANCE),
+                }
+            )
+        )
+
+    return comparisons
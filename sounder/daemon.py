@@ -0,0 +1,480 @@
+"""
+Long running analysis service, and client to send it jobs.
+The service keeps a warm pool of worker processes, with the analysis
+modules imported and caches loaded, and accepts jobs over a local socket.
+Jobs and results are sent as lines of JSON, and results are streamed
+back as they complete.
+
+Jobs are of the form:
+    {"job": "ping"}
+    {"job": "analyse", "file": <sound file>, "settings": <optional settings>}
+    {"job": "notes", "file": <sound file>, "settings": <optional settings>}
+    {"job": "meter", "file": <sound file>, "settings": <optional settings>}
+    {"job": "batch", "files": [<sound file>, ...], "settings": <optional settings>}
+    {"job": "record", "secs": <optional duration>}
+Analysis jobs can give the client's analysis settings sections, which
+replace the daemon's own for that job.
+Every job is finished with a {"done": true} result.
+"""
+
+from concurrent.futures import as_completed
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+from typing import Iterator, Optional
+
+import dotsi  # type: ignore
+import numpy as np  # type: ignore
+import sounddevice as sd  # type: ignore
+
+from sounder import app_logging
+from sounder import app_settings
+from sounder import audio_io
+import sounder.file_analysis as fa
+import sounder.meter as meter
+import sounder.sound_analysis as sa
+import sounder.welch as welch
+
+log = logging.getLogger(__name__)
+
+# Sections of the settings used by analysis jobs, that a client can send.
+ANALYSIS_SECTIONS = ["sound", "trim", "semitone", "onset", "harmonics", "meter", "welch"]
+
+
+def _worker_init(log_args: tuple) -> None:
+    """
+    Function to initialise a worker process.
+    Sets up logging, and warms up the transform caches.
+    Welch segments are run serially, as the workers are already a pool.
+    Args:
+        log_args:   Arguments to set up logging in the worker.
+    """
+
+    app_logging.worker_logging(*log_args)
+    welch.run_serial()
+
+    # Run a small transform so that the first job doesn't pay for set up.
+    sa.power_spectrum(np.zeros(4096, dtype=np.int16), 44100)
+
+
+def _analyse_job(s_file: str, settings: dotsi.Dict) -> dict:
+    """
+    Function to analyse a sound file in a worker process.
+    Args:
+        s_file:     Filename of the sound sample file to analyse.
+        settings:   Application settings.
+    Returns:
+        Dictionary of the analysis results, that can be sent as JSON.
+    """
+
+    # Analyse the whole file, each of the notes in the file, and meter its levels.
+    # Stage outputs are kept by the worker, keyed on the settings they used,
+    # so only stages affected by changed job settings are rerun.
+    analysis = fa.analyse_file(s_file, settings)
+    notes = fa.analyse_notes(s_file, settings)
+    levels = fa.analyse_levels(s_file, settings)
+
+    return {
+        "file": s_file,
+        "peak_freq": analysis.peak_freq,
+        "peak_power": analysis.peak_power,
+        "note": analysis.note,
+        "cents": analysis.cents,
+        "notes": [dict(note) for note in notes],
+        "levels": meter.report(levels),
+    }
+
+
+def _notes_job(s_file: str, settings: dotsi.Dict) -> dict:
+    """
+    Function to analyse each of the notes in a sound file in a worker process.
+    Args:
+        s_file:     Filename of the sound sample file to analyse.
+        settings:   Application settings.
+    Returns:
+        Dictionary of the note analysis results, that can be sent as JSON.
+    """
+
+    notes = fa.analyse_notes(s_file, settings)
+
+    return {"file": s_file, "notes": [dict(note) for note in notes]}
+
+
+def _meter_job(s_file: str, settings: dotsi.Dict) -> dict:
+    """
+    Function to meter the levels of a sound file in a worker process.
+    Args:
+        s_file:     Filename of the sound sample file to meter.
+        settings:   Application settings.
+    Returns:
+        Dictionary of the meter report, that can be sent as JSON.
+    """
+
+    levels = fa.analyse_levels(s_file, settings)
+
+    return {"file": s_file, "levels": meter.report(levels)}
+
+
+# Jobs on a single sound file, and the function run in a worker for each.
+FILE_JOBS = {"analyse": _analyse_job, "notes": _notes_job, "meter": _meter_job}
+
+
+class AnalysisDaemon:
+    """
+    Analysis service, serving jobs from a local socket.
+    """
+
+    def __init__(self, settings: dotsi.Dict) -> None:
+        """
+        Analysis service initialisation.
+        Args:
+            settings:   Application settings.
+        """
+
+        log.info("Initialising analysis daemon.")
+
+        # Initialise application settings to use.
+        self._settings = settings
+
+        # Refuse to start if a daemon is already serving the socket,
+        # before starting any workers or opening the audio device.
+        if DaemonClient(settings).available():
+            raise OSError("Analysis daemon already running.")
+
+        # Warm pool of worker processes for analysis jobs.
+        # Replaced if a worker dies, so only one job thread is to replace it.
+        self._pool = self._start_pool()
+        self._pool_lock = threading.Lock()
+
+        # Only one job at a time can use the audio device.
+        self._audio_lock = threading.Lock()
+
+        # Armed recorder, keeping the input stream open, if using it.
+        self._recorder: Optional[audio_io.ArmedRecorder] = None
+        if settings.capture.ARMED:
+            self._recorder = audio_io.ArmedRecorder(settings)
+            self._recorder.start()
+
+        # Create the socket server, with a handler that calls back to this daemon.
+        daemon = self
+
+        class JobHandler(socketserver.StreamRequestHandler):
+            """
+            Handler for a client connection, serving jobs until it disconnects.
+            """
+
+            def handle(self) -> None:
+                try:
+                    for line in self.rfile:
+                        if not line.strip():
+                            continue
+                        for result in daemon.run_job(line):
+                            self.wfile.write((json.dumps(result) + "\n").encode("utf8"))
+                            self.wfile.flush()
+                except ConnectionError:
+                    # Client has gone; nothing to send results to.
+                    log.info("Analysis daemon client disconnected.")
+
+        self._server: socketserver.BaseServer
+        if hasattr(socket, "AF_UNIX"):
+            # Remove any socket left from a previous run.
+            if os.path.exists(settings.daemon.SOCKET):
+                os.remove(settings.daemon.SOCKET)
+            self._server = socketserver.ThreadingUnixStreamServer(settings.daemon.SOCKET, JobHandler)
+        else:
+            self._server = socketserver.ThreadingTCPServer((settings.daemon.HOST, settings.daemon.PORT), JobHandler)
+        self._server.daemon_threads = True  # type: ignore
+
+    def _start_pool(self) -> ProcessPoolExecutor:
+        """
+        Function to start the pool of worker processes.
+        Returns:
+            Pool of worker processes.
+        """
+
+        return ProcessPoolExecutor(
+            max_workers=self._settings.daemon.WORKERS,
+            initializer=_worker_init,
+            initargs=(app_logging.worker_logging_args(),),
+        )
+
+    def _restart_pool(self, broken: ProcessPoolExecutor) -> None:
+        """
+        Function to replace a broken pool of worker processes,
+        unless it has already been replaced by another job.
+        Args:
+            broken: Pool that is broken.
+        """
+
+        with self._pool_lock:
+            if self._pool is broken:
+                log.warning("Analysis daemon worker pool broken, restarting it.")
+                broken.shutdown(wait=False)
+                self._pool = self._start_pool()
+
+    def serve_forever(self) -> None:
+        """
+        Serve jobs until shutdown.
+        """
+
+        log.info("Analysis daemon serving jobs.")
+        self._server.serve_forever()
+
+    def shutdown(self) -> None:
+        """
+        Stop serving jobs, and stop the worker processes.
+        """
+
+        log.info("Stopping analysis daemon.")
+        self._server.shutdown()
+        self._server.server_close()
+        self._pool.shutdown()
+        if self._recorder:
+            self._recorder.stop()
+        if hasattr(socket, "AF_UNIX") and os.path.exists(self._settings.daemon.SOCKET):
+            os.remove(self._settings.daemon.SOCKET)
+
+    def run_job(self, line: bytes) -> Iterator[dict]:
+        """
+        Function to run a job, yielding results as they are ready.
+        Args:
+            line:   JSON job request.
+        Returns:
+            Iterator of results, finishing with the done result.
+        """
+
+        pool = self._pool
+        try:
+            job = json.loads(line)
+            log.info(f"Analysis daemon job: {job.get('job')}")
+
+            if job["job"] == "ping":
+                yield {"pong": True}
+            elif job["job"] in FILE_JOBS:
+                settings = self._job_settings(job)
+                yield pool.submit(FILE_JOBS[job["job"]], job["file"], settings).result()
+            elif job["job"] == "batch":
+                # Stream results back in the order they complete.
+                settings = self._job_settings(job)
+                futures = {pool.submit(_analyse_job, s_file, settings): s_file for s_file in job["files"]}
+                for future in as_completed(futures):
+                    try:
+                        yield future.result()
+                    except BrokenProcessPool:
+                        # Fails the rest of the batch, and replaces the pool.
+                        raise
+                    except (OSError, ValueError) as ex:
+                        yield {"file": futures[future], "error": str(ex)}
+                    except Exception as ex:
+                        # Unexpected error in this file only, the rest of the batch carries on.
+                        log.exception(f"Analysis daemon batch file failed unexpectedly - {ex}")
+                        yield {"file": futures[future], "error": f"Unexpected error: {ex}"}
+            elif job["job"] == "record":
+                yield {"file": self._record(job.get("secs", self._settings.sound.SAMPLE_DUR))}
+            else:
+                yield {"error": f"Unknown job: {job['job']}"}
+        except BrokenProcessPool as ex:
+            # A worker died; replace the pool so later jobs can run.
+            log.warning(f"Analysis daemon job failed, worker pool broken - {ex}")
+            self._restart_pool(pool)
+            yield {"error": f"Worker pool broken: {ex}"}
+        except (OSError, ValueError, KeyError, TypeError, sd.PortAudioError) as ex:
+            log.warning(f"Analysis daemon job failed - {ex}")
+            yield {"error": str(ex)}
+        except Exception as ex:
+            # Unexpected error, still report it so the client is not left waiting.
+            log.exception(f"Analysis daemon job failed unexpectedly - {ex}")
+            yield {"error": f"Unexpected error: {ex}"}
+
+        yield {"done": True}
+
+    def _job_settings(self, job: dict) -> dotsi.Dict:
+        """
+        Function to get the settings for an analysis job, with any
+        analysis settings sections sent with the job replacing the daemon's.
+        Args:
+            job:    Job request.
+        Returns:
+            Application settings for the job.
+        """
+
+        # Only analysis sections can be replaced, not those of the daemon itself.
+        sections = job.get("settings") or {}
+        unknown = set(sections) - set(ANALYSIS_SECTIONS)
+        if unknown:
+            raise ValueError(f"Settings sections not allowed in jobs: {sorted(unknown)}")
+
+        return dotsi.Dict({**self._settings, **sections})
+
+    def _record(self, secs: float) -> str:
+        """
+        Function to record a sound sample, saved with a file name
+        that includes the current time.
+        Args:
+            secs:   Duration of the recording (seconds).
+        Returns:
+            Absolute file name of the recording.
+        """
+
+        with self._audio_lock:
+            if self._recorder:
+                # Recording starts immediately from the armed recorder.
+                recording = self._recorder.record(secs)
+            else:
+                # Otherwise open the input stream for the recording.
+                recording = audio_io.record_stream(self._settings, secs)
+
+        # Create the filename form the date and time.
+        # Absolute, as the client may not share the daemon working directory.
+        s_file = os.path.abspath(f"sounder-{datetime.now().strftime('%Y%m%d%H%M%S')}.wav")
+        sa.write_wav(s_file, self._settings.sound.SAMPLE_RATE, recording, pre_roll=self._recorder is not None)
+
+        return s_file
+
+
+class DaemonClient:
+    """
+    Client to send jobs to the analysis daemon.
+    """
+
+    def __init__(self, settings: dotsi.Dict) -> None:
+        """
+        Daemon client initialisation.
+        Args:
+            settings:   Application settings.
+        """
+
+        # Initialise application settings to use.
+        self._settings = settings
+
+    def _connect(self) -> socket.socket:
+        """
+        Function to connect to the daemon.
+        Returns:
+            Connected socket.
+        """
+
+        if hasattr(socket, "AF_UNIX"):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            address = self._settings.daemon.SOCKET
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            address = (self._settings.daemon.HOST, self._settings.daemon.PORT)
+        sock.settimeout(self._settings.daemon.TIMEOUT)
+        sock.connect(address)
+
+        return sock
+
+    def request(self, job: dict) -> Iterator[dotsi.Dict]:
+        """
+        Function to send a job to the daemon, and get the results.
+        Args:
+            job:    Job request.
+        Returns:
+            Iterator of results, as they are streamed back.
+        """
+
+        with self._connect() as sock:
+            sock.sendall((json.dumps(job) + "\n").encode("utf8"))
+            with sock.makefile("r", encoding="utf8") as results:
+                for line in results:
+                    result = json.loads(line)
+                    if result.get("done"):
+                        return
+                    yield dotsi.Dict(result)
+
+    def available(self) -> bool:
+        """
+        Function to check if the daemon is running.
+        Returns:
+            True if the daemon responds.
+        """
+
+        try:
+            return any(result.get("pong") for result in list(self.request({"job": "ping"})))
+        except OSError:
+            return False
+
+    def analysis_settings(self) -> dict:
+        """
+        Function to get the current analysis settings, to send with jobs,
+        so that changes to the settings since the daemon started are used.
+        Returns:
+            Dictionary of the analysis settings sections.
+        """
+
+        return {section: dict(self._settings[section]) for section in ANALYSIS_SECTIONS}
+
+    def file_job(self, job: str, s_file: str) -> Optional[dotsi.Dict]:
+        """
+        Function to run a job on a sound file by the daemon, with the current analysis settings.
+        Args:
+            job:    Name of the job, one of the file jobs.
+            s_file: Filename of the sound sample file.
+        Returns:
+            Job results, or None if no result.
+        """
+
+        request = {"job": job, "file": os.path.abspath(s_file), "settings": self.analysis_settings()}
+
+        return next(self.request(request), None)
+
+    def analyse(self, s_file: str) -> Optional[dotsi.Dict]:
+        """
+        Function to analyse a sound file by the daemon, with the current analysis settings.
+        Args:
+            s_file: Filename of the sound sample file to analyse.
+        Returns:
+            Analysis results, or None if no result.
+        """
+
+        return self.file_job("analyse", s_file)
+
+    def record(self, secs: float) -> Optional[dotsi.Dict]:
+        """
+        Function to record a sound sample by the daemon.
+        Args:
+            secs:   Duration of the recording (seconds).
+        Returns:
+            Result with the absolute file name of the recording, or None if no result.
+        """
+
+        return next(self.request({"job": "record", "secs": secs}), None)
+
+
+def run() -> None:
+    """
+    Poetry calls this to get the analysis daemon up and running.
+    Assumes a python script as follows:
+
+    [tool.poetry.scripts]
+    sounder-daemon = "sounder.daemon:run"
+    """
+
+    # Load application settings, and setup the daemon logger.
+    settings = dotsi.Dict(app_settings.load())
+    app_logging.setup_logging(settings.app.APP_NAME, settings, settings.daemon.LOG_FILE)
+
+    try:
+        daemon = AnalysisDaemon(settings)
+    except OSError as ex:
+        # Already running, or the socket could not be served.
+        log.error(f"Unable to start analysis daemon - {ex}")
+        return
+
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.shutdown()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,388 @@
+"""
+Functions to analyse a sounder recording file without plotting,
+for use by the plotting functions and headless analysis.
+
+Analysis is done in stages:
+    load -> trim -> spectrum -> band -> smooth -> peak -> harmonics
+                            -> semitone
+         -> notes
+         -> meter
+The output of each stage is memoized, keyed on the inputs to the stage
+(the upstream stage and the settings the stage uses), so that after a
+settings change only the stages downstream of the change are rerun.
+"""
+
+from collections import OrderedDict
+import logging
+import os
+from typing import Any, Callable, Optional
+
+import dotsi  # type: ignore
+import numpy as np  # type: ignore
+
+import sounder.harmonics as harmonics
+import sounder.meter as meter
+import sounder.onsets as onsets
+import sounder.semitone as semitone
+import sounder.sound_analysis as sa
+import sounder.trim as trim
+import sounder.welch as welch
+
+log = logging.getLogger(__name__)
+
+
+class AnalysisPipeline:
+    """
+    Staged analysis of sound files, memoizing the output of each stage.
+    Stage outputs are shared, so must not be modified by the caller.
+    """
+
+    def __init__(self, max_entries: int = 32) -> None:
+        """
+        Analysis pipeline initialisation.
+        Args:
+            max_entries:    Number of stage outputs to keep,
+                            least recently used are dropped first.
+        """
+
+        self._max_entries = max_entries
+        self._cache: OrderedDict[tuple, Any] = OrderedDict()
+
+    def _stage(self, key: tuple, func: Callable[[], Any]) -> Any:
+        """
+        Function to get the output of a stage, running it if not memoized.
+        Args:
+            key:    Stage name and inputs.
+            func:   Function to run the stage.
+        Returns:
+            Output of the stage.
+        """
+
+        # Use the memoized output if there is one.
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        log.info(f"Running analysis stage: {key[0]}")
+        output = func()
+
+        # Keep the output, dropping the least recently used if too many.
+        self._cache[key] = output
+        if len(self._cache) > self._max_entries:
+            self._cache.popitem(last=False)
+
+        return output
+
+    def load(self, s_file: str) -> tuple[tuple, tuple[int, np.ndarray]]:
+        """
+        Load stage, reading the sound file.
+        Keyed on the file, and when it was last modified.
+        Args:
+            s_file: Filename of the sound sample file.
+        Returns:
+            Tuple of the stage key, and the stage output of
+            sample rate and single channel sound samples.
+        """
+
+        # A file that has changed since it was loaded is loaded again.
+        stat = os.stat(s_file)
+        key = ("load", os.path.abspath(s_file), stat.st_mtime_ns, stat.st_size)
+
+        def run() -> tuple[int, np.ndarray]:
+            # Memory mapped if possible, so that samples are only read as they are converted.
+            sample_rate, sound_data = sa.read_wav(s_file)
+            return sample_rate, sa.first_channel(sound_data)
+
+        return key, self._stage(key, run)
+
+    def trim(self, s_file: str, settings: dotsi.Dict) -> tuple[tuple, tuple[int, int]]:
+        """
+        Trim stage, finding the active region of the recording.
+        Args:
+            s_file:     Filename of the sound sample file.
+            settings:   Application settings.
+        Returns:
+            Tuple of the stage key, and the stage output of the
+            start and end (exclusive) sample indexes of the region.
+        """
+
+        load_key, (sample_rate, sound_data) = self.load(s_file)
+        key = ("trim", load_key, settings.sound.BURN_SECS, tuple(settings.trim.items()))
+
+        def run() -> tuple[int, int]:
+            # Whether the start is burnt depends on how the file was recorded.
+            return trim.active_region(sound_data, sample_rate, settings, sa.has_pre_roll(s_file))
+
+        return key, self._stage(key, run)
+
+    def spectrum(self, s_file: str, settings: dotsi.Dict) -> tuple[tuple, tuple[float, np.ndarray]]:
+        """
+        Spectrum stage, transforming the active region of the recording
+        to the power spectrum (dB).
+        Only the spacing of the points is kept, not a frequency array.
+        Args:
+            s_file:     Filename of the sound sample file.
+            settings:   Application settings.
+        Returns:
+            Tuple of the stage key, and the stage output of the
+            frequency spacing of the points (Hz) and the power array (dB).
+        """
+
+        load_key, (sample_rate, sound_data) = self.load(s_file)
+        trim_key, (start, end) = self.trim(s_file, settings)
+        if end <= start:
+            raise ValueError(f"No samples to analyse in sound file: {s_file}")
+
+        # Only averaged over segments split across processes if that mode is chosen,
+        # and there is at least one whole segment.
+        use_welch = settings.welch.ENABLED and end - start >= settings.welch.SEG_SIZE
+        welch_key = (settings.welch.SEG_SIZE, settings.welch.OVERLAP) if use_welch else None
+        key = ("spectrum", trim_key, settings.sound.FFT_DTYPE, welch_key)
+
+        def run() -> tuple[float, np.ndarray]:
+            if use_welch:
+                freq_array, power = welch.welch_power(s_file, start, end, sample_rate, settings)
+                return sa.bin_spacing(freq_array), power
+            # Otherwise sound array is converted to float array as part of a single FFT.
+            # Own workspace rather than one kept for reuse, so its power array is
+            # handed to the stage, and its scratch samples freed, not held idle.
+            workspace = sa.SpectrumWorkspace(end - start, settings.sound.FFT_DTYPE)
+            return sample_rate / (end - start), workspace.power(sound_data[start:end])
+
+        return key, self._stage(key, run)
+
+    def band(self, s_file: str, settings: dotsi.Dict) -> tuple[tuple, tuple[np.ndarray, np.ndarray]]:
+        """
+        Band stage, taking the portion of the spectrum of interest.
+        Args:
+            s_file:     Filename of the sound sample file.
+            settings:   Application settings.
+        Returns:
+            Tuple of the stage key, and the stage output of the
+            frequency array (Hz) and the power array (dB) of the band.
+        """
+
+        spectrum_key, (bin_hz, power) = self.spectrum(s_file, settings)
+        key = ("band", spectrum_key, settings.sound.FFT_MIN_HZ, settings.sound.FFT_MAX_HZ)
+
+        def run() -> tuple[np.ndarray, np.ndarray]:
+            # Frequency array of only the band, and a view of the power, no need to copy.
+            lower, upper = sa.band_bins(bin_hz, len(power), settings.sound.FFT_MIN_HZ, settings.sound.FFT_MAX_HZ)
+            return np.arange(lower, upper) * bin_hz, power[lower:upper]
+
+        return key, self._stage(key, run)
+
+    def smooth(self, s_file: str, settings: dotsi.Dict) -> tuple[tuple, np.ndarray]:
+        """
+        Smooth stage, calculating the moving average of the band.
+        Args:
+            s_file:     Filename of the sound sample file.
+            settings:   Application settings.
+        Returns:
+            Tuple of the stage key, and the stage output of the
+            moving average of the power array (dB) of the band.
+        """
+
+        _, (bin_hz, _) = self.spectrum(s_file, settings)
+        band_key, (_, power) = self.band(s_file, settings)
+        key = ("smooth", band_key, settings.sound.FFT_AVG_HZ)
+
+        # Smoothing window is in Hz, so the same for any spectrum resolution.
+        window = sa.window_bins(bin_hz, settings.sound.FFT_AVG_HZ)
+
+        return key, self._stage(key, lambda: sa.moving_average(power, window))
+
+    def peak(self, s_file: str, settings: dotsi.Dict) -> tuple[tuple, dotsi.Dict]:
+        """
+        Peak stage, finding the peak of the smoothed band, refined to
+        the interpolated peak of the band, and the note it is closest to.
+        Args:
+            s_file:     Filename of the sound sample file.
+            settings:   Application settings.
+        Returns:
+            Tuple of the stage key, and the stage output of
+            dictionary of the peak.
+        """
+
+        _, (bin_hz, _) = self.spectrum(s_file, settings)
+        _, (freq_array, power) = self.band(s_file, settings)
+        smooth_key, smoothed = self.smooth(s_file, settings)
+        key = ("peak", smooth_key)
+
+        def run() -> dotsi.Dict:
+            # Peak of the smoothed band, refined on the band itself.
+            window = sa.window_bins(bin_hz, settings.sound.FFT_AVG_HZ)
+            peak_freq, peak_power = sa.peak_frequency(freq_array, power, smoothed, window)
+            note, cents = sa.nearest_note(peak_freq)
+            return dotsi.Dict({"peak_freq": peak_freq, "peak_power": peak_power, "note": note, "cents": cents})
+
+        return key, self._stage(key, run)
+
+    def harmonics(self, s_file: str, settings: dotsi.Dict) -> tuple[tuple, dotsi.Dict]:
+        """
+        Harmonics stage, analysing the partials of the peak over the
+        whole spectrum, as the partials go above the band.
+        Args:
+            s_file:     Filename of the sound sample file.
+            settings:   Application settings.
+        Returns:
+            Tuple of the stage key, and the stage output of
+            dictionary of the harmonic analysis.
+        """
+
+        _, (bin_hz, power) = self.spectrum(s_file, settings)
+        peak_key, peak = self.peak(s_file, settings)
+        key = ("harmonics", peak_key, tuple(settings.harmonics.items()))
+
+        return key, self._stage(key, lambda: harmonics.analyse_harmonics(bin_hz, power, peak.peak_freq, settings))
+
+    def semitone(self, s_file: str, settings: dotsi.Dict) -> tuple[tuple, tuple[np.ndarray, np.ndarray]]:
+        """
+        Semitone stage, calculating the semitone spectrum over the band.
+        Args:
+            s_file:     Filename of the sound sample file.
+            settings:   Application settings.
+        Returns:
+            Tuple of the stage key, and the stage output of the
+            band centre frequencies (Hz) and band power (dB).
+        """
+
+        spectrum_key, (bin_hz, power) = self.spectrum(s_file, settings)
+        key = (
+            "semitone",
+            spectrum_key,
+            settings.sound.FFT_MIN_HZ,
+            settings.sound.FFT_MAX_HZ,
+            settings.semitone.BINS_PER_SEMITONE,
+        )
+
+        return key, self._stage(key, lambda: semitone.semitone_spectrum(bin_hz, power, settings))
+
+    def notes(self, s_file: str, settings: dotsi.Dict) -> tuple[tuple, list[dotsi.Dict]]:
+        """
+        Notes stage, splitting the recording into notes and analysing each note.
+        Args:
+            s_file:     Filename of the sound sample file.
+            settings:   Application settings.
+        Returns:
+            Tuple of the stage key, and the stage output of
+            list of note analysis dictionaries.
+        """
+
+        load_key, (sample_rate, sound_data) = self.load(s_file)
+        key = (
+            "notes",
+            load_key,
+            tuple(settings.onset.items()),
+            tuple(settings.harmonics.items()),
+            settings.sound.FFT_MIN_HZ,
+            settings.sound.FFT_MAX_HZ,
+            settings.sound.FFT_DTYPE,
+        )
+
+        return key, self._stage(key, lambda: onsets.analyse_note_data(sound_data, sample_rate, settings))
+
+    def meter(self, s_file: str, settings: dotsi.Dict) -> tuple[tuple, dotsi.Dict]:
+        """
+        Meter stage, metering the level and loudness of the whole recording.
+        Args:
+            s_file:     Filename of the sound sample file.
+            settings:   Application settings.
+        Returns:
+            Tuple of the stage key, and the stage output of
+            dictionary of the meter results.
+        """
+
+        load_key, (sample_rate, sound_data) = self.load(s_file)
+        key = ("meter", load_key, tuple(settings.meter.items()))
+
+        return key, self._stage(key, lambda: meter.meter_data(sound_data, sample_rate, settings))
+
+
+# Pipeline used if one is not given, so stage outputs are kept between calls.
+_pipeline = AnalysisPipeline()
+
+
+def default_pipeline() -> AnalysisPipeline:
+    """
+    Function to get the pipeline used if one is not given.
+    Returns:
+        Default analysis pipeline.
+    """
+
+    return _pipeline
+
+
+def analyse_file(s_file: str, settings: dotsi.Dict, pipeline: Optional[AnalysisPipeline] = None) -> dotsi.Dict:
+    """
+    Function to analyse the frequency spectrum of a sound sample file.
+    Analysis is FFT so for best results want sound sample
+    to be constant in the frequency domain.
+    Args:
+        s_file:     Filename of the sound sample file to analyse.
+        settings:   Application settings.
+        pipeline:   Analysis pipeline to use, the default pipeline if None.
+    Returns:
+        Dictionary of the analysis, including the frequency, power and
+        smoothed power arrays for the band of interest, the semitone
+        spectrum, the peak, and the harmonics of the peak.
+    """
+
+    log.info(f"Analysing sound recording of file: {s_file}")
+
+    pipeline = pipeline or _pipeline
+
+    # Run the stages, only those with changed inputs are rerun.
+    _, (freq_array, power) = pipeline.band(s_file, settings)
+    _, smoothed = pipeline.smooth(s_file, settings)
+    _, peak = pipeline.peak(s_file, settings)
+    _, (semitone_freq, semitone_power) = pipeline.semitone(s_file, settings)
+    harmonic_analysis = pipeline.harmonics(s_file, settings)[1] if settings.harmonics.ENABLED else None
+
+    return dotsi.Dict(
+        {
+            "freq_array": freq_array,
+            "power": power,
+            "smoothed": smoothed,
+            "semitone_freq": semitone_freq,
+            "semitone_power": semitone_power,
+            "harmonics": harmonic_analysis,
+            **peak,
+        }
+    )
+
+
+def analyse_notes(s_file: str, settings: dotsi.Dict, pipeline: Optional[AnalysisPipeline] = None) -> list[dotsi.Dict]:
+    """
+    Function to split a sound sample file into notes and analyse each note.
+    Args:
+        s_file:     Filename of the sound sample file to analyse.
+        settings:   Application settings.
+        pipeline:   Analysis pipeline to use, the default pipeline if None.
+    Returns:
+        List of note analysis dictionaries, in order of note start.
+    """
+
+    log.info(f"Analysing notes in sound recording of file: {s_file}")
+
+    _, notes = (pipeline or _pipeline).notes(s_file, settings)
+
+    return notes
+
+
+def analyse_levels(s_file: str, settings: dotsi.Dict, pipeline: Optional[AnalysisPipeline] = None) -> dotsi.Dict:
+    """
+    Function to meter the level and loudness of a sound sample file.
+    Args:
+        s_file:     Filename of the sound sample file to meter.
+        settings:   Application settings.
+        pipeline:   Analysis pipeline to use, the default pipeline if None.
+    Returns:
+        Dictionary of the meter results, with an array of each measure by block.
+    """
+
+    log.info(f"Metering levels in sound recording of file: {s_file}")
+
+    _, levels = (pipeline or _pipeline).meter(s_file, settings)
+
+    return levels
@@ -0,0 +1,157 @@
+"""
+Functions to analyse the harmonic partials of a note.
+For a fundamental, the spectrum is searched around each of the expected
+partial frequencies (a comb at multiples of the fundamental) in a single
+indexing operation, and each partial peak is refined by parabolic
+interpolation.
+The partial frequencies are fitted to the stiff string model
+f(n) = n * f0 * sqrt(1 + B * n^2), giving the inharmonicity coefficient B,
+and the total harmonic distortion is calculated from the partial powers.
+"""
+
+import logging
+from math import ceil
+
+import dotsi  # type: ignore
+import numpy as np  # type: ignore
+
+log = logging.getLogger(__name__)
+
+# Number of points of the spectrum sampled for the noise floor.
+NOISE_POINTS = 65536
+
+
+def partial_peaks(
+    bin_hz: float, power: np.ndarray, fundamental: float, num_partials: int, search_cents: float
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Function to find the peaks of the partials of a fundamental.
+    Each partial is searched for within a window either side of
+    the multiple of the fundamental, all partials at once.
+    Args:
+        bin_hz:         Frequency spacing of the power spectrum points (Hz), from 0 Hz.
+        power:          Power array (dB).
+        fundamental:    Fundamental frequency (Hz).
+        num_partials:   Number of partials, including the fundamental.
+        search_cents:   Distance to search either side of each partial (cents).
+    Returns:
+        Tuple of the partial numbers, and the interpolated frequencies (Hz)
+        and power (dB) of each partial found within the spectrum.
+    """
+
+    # Expected partial frequencies, and half width of the search windows in bins.
+    numbers = np.arange(1, num_partials + 1)
+    expected = numbers * fundamental / bin_hz
+    half_width = np.maximum(expected * (2.0 ** (search_cents / 1200) - 1), 1.0)
+    width = int(ceil(half_width.max()))
+
+    # Only the partials with search windows within the spectrum.
+    keep = np.rint(expected) + width < len(power) - 1
+    numbers, expected, half_width = numbers[keep], expected[keep], half_width[keep]
+    if len(numbers) == 0:
+        return numbers, np.empty(0), np.empty(0)
+
+    # Index window over the spectrum for every partial, as one array.
+    # Bins beyond each partial's own search width are masked out.
+    offsets = np.arange(-width, width + 1)
+    idx = np.rint(expected).astype(int)[:, np.newaxis] + offsets
+    np.clip(idx, 1, len(power) - 2, out=idx)
+    windows = np.where(np.abs(offsets) <= half_width[:, np.newaxis], power[idx], -np.inf)
+
+    # Peak bin of each partial.
+    peak_idx = idx[np.arange(len(idx)), np.argmax(windows, axis=1)]
+
+    # Refine by fitting a parabola through the peak bin and its neighbours.
+    alpha = power[peak_idx - 1].astype(np.float64)
+    beta = power[peak_idx].astype(np.float64)
+    gamma = power[peak_idx + 1].astype(np.float64)
+    denom = alpha - 2 * beta + gamma
+    delta = np.divide(0.5 * (alpha - gamma), denom, out=np.zeros_like(denom), where=denom < 0)
+
+    return numbers, (peak_idx + delta) * bin_hz, beta - 0.25 * (alpha - gamma) * delta
+
+
+def fit_inharmonicity(numbers: np.ndarray, freqs: np.ndarray) -> tuple[float, float]:
+    """
+    Function to fit partial frequencies to the stiff string model.
+    Squaring f(n) / n = f0 * sqrt(1 + B * n^2) gives a straight line
+    (f(n) / n)^2 = f0^2 + f0^2 * B * n^2, fitted by least squares.
+    Args:
+        numbers:    Partial numbers.
+        freqs:      Frequencies of the partials (Hz).
+    Returns:
+        Tuple of the fitted fundamental frequency (Hz) and the
+        inharmonicity coefficient, which is 0 if fewer than 2 partials.
+    """
+
+    if len(numbers) < 2:
+        return float(freqs[0] / numbers[0]), 0.0
+
+    slope, intercept = np.polyfit(numbers.astype(np.float64) ** 2, (freqs / numbers) ** 2, 1)
+
+    return float(np.sqrt(intercept)), float(slope / intercept)
+
+
+def total_harmonic_distortion(numbers: np.ndarray, partial_power: np.ndarray) -> float:
+    """
+    Function to calculate the total harmonic distortion of the partials,
+    as the ratio of the amplitude of the harmonics to the fundamental.
+    Args:
+        numbers:        Partial numbers.
+        partial_power:  Power of each partial (dB).
+    Returns:
+        Total harmonic distortion ratio.
+    """
+
+    linear = np.power(10.0, partial_power / 10.0)
+
+    return float(np.sqrt(linear[numbers > 1].sum() / linear[numbers == 1].sum()))
+
+
+def analyse_harmonics(bin_hz: float, power: np.ndarray, fundamental: float, settings: dotsi.Dict) -> dotsi.Dict:
+    """
+    Function to analyse the partials of a fundamental.
+    Args:
+        bin_hz:         Frequency spacing of the power spectrum points (Hz), from 0 Hz.
+        power:          Power array (dB).
+        fundamental:    Fundamental frequency (Hz).
+        settings:       Application settings.
+    Returns:
+        Dictionary of the harmonic analysis, including the partial
+        frequencies and power as lists, so it can be sent as JSON.
+        No partials, inharmonicity or THD if the fundamental is not
+        above the noise floor.
+    """
+
+    no_partials = dotsi.Dict({"partials": [], "partial_power": [], "fit_f0": None, "inharmonicity": None, "thd": None})
+    if fundamental <= 0:
+        return no_partials
+
+    numbers, freqs, partial_power = partial_peaks(
+        bin_hz, power, fundamental, settings.harmonics.NUM_PARTIALS, settings.harmonics.SEARCH_CENTS
+    )
+
+    # Noise floor from the median of a sample of the spectrum points,
+    # and only the partials above it, if the fundamental is.
+    noise_floor = float(np.median(power[:: max(1, len(power) // NOISE_POINTS)]))
+    above = partial_power > noise_floor + settings.harmonics.ABOVE_NOISE_DB
+    if not above[numbers == 1].any():
+        log.debug(f"Fundamental {fundamental:.1f}Hz not above the noise floor.", extra={"stage": "harmonics"})
+        return no_partials
+    numbers, freqs, partial_power = numbers[above], freqs[above], partial_power[above]
+
+    # Only fit the partials strong enough to be above the noise.
+    strong = partial_power >= partial_power.max() - settings.harmonics.FIT_DB
+    fit_f0, inharmonicity = fit_inharmonicity(numbers[strong], freqs[strong])
+    thd = total_harmonic_distortion(numbers, partial_power)
+    log.debug(f"Harmonics of {fundamental:.1f}Hz, B {inharmonicity:.2e}, THD {thd:.3f}.", extra={"stage": "harmonics"})
+
+    return dotsi.Dict(
+        {
+            "partials": freqs.tolist(),
+            "partial_power": partial_power.tolist(),
+            "fit_f0": fit_f0,
+            "inharmonicity": inharmonicity,
+            "thd": thd,
+        }
+    )
@@ -10,28 +10,65 @@ sudo apt install python3-pyaudio
 from datetime import datetime
 import logging
 from time import sleep
-from typing import Optional
+from typing import Callable, Optional
 
 import dotsi  # type: ignore
-from scipy.io.wavfile import write  # type: ignore
+import numpy as np  # type: ignore
 import sounddevice as sd  # type: ignore
 import soundfile as sf  # type: ignore
 
+from sounder import audio_io
+from sounder import compare
+from sounder import daemon
 from sounder import std_io as io
+from sounder import tuner
+import sounder.file_analysis as fa
 import sounder.progress as prog
+import sounder.sound_analysis as sa
 import sounder.sound_plot as splot
 
+# Analysis settings that can be changed from the menu.
+ANALYSIS_SETTINGS = ["FFT_MIN_HZ", "FFT_MAX_HZ", "FFT_AVG_HZ", "PLOT_1ST_OCT", "PLOT_OCTAVES"]
+
 MENU_ITEMS = {
     1: "Record sample",
     2: "Load sample",
     3: "Play sample",
     4: "Analyse sample",
-    5: "Exit",
+    5: "Analyse notes",
+    6: "Compare samples",
+    7: "Analysis settings",
+    8: "Measure latency",
+    9: "Tuner",
+    10: "Meter levels",
+    11: "Exit",
 }
 
 log = logging.getLogger(__name__)
 
 
+def analysis_settings_error(settings: dotsi.Dict) -> Optional[str]:
+    """
+    Function to check the analysis settings leave a band of the spectrum to analyse.
+    Args:
+        settings:   Application settings.
+    Returns:
+        Description of what is wrong with the settings, None if they are valid.
+    """
+
+    sound = settings.sound
+    if sound.FFT_MIN_HZ < 0:
+        return "FFT_MIN_HZ must not be negative"
+    if sound.FFT_MIN_HZ >= sound.FFT_MAX_HZ:
+        return "FFT_MIN_HZ must be below FFT_MAX_HZ"
+    if sound.FFT_MIN_HZ >= sound.SAMPLE_RATE / 2:
+        return f"FFT_MIN_HZ must be below {sound.SAMPLE_RATE / 2:g}Hz, half the sample rate"
+    if sound.FFT_AVG_HZ <= 0:
+        return "FFT_AVG_HZ must be above 0"
+
+    return None
+
+
 class AppMenu:
     """
     Main Class for application.
@@ -59,6 +96,21 @@ class AppMenu:
         # Sounder variables.
         self._sound_file: Optional[str] = None
 
+        # Armed recorder, keeping the input stream open, if using it.
+        # Not armed if recording by the daemon, which has the input device.
+        self._recorder: Optional[audio_io.ArmedRecorder] = None
+        if settings.capture.ARMED and not settings.daemon.USE_DAEMON:
+            try:
+                recorder = audio_io.ArmedRecorder(settings)
+                recorder.start()
+                self._recorder = recorder
+            except sd.PortAudioError as ex:
+                # Audio device could not be opened; record unarmed instead.
+                log.warning(f"Error opening audio input for armed recorder, recording unarmed - {ex}")
+
+        # Client of the analysis daemon, if using it.
+        self._daemon = daemon.DaemonClient(settings) if settings.daemon.USE_DAEMON else None
+
         # Start main menu function running.
         self.run()
 
@@ -101,7 +153,27 @@ class AppMenu:
                 self.analyse_sample()
                 self.app_io.app_out("")
             elif option == "5":
+                self.analyse_notes()
+                self.app_io.app_out("")
+            elif option == "6":
+                self.compare_samples()
+                self.app_io.app_out("")
+            elif option == "7":
+                self.analysis_settings()
+                self.app_io.app_out("")
+            elif option == "8":
+                self.measure_latency()
+                self.app_io.app_out("")
+            elif option == "9":
+                self.run_tuner()
+                self.app_io.app_out("")
+            elif option == "10":
+                self.meter_levels()
+                self.app_io.app_out("")
+            elif option == "11":
                 self.stay_alive = False
+                if self._recorder:
+                    self._recorder.stop()
                 log.info("Stopping application command menu.")
             else:
                 self.app_io.app_out("Invalid selection.")
@@ -117,36 +189,48 @@ class AppMenu:
 
         log.info("User selection to record sound sample.")
 
-        # Calculate number of samples.
-        num_samples = int(self._settings.sound.SAMPLE_RATE * self._settings.sound.SAMPLE_DUR)
-
-        # Start recorder with the given values of duration and sample frequency.
-        # Note only recording 1 channel (the left) if more than 1 channel available.
-        recording = sd.rec(num_samples, samplerate=self._settings.sound.SAMPLE_RATE, channels=1)
-
-        # Record audio for the given number of seconds.
-        # First initialise a progress bar so that user can
-        # see progress of the recording.
-        pb = prog.CLI_PROGRESS(self._settings, "Recording")
-
-        # Progress bar accepts progress in integer percents,
-        # so loop from 0 to 100 percent.
-        for idx in range(101):
-            # Show the current progress.
-            pb.show_progress(idx)
-            # Wait 1 percent of the recording duration.
-            sleep(self._settings.sound.SAMPLE_DUR / 100)
+        # Record by the analysis daemon if it is running.
+        result = self._daemon_job(lambda client: client.record(self._settings.sound.SAMPLE_DUR))
+        if result:
+            self._sound_file = result.file
+            splot.plot_wav_file(self._sound_file, self._settings)
+            return
 
-        # Make sure that the recording is complete.
-        # If not quite complete this will block until done.
-        sd.wait()
+        # Otherwise record from the armed recorder if there is one.
+        # Recording starts immediately, with the pre-roll from before now.
+        pre_roll = self._recorder is not None
+        if self._recorder:
+            pb = prog.CLI_PROGRESS(self._settings, "Recording")
+            try:
+                recording = self._recorder.record(self._settings.sound.SAMPLE_DUR, progress=pb.show_progress)
+            except ValueError as ex:
+                # No sample duration, or recording and pre-roll don't fit in the capture buffer,
+                # or were overwritten.
+                log.warning(f"Error recording from armed recorder - {ex}")
+                self.app_io.app_out(
+                    "Error recording; sample duration must be above 0, and with the pre-roll "
+                    "fit within the capture buffer.",
+                    True,
+                )
+                return
+            except TimeoutError as ex:
+                # Input stream stopped, such as the device being unplugged.
+                log.warning(f"Error recording from armed recorder - {ex}")
+                self.app_io.app_out("Error recording; no input from the audio device.", True)
+                return
+        else:
+            # Otherwise open the input stream for the recording.
+            # Show a progress bar so that user can see progress of the recording.
+            pb = prog.CLI_PROGRESS(self._settings, "Recording")
+            recording = audio_io.record_stream(self._settings, self._settings.sound.SAMPLE_DUR, pb.show_progress)
 
         # Now convert the NumPy array to an audio
         # file with the given sampling frequency.
         # Create the filename form the date and time.
         self._sound_file = f"sounder-{datetime.now().strftime('%Y%m%d%H%M%S')}.wav"
 
-        write(self._sound_file, self._settings.sound.SAMPLE_RATE, recording)
+        # Armed recordings are tagged as starting with the pre-roll.
+        sa.write_wav(self._sound_file, self._settings.sound.SAMPLE_RATE, recording, pre_roll)
 
         # Plot the file.
         splot.plot_wav_file(self._sound_file, self._settings)
@@ -191,7 +275,7 @@ class AppMenu:
         rec_duration = len(sound_data) / sample_rate
 
         # Play the sound sample.
-        sd.play(sound_data, sample_rate)
+        sd.play(sound_data, sample_rate, **audio_io.stream_kwargs(self._settings))
 
         # First initialise a progress bar so that user can
         # see progress of the playback.
@@ -221,6 +305,270 @@ class AppMenu:
             # Perform sound analysis.
             # Only interested in section of the frequency spectrum for analysis.
             # In settings can nominate min/max depending on instrument.
-            splot.analyse_wav_file(self._sound_file, self._settings)
+            try:
+                splot.analyse_wav_file(self._sound_file, self._settings)
+            except (FileNotFoundError, ValueError) as ex:
+                # Sound file could not be found or not a wav file; log a warning.
+                log.warning(f"Error opening sound file: {self._sound_file} - {ex}")
+                self.app_io.app_out("Error opening sound file.", True)
+        else:
+            self.app_io.app_out("No sound file to analyse.", True)
+
+    def analyse_notes(self) -> None:
+        """
+        Function to split the previously recorded or loaded sound sample
+        into individual notes, and analyse each note.
+        A table of the analysis of each note is output.
+        """
+
+        # Check if there is a file to analyse first.
+        if self._sound_file:
+            log.info(f"User selection to analyse notes in sound sample: {self._sound_file}")
+            s_file = self._sound_file
+
+            # Perform the note analysis.
+            # Use the analysis daemon if it is running, otherwise analyse locally.
+            try:
+                result = self._daemon_job(lambda client: client.file_job("notes", s_file))
+                notes = result.notes if result else fa.analyse_notes(self._sound_file, self._settings)
+            except (FileNotFoundError, ValueError) as ex:
+                # Sound file could not be found or not a wav file; log a warning.
+                log.warning(f"Error opening sound file: {self._sound_file} - {ex}")
+                self.app_io.app_out("Error opening sound file.", True)
+                return
+
+            # Output table of the notes found.
+            # Include the inharmonicity and THD if the harmonics were analysed.
+            self.app_io.app_out(
+                f"{'Start (s)':>10}{'End (s)':>10}{'Freq (Hz)':>12}{'Note':>6}{'Cents':>8}{'Inharm B':>11}{'THD %':>8}"
+            )
+            for note in notes:
+                harmonic_text = ""
+                if note.get("harmonics") and note.harmonics.inharmonicity is not None:
+                    harmonic_text = f"{note.harmonics.inharmonicity:>11.2e}{note.harmonics.thd * 100:>8.1f}"
+                self.app_io.app_out(
+                    f"{note.start:>10.2f}{note.end:>10.2f}{note.freq:>12.1f}{note.note:>6}{note.cents:>+8.1f}"
+                    + harmonic_text
+                )
         else:
             self.app_io.app_out("No sound file to analyse.", True)
+
+    def _daemon_job(self, job: Callable[[daemon.DaemonClient], Optional[dotsi.Dict]]) -> Optional[dotsi.Dict]:
+        """
+        Function to run a job by the analysis daemon.
+        Args:
+            job:    Function to send the job by the daemon client.
+        Returns:
+            Result of the job, None if not using the daemon,
+            or it is not running, could not be reached or failed.
+        """
+
+        if self._daemon is None:
+            return None
+
+        try:
+            if not self._daemon.available():
+                return None
+            result = job(self._daemon)
+        except OSError as ex:
+            # Daemon timed out or the connection failed; log a warning.
+            log.warning(f"Analysis daemon failed, analysing locally - {ex}")
+            return None
+
+        # Daemon failed the job, or gave no result; log a warning.
+        # Running locally reports any errors in the sound file itself.
+        if not result or "error" in result:
+            error = result.get("error") if result else "no result"
+            log.warning(f"Analysis daemon failed, running locally - {error}")
+            return None
+
+        return result
+
+    def compare_samples(self) -> None:
+        """
+        Function to compare sound samples against a reference sample.
+        The previously recorded or loaded sound sample is the reference,
+        and the user is prompted for the samples to compare with it.
+        A table of the peak and note shifts is output, and the
+        comparison is plotted.
+        """
+
+        # Check if there is a file to compare against first.
+        if not self._sound_file:
+            self.app_io.app_out("No sound file to compare against.", True)
+            return
+
+        log.info(f"User selection to compare sound samples against: {self._sound_file}")
+
+        # Prompt the user for the sound samples to compare, until none entered.
+        s_files = [self._sound_file]
+        while True:
+            self.app_io.app_out("\nCompare with sound file (blank to finish) : ", False)
+            sound_file = self.app_io.app_in()
+            if not sound_file or not sound_file.strip():
+                break
+            s_files.append(sound_file.strip())
+
+        if len(s_files) < 2:
+            self.app_io.app_out("No sound files to compare.", True)
+            return
+
+        # Perform the comparison.
+        try:
+            comparisons = compare.compare_files(s_files, self._settings)
+        except (FileNotFoundError, ValueError) as ex:
+            # Sound file could not be found or not a wav file; log a warning.
+            log.warning(f"Error comparing sound files: {s_files} - {ex}")
+            self.app_io.app_out("Error comparing sound files.", True)
+            return
+
+        # Output table of the shifts from the reference.
+        for comparison in comparisons[1:]:
+            self.app_io.app_out(
+                f"\n{comparison.file} : offset {comparison.offset:+.3f}s, peak shift {comparison.peak_shift:+.1f} cents"
+            )
+            for note in comparison.notes:
+                self.app_io.app_out(f"{note.start:>10.2f}{note.ref_note:>6}{note.shift:>+8.1f}")
+
+        # Plot the comparison.
+        splot.plot_comparison(comparisons, self._settings)
+
+    def analysis_settings(self) -> None:
+        """
+        Function to allow user to change the sound analysis settings.
+        Each setting is prompted for, showing the current value,
+        and is left unchanged if nothing is entered.
+        Only the analysis stages affected by a change are rerun
+        when the sample is next analysed.
+        """
+
+        log.info("User selection to change analysis settings.")
+
+        for name in ANALYSIS_SETTINGS:
+            # Prompt the user for the new value.
+            self.app_io.app_out(f"{name} ({self._settings.sound[name]}) : ", False)
+            value = self.app_io.app_in()
+            if not value or not value.strip():
+                continue
+
+            # Keep the same type as the current setting.
+            old_value = self._settings.sound[name]
+            try:
+                self._settings.sound[name] = type(old_value)(value.strip())
+            except ValueError:
+                self.app_io.app_out(f"Invalid value for {name}.", True)
+                continue
+
+            # Keep the old setting if the new one leaves nothing to analyse.
+            error = analysis_settings_error(self._settings)
+            if error:
+                self._settings.sound[name] = old_value
+                self.app_io.app_out(f"Invalid value for {name}, {error}.", True)
+                continue
+
+            log.info(f"Analysis setting {name} changed to: {self._settings.sound[name]}")
+
+    def measure_latency(self) -> None:
+        """
+        Function to measure the latency of the audio device with each
+        of the audio profiles.
+        Round trip latency needs the output looped back to the input.
+        """
+
+        log.info("User selection to measure audio latency.")
+
+        self.app_io.app_out(
+            f"{'Profile':>10}{'Block':>7}{'In (ms)':>9}{'Out (ms)':>10}{'Trip (ms)':>11}{'Under':>7}{'Over':>6}"
+        )
+        for profile in self._settings.audio.PROFILES:
+            try:
+                results = audio_io.measure_latency(self._settings, profile)
+            except sd.PortAudioError as ex:
+                # Profile not supported by the audio device; log a warning.
+                log.warning(f"Error measuring latency of profile: {profile} - {ex}")
+                self.app_io.app_out(f"{profile:>10} not supported by audio device.")
+                continue
+
+            # Show no round trip if the pulse was not captured.
+            trip = f"{results.round_trip_ms:.1f}" if results.round_trip_ms is not None else "-"
+            self.app_io.app_out(
+                f"{profile:>10}{results.blocksize:>7}{results.input_ms:>9.1f}{results.output_ms:>10.1f}"
+                f"{trip:>11}{results.underruns:>7}{results.overruns:>6}"
+            )
+
+    def meter_levels(self) -> None:
+        """
+        Function to meter the level and loudness of the previously
+        recorded or loaded sound sample.
+        A summary of the levels, and where the peak is, is output.
+        """
+
+        # Check if there is a file to meter first.
+        if self._sound_file:
+            log.info(f"User selection to meter levels of sound sample: {self._sound_file}")
+            s_file = self._sound_file
+
+            # Use the analysis daemon if it is running, otherwise meter locally.
+            try:
+                result = self._daemon_job(lambda client: client.file_job("meter", s_file))
+                levels = result.levels if result else fa.analyse_levels(self._sound_file, self._settings)
+            except (FileNotFoundError, ValueError) as ex:
+                # Sound file could not be found or not a wav file; log a warning.
+                log.warning(f"Error opening sound file: {self._sound_file} - {ex}")
+                self.app_io.app_out("Error opening sound file.", True)
+                return
+
+            if not len(levels.peak_db):
+                self.app_io.app_out("No samples to meter.", True)
+                return
+
+            # Show no loudness if too short or too quiet to measure.
+            # Block arrays are lists if metered by the daemon.
+            loudness = f"{levels.integrated_lufs:.1f} LUFS" if levels.integrated_lufs is not None else "-"
+            peak_db = np.asarray(levels.peak_db)
+            crest_db = peak_db - np.asarray(levels.rms_db)
+            peak_secs = int(np.argmax(peak_db)) * levels.block_secs
+            self.app_io.app_out(f"Peak level       : {levels.max_peak_db:.1f} dBFS at {peak_secs:.1f}s")
+            self.app_io.app_out(f"RMS level        : {levels.rms_total_db:.1f} dBFS")
+            self.app_io.app_out(f"Max crest factor : {crest_db.max():.1f} dB")
+            self.app_io.app_out(f"Loudness         : {loudness}")
+            self.app_io.app_out(f"Clipped samples  : {levels.total_clips} in {np.count_nonzero(levels.clips)} blocks")
+        else:
+            self.app_io.app_out("No sound file to meter.", True)
+
+    def _render_tuner(self, text: str) -> None:
+        """
+        Function to render the tuner readout in place, through the app output.
+        Args:
+            text:   Tuner readout text.
+        """
+
+        self.app_io.app_out(tuner.in_place(text), False)
+
+    def run_tuner(self) -> None:
+        """
+        Function to show a real time tuner readout of the live input,
+        until the tuner time is up or the user interrupts it.
+        """
+
+        log.info("User selection to run tuner.")
+
+        self.app_io.app_out(f"Tuning for {self._settings.tuner.SECS}s, Ctrl-C to stop.")
+        try:
+            with tuner.Tuner(self._settings) as live_tuner:
+                try:
+                    live_tuner.run(self._settings.tuner.SECS, self._render_tuner)
+                except KeyboardInterrupt:
+                    log.info("Tuner stopped by user.")
+        except sd.PortAudioError as ex:
+            # Audio device could not be opened; log a warning.
+            log.warning(f"Error opening audio input for tuner - {ex}")
+            self.app_io.app_out("Error opening audio input.", True)
+            return
+
+        # Finish the readout line, and show how quickly it updated.
+        self.app_io.app_out("")
+        self.app_io.app_out(
+            f"Updated every {live_tuner.block_secs * 1000:.1f}ms, "
+            f"slowest estimate {live_tuner.max_estimate_secs * 1000:.2f}ms, {live_tuner.overruns} overruns."
+        )
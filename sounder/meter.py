@@ -0,0 +1,356 @@
+"""
+Functions to meter the level and loudness of sounder recordings and
+live input in a single streaming pass.
+Samples are pushed in chunks of any size, and are metered in fixed
+blocks of 100ms (the ITU-R BS.1770 gating step), giving compact arrays
+of the peak, RMS, crest factor, clip count and momentary loudness of
+each block, and the integrated loudness of everything pushed.
+The K-weighting filter state is carried between chunks, so metering
+in chunks gives the same result as metering all the samples at once.
+For live monitoring the meter can keep only the most recent blocks,
+so its memory use is bounded however long it runs.
+"""
+
+import logging
+from typing import Optional
+
+import dotsi  # type: ignore
+import numpy as np  # type: ignore
+from numpy.lib.stride_tricks import sliding_window_view  # type: ignore
+from scipy.signal import sosfilt  # type: ignore
+
+import sounder.sound_analysis as sa
+
+log = logging.getLogger(__name__)
+
+# Duration of each meter block, the BS.1770 gating step (seconds).
+BLOCK_SECS = 0.1
+
+# Number of meter blocks in each BS.1770 gating block of 400ms.
+GATE_BLOCKS = 4
+
+# Offset of the BS.1770 loudness from the mean square of the K-weighted samples.
+LOUDNESS_OFFSET = -0.691
+
+# Lowest level reported, for digital silence (dB).
+MIN_DB = -120.0
+
+
+def k_weighting(sample_rate: int) -> np.ndarray:
+    """
+    Function to design the BS.1770 K-weighting filter for a sample rate,
+    a high shelf for the head followed by a high pass.
+    The filter is designed by the bilinear transform of its analogue
+    prototype, so matches the coefficients given in BS.1770 at 48kHz
+    and works at any sample rate.
+    Args:
+        sample_rate:    Sample rate of the sound samples (Hz).
+    Returns:
+        Filter as second order sections.
+    """
+
+    # High shelf, +4dB above about 1.7kHz.
+    k = np.tan(np.pi * 1681.974450955533 / sample_rate)
+    q = 0.7071752369554196
+    v_high = 10.0 ** (3.999843853973347 / 20)
+    v_band = v_high**0.4996667741545416
+    shelf = [v_high + v_band * k / q + k * k, 2 * (k * k - v_high), v_high - v_band * k / q + k * k]
+    shelf += [1 + k / q + k * k, 2 * (k * k - 1), 1 - k / q + k * k]
+
+    # High pass, rolling off below about 38Hz, with unity gain numerator.
+    k = np.tan(np.pi * 38.13547087602444 / sample_rate)
+    q = 0.5003270373238773
+    a0 = 1 + k / q + k * k
+    high_pass = [a0, -2 * a0, a0, a0, 2 * (k * k - 1), 1 - k / q + k * k]
+
+    # Normalise each section so that a0 is 1.
+    sos = np.array([shelf, high_pass])
+    sos /= sos[:, 3:4]
+
+    return sos
+
+
+def to_db(values: np.ndarray) -> np.ndarray:
+    """
+    Function to convert power values to decibels.
+    Args:
+        values: Power values.
+    Returns:
+        Power (dB), no lower than MIN_DB, so digital silence is reported as MIN_DB.
+    """
+
+    return 10.0 * np.log10(np.maximum(values, 10.0 ** (MIN_DB / 10)))
+
+
+def to_lufs(values: np.ndarray) -> np.ndarray:
+    """
+    Function to convert mean square K-weighted values to loudness.
+    Args:
+        values: Mean square of K-weighted samples.
+    Returns:
+        Loudness (LUFS), no lower than MIN_DB, as for levels.
+    """
+
+    return np.maximum(LOUDNESS_OFFSET + to_db(values), MIN_DB)
+
+
+def integrated_loudness(k_mean_square: np.ndarray, settings: dotsi.Dict) -> Optional[float]:
+    """
+    Function to calculate the BS.1770 gated integrated loudness from the
+    mean square of the K-weighted samples of each meter block.
+    Args:
+        k_mean_square:  Mean square of the K-weighted samples of each block.
+        settings:       Application settings.
+    Returns:
+        Integrated loudness (LUFS), None if too short or too quiet.
+    """
+
+    if len(k_mean_square) < GATE_BLOCKS:
+        return None
+
+    # Gating blocks of 400ms, overlapping by 75%.
+    gate_power = sliding_window_view(k_mean_square, GATE_BLOCKS).mean(axis=1)
+    gate_loudness = to_lufs(gate_power)
+
+    # Absolute gate, then relative gate below the loudness of the blocks left.
+    above_abs = gate_loudness > settings.meter.ABS_GATE_LUFS
+    if not above_abs.any():
+        return None
+    rel_gate = to_lufs(gate_power[above_abs].mean()) + settings.meter.REL_GATE_LU
+    gated = above_abs & (gate_loudness > rel_gate)
+
+    return float(to_lufs(gate_power[gated].mean()))
+
+
+class StreamMeter:
+    """
+    Level and loudness meter, metering samples as they are pushed.
+    """
+
+    def __init__(self, sample_rate: int, settings: dotsi.Dict, max_blocks: Optional[int] = None) -> None:
+        """
+        Stream meter initialisation.
+        Args:
+            sample_rate:    Sample rate of the sound samples (Hz).
+            settings:       Application settings.
+            max_blocks:     Number of the most recent blocks to keep, for live
+                            monitoring, or None to keep all the blocks.
+        """
+
+        self._sample_rate = sample_rate
+        self._settings = settings
+        self._max_blocks = max_blocks
+        self.block_size = max(1, int(round(BLOCK_SECS * sample_rate)))
+
+        # K-weighting filter, and its state carried between chunks.
+        self._sos = k_weighting(sample_rate)
+        self._zi = np.zeros((self._sos.shape[0], 2))
+
+        # Samples of a partial block carried between chunks, in buffers
+        # allocated once, with the number of samples in them.
+        self._pending = np.empty(self.block_size)
+        self._k_pending = np.empty(self.block_size)
+        self._num_pending = 0
+
+        # Counts of the blocks metered, and of those kept.
+        self._num_blocks = 0
+        self._num_kept = 0
+
+        # Measures of each block, as a list of arrays for each chunk.
+        self._peak: list[np.ndarray] = []
+        self._mean_square: list[np.ndarray] = []
+        self._k_mean_square: list[np.ndarray] = []
+        self._clips: list[np.ndarray] = []
+
+    @property
+    def num_blocks(self) -> int:
+        """
+        Number of blocks metered.
+        """
+
+        return self._num_blocks
+
+    def push(self, samples: np.ndarray) -> int:
+        """
+        Function to meter a chunk of samples.
+        Args:
+            samples:    Single channel sound samples, of any type.
+        Returns:
+            Number of blocks completed by the chunk.
+        """
+
+        # Scale to -1 to 1, and filter carrying the state from the last chunk.
+        scaled = sa.to_float(samples, np.float64)
+        k_weighted, self._zi = sosfilt(self._sos, scaled, zi=self._zi)
+
+        # Fill any partial block from the last chunk, metering it once complete.
+        completed = 0
+        used = 0
+        if self._num_pending:
+            used = min(len(scaled), self.block_size - self._num_pending)
+            self._pending[self._num_pending : self._num_pending + used] = scaled[:used]
+            self._k_pending[self._num_pending : self._num_pending + used] = k_weighted[:used]
+            self._num_pending += used
+            if self._num_pending == self.block_size:
+                self._meter_blocks(self._pending[np.newaxis, :], self._k_pending[np.newaxis, :])
+                self._num_pending = 0
+                completed = 1
+
+        # Meter the whole blocks left, and carry the rest to the next chunk.
+        rest = len(scaled) - used
+        if rest:
+            whole = rest // self.block_size * self.block_size
+            if whole:
+                blocks = scaled[used : used + whole].reshape(-1, self.block_size)
+                self._meter_blocks(blocks, k_weighted[used : used + whole].reshape(-1, self.block_size))
+                completed += whole // self.block_size
+            self._num_pending = rest - whole
+            self._pending[: self._num_pending] = scaled[used + whole :]
+            self._k_pending[: self._num_pending] = k_weighted[used + whole :]
+
+        return completed
+
+    def flush(self) -> None:
+        """
+        Function to meter any partial block left, as a short last block.
+        """
+
+        if self._num_pending:
+            count = self._num_pending
+            self._meter_blocks(self._pending[np.newaxis, :count], self._k_pending[np.newaxis, :count])
+        self._num_pending = 0
+
+    def _meter_blocks(self, blocks: np.ndarray, k_blocks: np.ndarray) -> None:
+        """
+        Function to meter blocks of samples, all in one operation.
+        Args:
+            blocks:     Scaled samples, one block to each row.
+            k_blocks:   K-weighted samples, one block to each row.
+        """
+
+        self._num_blocks += len(blocks)
+
+        # Only the most recent blocks are kept, if bounded.
+        if self._max_blocks:
+            blocks = blocks[-self._max_blocks :]
+            k_blocks = k_blocks[-self._max_blocks :]
+
+        magnitude = np.abs(blocks)
+        self._peak.append(magnitude.max(axis=1))
+        self._clips.append(np.count_nonzero(magnitude >= self._settings.meter.CLIP_LEVEL, axis=1))
+        self._mean_square.append(np.einsum("ij,ij->i", blocks, blocks) / blocks.shape[1])
+        self._k_mean_square.append(np.einsum("ij,ij->i", k_blocks, k_blocks) / k_blocks.shape[1])
+        self._num_kept += len(blocks)
+
+        # Drop the oldest chunks of blocks while enough newer blocks are kept.
+        while self._max_blocks and self._num_kept - len(self._peak[0]) >= self._max_blocks:
+            self._num_kept -= len(self._peak[0])
+            del self._peak[0], self._clips[0], self._mean_square[0], self._k_mean_square[0]
+
+    def latest(self) -> Optional[dotsi.Dict]:
+        """
+        Function to get the measures of the last block, for live monitoring.
+        Returns:
+            Dictionary of the peak and RMS (dBFS), clip count and
+            momentary loudness (LUFS) of the last block, None if no blocks yet.
+        """
+
+        if not self._peak:
+            return None
+
+        # Momentary loudness is over the last 400ms.
+        k_recent = np.concatenate(self._k_mean_square[-GATE_BLOCKS:])[-GATE_BLOCKS:]
+
+        return dotsi.Dict(
+            {
+                "peak_db": float(to_db(self._peak[-1][-1] ** 2)),
+                "rms_db": float(to_db(self._mean_square[-1][-1])),
+                "clips": int(self._clips[-1][-1]),
+                "momentary_lufs": float(to_lufs(k_recent.mean())),
+            }
+        )
+
+    def results(self) -> dotsi.Dict:
+        """
+        Function to get the measures of all the blocks kept,
+        only the most recent if the meter is bounded.
+        Returns:
+            Dictionary of the arrays of peak, RMS and crest factor (dB),
+            clip count and momentary loudness (LUFS) of each block, and
+            the overall peak, RMS, clip count and integrated loudness.
+        """
+
+        peak = np.concatenate(self._peak) if self._peak else np.empty(0)
+        mean_square = np.concatenate(self._mean_square) if self._mean_square else np.empty(0)
+        k_mean_square = np.concatenate(self._k_mean_square) if self._k_mean_square else np.empty(0)
+        clips = np.concatenate(self._clips) if self._clips else np.empty(0, dtype=int)
+
+        # Momentary loudness over the 400ms up to the end of each block.
+        k_sum = np.concatenate((np.zeros(1), np.cumsum(k_mean_square)))
+        ends = np.arange(1, len(k_mean_square) + 1)
+        starts = np.maximum(ends - GATE_BLOCKS, 0)
+        momentary = to_lufs((k_sum[ends] - k_sum[starts]) / np.maximum(ends - starts, 1))
+
+        peak_db = to_db(peak**2)
+        rms_db = to_db(mean_square)
+
+        return dotsi.Dict(
+            {
+                "block_secs": self.block_size / self._sample_rate,
+                "peak_db": peak_db,
+                "rms_db": rms_db,
+                "crest_db": peak_db - rms_db,
+                "clips": clips,
+                "momentary_lufs": momentary,
+                "max_peak_db": float(peak_db.max()) if len(peak_db) else None,
+                "rms_total_db": float(to_db(mean_square.mean())) if len(mean_square) else None,
+                "total_clips": int(clips.sum()),
+                "integrated_lufs": integrated_loudness(k_mean_square, self._settings),
+            }
+        )
+
+
+def meter_data(sound_data: np.ndarray, sample_rate: int, settings: dotsi.Dict) -> dotsi.Dict:
+    """
+    Function to meter sound data in one streaming pass, a chunk at a time,
+    so only a chunk of the (memory mapped) sound data is converted at once.
+    Args:
+        sound_data:     Single channel sound samples.
+        sample_rate:    Sample rate of the sound samples (Hz).
+        settings:       Application settings.
+    Returns:
+        Dictionary of the meter results.
+    """
+
+    meter = StreamMeter(sample_rate, settings)
+
+    # Chunks of whole blocks, so no partial blocks are carried.
+    chunk_size = max(1, int(settings.meter.CHUNK_SECS / BLOCK_SECS)) * meter.block_size
+    for start in range(0, len(sound_data), chunk_size):
+        meter.push(sound_data[start : start + chunk_size])
+    meter.flush()
+
+    return meter.results()
+
+
+def report(results: dotsi.Dict) -> dict:
+    """
+    Function to get the meter results as a compact report that can be
+    sent as JSON, with the block arrays as lists rounded to 0.01dB.
+    Args:
+        results:    Meter results.
+    Returns:
+        Dictionary of the meter report.
+    """
+
+    return {
+        "block_secs": results.block_secs,
+        "max_peak_db": results.max_peak_db,
+        "rms_total_db": results.rms_total_db,
+        "total_clips": results.total_clips,
+        "integrated_lufs": results.integrated_lufs,
+        "peak_db": np.round(results.peak_db, 2).tolist(),
+        "rms_db": np.round(results.rms_db, 2).tolist(),
+        "clips": results.clips.tolist(),
+        "momentary_lufs": np.round(results.momentary_lufs, 2).tolist(),
+    }
@@ -0,0 +1,194 @@
+"""
+Functions to split a sounder recording into individual notes
+by onset detection, and to analyse each of the notes.
+Note segments are views over the (memory mapped) sound data,
+so no copies of the recording are made to split it.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+
+import dotsi  # type: ignore
+import numpy as np  # type: ignore
+from numpy.lib.stride_tricks import sliding_window_view  # type: ignore
+from scipy.ndimage import median_filter  # type: ignore
+from scipy.signal import find_peaks  # type: ignore
+
+import sounder.harmonics as harmonics
+import sounder.sound_analysis as sa
+
+log = logging.getLogger(__name__)
+
+
+def frame_view(sound_data: np.ndarray, frame_size: int, hop_size: int) -> np.ndarray:
+    """
+    Function to split sound data into overlapping frames.
+    The frames are a view over the sound data, not a copy.
+    Args:
+        sound_data: Single channel sound samples.
+        frame_size: Number of samples in each frame.
+        hop_size:   Number of samples between the start of each frame.
+    Returns:
+        2D array view of frames, one frame per row.
+    """
+
+    # Not enough data for a single frame.
+    if len(sound_data) < frame_size:
+        return np.empty((0, frame_size), dtype=sound_data.dtype)
+
+    return sliding_window_view(sound_data, frame_size)[::hop_size]
+
+
+def spectral_flux(sound_data: np.ndarray, frame_size: int, hop_size: int, chunk_frames: int = 256) -> np.ndarray:
+    """
+    Function to calculate the spectral flux of sound data.
+    This is the sum of increases in (log) magnitude of each frequency
+    bin from one frame to the next, which peaks when a note starts.
+    Frames are processed in chunks to limit memory use on long recordings.
+    Args:
+        sound_data:     Single channel sound samples.
+        frame_size:     Number of samples in each frame.
+        hop_size:       Number of samples between the start of each frame.
+        chunk_frames:   Number of frames to transform at a time.
+    Returns:
+        Spectral flux, one value per frame.
+    """
+
+    frames = frame_view(sound_data, frame_size, hop_size)
+    flux = np.zeros(len(frames))
+
+    # Window the frames to reduce spectral leakage.
+    window = np.hanning(frame_size)
+
+    # Magnitude of the previous frame, carried across chunks.
+    # Recording is taken to start from silence so a note at the start counts.
+    prev_mag = np.zeros((1, frame_size // 2 + 1))
+
+    for start in range(0, len(frames), chunk_frames):
+        # Transform the chunk of frames, converting only this chunk to float.
+        chunk = sa.to_float(frames[start : start + chunk_frames])
+        mag = np.log1p(np.abs(np.fft.rfft(chunk * window, axis=1)))
+
+        # Include the last frame of the previous chunk to difference against.
+        mag = np.vstack((prev_mag, mag))
+
+        # Only increases in magnitude count towards the flux.
+        diff = np.diff(mag, axis=0)
+        np.maximum(diff, 0, out=diff)
+        flux[start : start + len(diff)] = diff.sum(axis=1)
+
+        prev_mag = mag[-1:]
+
+    return flux
+
+
+def detect_onsets(sound_data: np.ndarray, sample_rate: int, settings: dotsi.Dict) -> np.ndarray:
+    """
+    Function to detect the start of notes in sound data.
+    Args:
+        sound_data:     Single channel sound samples.
+        sample_rate:    Sample rate of the sound samples (Hz).
+        settings:       Application settings.
+    Returns:
+        Array of sample indexes where notes start.
+    """
+
+    hop_size = settings.onset.HOP_SIZE
+
+    # Calculate the spectral flux and normalise it.
+    flux = spectral_flux(sound_data, settings.onset.FRAME_SIZE, hop_size)
+    if len(flux) == 0 or np.max(flux) <= 0:
+        return np.empty(0, dtype=np.int64)
+    flux /= np.max(flux)
+
+    # Remove the slowly varying part of the flux with a local median,
+    # then pick peaks that are high enough and far enough apart.
+    # Pad the start so that a peak in the first frame can be found.
+    detrended = np.append(0.0, flux - median_filter(flux, size=settings.onset.MEDIAN_FRAMES))
+    min_gap = max(1, int(settings.onset.MIN_GAP_SECS * sample_rate / hop_size))
+    peaks, _ = find_peaks(detrended, height=settings.onset.DELTA, distance=min_gap)
+
+    # Convert frame numbers to sample indexes, allowing for the padding.
+    return (peaks.astype(np.int64) - 1) * hop_size
+
+
+def segment_views(sound_data: np.ndarray, onsets: np.ndarray, min_samples: int) -> list[tuple[int, np.ndarray]]:
+    """
+    Function to split sound data into note segments starting at each onset.
+    Each segment runs up to the next onset, or the end of the data.
+    Segments are views over the sound data, not copies.
+    Args:
+        sound_data:     Sound samples.
+        onsets:         Sample indexes where notes start.
+        min_samples:    Segments shorter than this are dropped.
+    Returns:
+        List of tuples of segment start index and segment view.
+    """
+
+    # Each segment ends where the next one starts.
+    ends = np.append(onsets[1:], len(sound_data))
+
+    return [(int(start), sound_data[start:end]) for start, end in zip(onsets, ends) if end - start >= min_samples]
+
+
+def analyse_segment(segment: np.ndarray, sample_rate: int, settings: dotsi.Dict) -> dotsi.Dict:
+    """
+    Function to analyse a single note segment.
+    Args:
+        segment:        Sound samples of the note.
+        sample_rate:    Sample rate of the sound samples (Hz).
+        settings:       Application settings.
+    Returns:
+        Dictionary of the note analysis.
+    """
+
+    # Calculate the power spectrum of the note.
+    freq_array, power = sa.power_spectrum(segment, sample_rate, settings.sound.FFT_DTYPE)
+
+    # Only look at the portion of the frequency spectrum of interest.
+    lower, upper = sa.band_limits(freq_array, settings.sound.FFT_MIN_HZ, settings.sound.FFT_MAX_HZ)
+    # Smoothing window is in Hz, so the same for notes of any length.
+    window = sa.window_bins(sa.bin_spacing(freq_array), settings.onset.NOTE_AVG_HZ)
+    smoothed = sa.moving_average(power[lower:upper], window)
+
+    # Find the peak and the note it is closest to.
+    peak_freq, peak_power = sa.peak_frequency(freq_array[lower:upper], power[lower:upper], smoothed, window)
+    note, cents = sa.nearest_note(peak_freq)
+    log.debug(f"Note segment peak at {peak_freq:.1f}Hz, {note} {cents:+.1f} cents.", extra={"stage": "notes"})
+
+    result = dotsi.Dict({"freq": peak_freq, "power": peak_power, "note": note, "cents": cents})
+
+    # Analyse the partials over the whole spectrum, as they go above the band.
+    if settings.harmonics.ENABLED:
+        result.harmonics = harmonics.analyse_harmonics(sa.bin_spacing(freq_array), power, peak_freq, settings)
+
+    return result
+
+
+def analyse_note_data(sound_data: np.ndarray, sample_rate: int, settings: dotsi.Dict) -> list[dotsi.Dict]:
+    """
+    Function to split sound data into notes and analyse each note.
+    Notes are analysed concurrently in a pool of threads.
+    Args:
+        sound_data:     Single channel sound samples.
+        sample_rate:    Sample rate of the sound samples (Hz).
+        settings:       Application settings.
+    Returns:
+        List of note analysis dictionaries, in order of note start.
+    """
+
+    # Find where the notes start, and split the recording at these points.
+    onsets = detect_onsets(sound_data, sample_rate, settings)
+    segments = segment_views(sound_data, onsets, int(settings.onset.MIN_NOTE_SECS * sample_rate))
+    log.info(f"Found {len(segments)} notes in sound recording.")
+
+    # Analyse all the notes concurrently.
+    with ThreadPoolExecutor(max_workers=settings.onset.WORKERS) as pool:
+        results = list(pool.map(lambda seg: analyse_segment(seg[1], sample_rate, settings), segments))
+
+    # Add the timing of each note to the results.
+    for (start, segment), result in zip(segments, results):
+        result.start = start / sample_rate
+        result.end = (start + len(segment)) / sample_rate
+
+    return results
@@ -0,0 +1,167 @@
+"""
+Functions to calculate a semitone (constant-Q) spectrum from a power
+spectrum, with bands on the same logarithmic grid as the note annotations.
+Bands are a fixed fraction of a semitone wide, so low notes get as many
+values as high notes.
+Each band is a weighted sum of the power spectrum bins it overlaps,
+applied as a sparse kernel built for the length and bin spacing of the
+spectrum. The bands only depend on the frequency range, so are reused
+across recordings; recordings are trimmed to their active region, so are
+mostly of different lengths, and the kernel is built for each length
+from the bands.
+"""
+
+from functools import lru_cache
+import logging
+from math import ceil
+from math import floor
+
+import dotsi  # type: ignore
+import numpy as np  # type: ignore
+from numpy.typing import ArrayLike  # type: ignore
+from scipy import sparse  # type: ignore
+
+log = logging.getLogger(__name__)
+
+
+def midi_to_freq(midi: ArrayLike) -> np.ndarray:
+    """
+    Function to convert (fractional) midi note numbers to frequency.
+    Uses well tempered music scale with A4 (midi 69) at 440Hz.
+    Args:
+        midi:   Midi note numbers.
+    Returns:
+        Frequencies (Hz).
+    """
+
+    return 440.0 * 2.0 ** ((np.asarray(midi, dtype=np.float64) - 69) / 12)
+
+
+def band_centres(min_hz: float, max_hz: float, bins_per_semitone: int) -> np.ndarray:
+    """
+    Function to get the centre frequencies of the bands within a range,
+    aligned so that every note is the centre of a band.
+    Args:
+        min_hz:             Lower frequency of the range (Hz).
+        max_hz:             Upper frequency of the range (Hz).
+        bins_per_semitone:  Number of bands in each semitone.
+    Returns:
+        Band centre frequencies (Hz).
+    """
+
+    # Bands start no lower than midi note 0 (C-1), so a range from 0Hz has bands.
+    min_hz = max(min_hz, float(midi_to_freq(0)))
+
+    # Band steps of a fraction of a semitone, starting from A4.
+    first = ceil(bins_per_semitone * 12 * np.log2(min_hz / 440.0))
+    last = floor(bins_per_semitone * 12 * np.log2(max_hz / 440.0))
+
+    return midi_to_freq(69 + np.arange(first, last + 1) / bins_per_semitone)
+
+
+@lru_cache(maxsize=16)
+def band_edges(min_hz: float, max_hz: float, bins_per_semitone: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Function to get the bands within a range, and their edges.
+    Bands only depend on the range, so are cached and reused across
+    recordings of any length.
+    Args:
+        min_hz:             Lower frequency of the range (Hz).
+        max_hz:             Upper frequency of the range (Hz).
+        bins_per_semitone:  Number of bands in each semitone.
+    Returns:
+        Tuple of the band centre, lower edge and upper edge frequencies (Hz).
+    """
+
+    # Band edges are half a band either side of the centre.
+    centres = band_centres(min_hz, max_hz, bins_per_semitone)
+    half_band = 2.0 ** (1 / (24 * bins_per_semitone))
+
+    return centres, centres / half_band, centres * half_band
+
+
+@lru_cache(maxsize=16)
+def semitone_kernel(
+    num_bins: int, bin_hz: float, min_hz: float, max_hz: float, bins_per_semitone: int
+) -> tuple[np.ndarray, sparse.csr_matrix, int]:
+    """
+    Function to build the sparse kernel mapping power spectrum bins to bands.
+    Each power spectrum bin is weighted by the fraction of it overlapping
+    the band, and the weights of each band sum to 1, so that each band is
+    the average power of the bins it covers.
+    The bands are reused across recordings, and the kernel is built from
+    them for all bands at once, so is quick to build for each spectrum length.
+    Kernels are also cached for the spectrum length and bin spacing, for
+    spectra of the same length, such as a recording reanalysed.
+    Args:
+        num_bins:           Number of bins in the power spectrum.
+        bin_hz:             Frequency spacing of the power spectrum bins (Hz).
+        min_hz:             Lower frequency of the bands (Hz).
+        max_hz:             Upper frequency of the bands (Hz).
+        bins_per_semitone:  Number of bands in each semitone.
+    Returns:
+        Tuple of the band centre frequencies (Hz), the kernel, and the
+        first power spectrum bin the kernel columns start from.
+    """
+
+    log.info(f"Building semitone kernel for {num_bins} bins of {bin_hz:.3f}Hz.")
+
+    centres, lower_edges, upper_edges = band_edges(min_hz, max_hz, bins_per_semitone)
+
+    # Power spectrum bins covered by the bands.
+    # Bin j covers from (j - 0.5) to (j + 0.5) bins.
+    first_bin = max(0, int(floor(lower_edges[0] / bin_hz + 0.5)))
+    last_bin = min(num_bins - 1, int(floor(upper_edges[-1] / bin_hz + 0.5)))
+    lower = lower_edges / bin_hz
+    upper = upper_edges / bin_hz
+    band_first = np.maximum(first_bin, np.floor(lower + 0.5).astype(int))
+    band_last = np.minimum(last_bin, np.floor(upper + 0.5).astype(int))
+
+    # One entry for each bin of each band, bands with no bins have no entries.
+    counts = np.maximum(band_last - band_first + 1, 0)
+    rows = np.repeat(np.arange(len(centres)), counts)
+    bins = band_first[rows] + np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    # Overlap of each bin with its band, in bins, normalised so each band sums to 1.
+    overlap = np.minimum(bins + 0.5, upper[rows]) - np.maximum(bins - 0.5, lower[rows])
+    overlap = np.maximum(overlap, 0.0)
+    band_sums = np.bincount(rows, weights=overlap, minlength=len(centres))
+    keep = band_sums[rows] > 0
+
+    kernel = sparse.csr_matrix(
+        (overlap[keep] / band_sums[rows[keep]], (rows[keep], bins[keep] - first_bin)),
+        shape=(len(centres), last_bin - first_bin + 1),
+    )
+
+    return centres, kernel, first_bin
+
+
+def semitone_spectrum(bin_hz: float, power: np.ndarray, settings: dotsi.Dict) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Function to calculate the semitone spectrum of a power spectrum,
+    over the band of interest.
+    Args:
+        bin_hz:     Frequency spacing of the power spectrum points (Hz), from 0 Hz.
+        power:      Power array (dB).
+        settings:   Application settings.
+    Returns:
+        Tuple of the band centre frequencies (Hz) and the band power (dB).
+    """
+
+    centres, kernel, first_bin = semitone_kernel(
+        len(power),
+        float(bin_hz),
+        float(settings.sound.FFT_MIN_HZ),
+        float(settings.sound.FFT_MAX_HZ),
+        int(settings.semitone.BINS_PER_SEMITONE),
+    )
+
+    # Average the linear power of the bins in each band.
+    linear = np.power(10.0, power[first_bin : first_bin + kernel.shape[1]] / 10.0)
+    band_power = kernel @ linear
+
+    # Change to array of power values.
+    # Guard against log of zero for silent bands.
+    np.maximum(band_power, np.finfo(np.float64).tiny, out=band_power)
+
+    return centres, 10.0 * np.log10(band_power)
@@ -0,0 +1,465 @@
+"""
+Functions to perform spectral analysis of sounder recordings.
+These functions do no plotting so they can be shared between
+the plotting functions and any headless analysis.
+"""
+
+from collections import OrderedDict
+import logging
+from math import ceil
+from math import floor
+import threading
+from typing import Optional
+import warnings
+
+import numpy as np  # type: ignore
+from numpy.typing import DTypeLike  # type: ignore
+import scipy.fft as sfft  # type: ignore
+from scipy.io.wavfile import read  # type: ignore
+from scipy.io.wavfile import WavFileWarning  # type: ignore
+from scipy.io.wavfile import write  # type: ignore
+import soundfile as sf  # type: ignore
+
+log = logging.getLogger(__name__)
+
+# Note names starting from C, as used for octave numbering.
+NOTE_NAMES = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
+
+# Note text when there is no note, for a frequency of 0Hz.
+NO_NOTE = "--"
+
+# Comment tagging recordings that start with the armed recorder pre-roll,
+# rather than device start up.
+PRE_ROLL_TAG = "sounder pre-roll"
+
+# Number of spectrum workspaces kept for reuse by each thread.
+WORKSPACE_CACHE = 4
+
+# Spectrum workspaces for each thread.
+_workspaces = threading.local()
+
+
+def read_wav(s_file: str) -> tuple[int, np.ndarray]:
+    """
+    Function to read a wav file, memory mapped where possible so that
+    samples are only read from the file as they are used.
+    24-bit files can't be memory mapped, so are read into memory as 32-bit.
+    Args:
+        s_file: Filename of the sound sample file.
+    Returns:
+        Tuple of the sample rate and the sound samples.
+    """
+
+    # Extra chunks, such as the peak chunk of tagged recordings, are skipped.
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", WavFileWarning)
+        try:
+            return read(s_file, mmap=True)
+        except ValueError as ex:
+            # Not a format that can be memory mapped, or not a wav file at all,
+            # which reading into memory reports in turn.
+            log.debug(f"Unable to memory map sound file: {s_file} - {ex}")
+            return read(s_file)
+
+
+def write_wav(s_file: str, sample_rate: int, recording: np.ndarray, pre_roll: bool = False) -> None:
+    """
+    Function to write a recording to a wav file.
+    Recordings starting with the armed recorder pre-roll are tagged, so that
+    whenever they are analysed nothing is burnt from the start.
+    Args:
+        s_file:         Filename of the sound sample file.
+        sample_rate:    Sample rate of the recording (Hz).
+        recording:      Recorded samples.
+        pre_roll:       True if the recording starts with the pre-roll.
+    """
+
+    if not pre_roll:
+        write(s_file, sample_rate, recording)
+        return
+
+    channels = 1 if recording.ndim == 1 else recording.shape[1]
+    with sf.SoundFile(s_file, "w", sample_rate, channels, subtype="FLOAT") as wav_file:
+        # Tag is written ahead of the samples.
+        wav_file.comment = PRE_ROLL_TAG
+        wav_file.write(recording)
+
+
+def has_pre_roll(s_file: str) -> bool:
+    """
+    Function to check if a recording starts with the armed recorder pre-roll.
+    Args:
+        s_file: Filename of the sound sample file.
+    Returns:
+        True if the recording is tagged as starting with the pre-roll.
+    """
+
+    try:
+        with sf.SoundFile(s_file) as wav_file:
+            return wav_file.comment == PRE_ROLL_TAG
+    except RuntimeError:
+        # Not readable for tags, so not tagged.
+        return False
+
+
+def first_channel(sound_data: np.ndarray) -> np.ndarray:
+    """
+    Function to get the first channel (the left) of sound data.
+    The channel is a view over the sound data, not a copy.
+    Args:
+        sound_data: Sound samples as read from the wav file.
+    Returns:
+        Single channel sound samples.
+    """
+
+    # Single channel data is returned as is.
+    if sound_data.ndim > 1:
+        return sound_data[:, 0]
+    return sound_data
+
+
+def to_float(sound_data: np.ndarray, dtype: DTypeLike = np.float64) -> np.ndarray:
+    """
+    Function to convert sound data to floating point in the range -1 to 1.
+    Args:
+        sound_data: Sound samples as read from the wav file.
+        dtype:      Floating point type to convert to.
+    Returns:
+        Floating point sound samples.
+    """
+
+    # Convert into a new array of the required type.
+    return scale_samples(sound_data, np.empty(sound_data.shape, dtype=dtype))
+
+
+def scale_samples(sound_data: np.ndarray, out: np.ndarray) -> np.ndarray:
+    """
+    Function to convert sound data to floating point in the range -1 to 1,
+    writing into an existing array without any full length temporaries.
+    Args:
+        sound_data: Sound samples as read from the wav file.
+        out:        Floating point array to write to, same shape as the sound data.
+    Returns:
+        The output array.
+    """
+
+    # Unsigned 8 bit samples are offset to the middle of the range.
+    if sound_data.dtype == np.uint8:
+        np.subtract(sound_data, 128, out=out, dtype=out.dtype, casting="unsafe")
+        out *= 1.0 / 128.0
+    # Scale integer samples by the full scale of the sample type.
+    elif np.issubdtype(sound_data.dtype, np.integer):
+        full_scale = float(2 ** (8 * sound_data.dtype.itemsize - 1))
+        np.multiply(sound_data, 1.0 / full_scale, out=out, dtype=out.dtype, casting="unsafe")
+    # Floating point samples are already scaled.
+    else:
+        np.copyto(out, sound_data, casting="unsafe")
+
+    return out
+
+
+class SpectrumWorkspace:
+    """
+    Preallocated arrays for calculating power spectra of a given length.
+    Reusing a workspace between calls of the same length means the only
+    full length allocation per call is the transform output.
+    """
+
+    def __init__(self, num_samps: int, dtype: DTypeLike = np.float32) -> None:
+        """
+        Spectrum workspace initialisation.
+        Args:
+            num_samps:  Number of sound samples to transform.
+            dtype:      Floating point type to calculate in.
+        """
+
+        self.num_samps = num_samps
+        self.dtype = np.dtype(dtype)
+
+        # Determine unique points, and elimiate negative space.
+        self.num_unique_pts = ceil((num_samps + 1) / 2.0)
+
+        # Scaled sound samples, and the power of each frequency.
+        self._samples = np.empty(num_samps, dtype=self.dtype)
+        self._power = np.empty(self.num_unique_pts, dtype=self.dtype)
+
+        # Frequency array for the last sample rate used, created when first needed.
+        self._freq_array: Optional[np.ndarray] = None
+        self._sample_rate: Optional[int] = None
+
+    def frequencies(self, sample_rate: int) -> np.ndarray:
+        """
+        Function to get the frequency of each point of the power spectrum.
+        Args:
+            sample_rate:    Sample rate of the sound samples (Hz).
+        Returns:
+            Frequency array (Hz).
+        """
+
+        # Compose the frequency array, only if sample rate has changed.
+        if self._freq_array is None:
+            self._freq_array = np.empty(self.num_unique_pts, dtype=np.float64)
+        if sample_rate != self._sample_rate:
+            np.multiply(np.arange(self.num_unique_pts), sample_rate / self.num_samps, out=self._freq_array)
+            self._sample_rate = sample_rate
+
+        return self._freq_array
+
+    def power_spectrum(self, sound_data: np.ndarray, sample_rate: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Function to calculate the single sided power spectrum of sound samples.
+        The returned arrays belong to the workspace, and are overwritten
+        by the next call.
+        Args:
+            sound_data:     Single channel sound samples, integer or floating point.
+            sample_rate:    Sample rate of the sound samples (Hz).
+        Returns:
+            Tuple of the frequency array (Hz) and the power array (dB).
+        """
+
+        return self.frequencies(sample_rate), self.power(sound_data)
+
+    def power(self, sound_data: np.ndarray) -> np.ndarray:
+        """
+        Function to calculate the single sided power spectrum of sound samples,
+        without the frequency array, the points being sample rate / number
+        of samples apart.
+        The returned array belongs to the workspace, and is overwritten
+        by the next call.
+        Args:
+            sound_data:     Single channel sound samples, integer or floating point.
+        Returns:
+            Power array (dB).
+        """
+
+        # Convert sound array to float array.
+        samples = scale_samples(sound_data, self._samples)
+
+        # Calculate FFT of the sample data.
+        # Real input so only the unique points (non-negative space) are calculated.
+        # Input can be overwritten as it is a scratch array.
+        power = np.abs(sfft.rfft(samples, overwrite_x=True), out=self._power)
+
+        # Scale by number of points so that magnitude does not depend on duration
+        # of the signal or sampling frequency.
+        # And then square to get the power.
+        power *= 1.0 / self.num_samps
+        np.square(power, out=power)
+
+        # Multiply by 2 to ensure Nyquist frequency included.
+        # Odd number of samples will not include Nyquist frequency.
+        if self.num_samps % 2 > 0:
+            power[1:] *= 2
+        else:
+            power[1:-1] *= 2
+
+        # Change fft data to array of power values.
+        # Guard against log of zero for silent bins.
+        np.maximum(power, np.finfo(self.dtype).tiny, out=power)
+        np.log10(power, out=power)
+        power *= 10.0
+
+        return power
+
+
+def get_workspace(num_samps: int, dtype: DTypeLike = np.float32) -> SpectrumWorkspace:
+    """
+    Function to get a spectrum workspace for the current thread.
+    Recently used workspaces are kept for reuse.
+    Args:
+        num_samps:  Number of sound samples to transform.
+        dtype:      Floating point type to calculate in.
+    Returns:
+        Spectrum workspace.
+    """
+
+    # Each thread has its own workspaces, as they are not thread safe.
+    if not hasattr(_workspaces, "cache"):
+        _workspaces.cache = OrderedDict()
+    cache = _workspaces.cache
+
+    # Reuse the workspace if there is one, otherwise create it.
+    key = (num_samps, np.dtype(dtype))
+    if key in cache:
+        cache.move_to_end(key)
+    else:
+        cache[key] = SpectrumWorkspace(num_samps, dtype)
+        # Drop the least recently used workspace if too many.
+        if len(cache) > WORKSPACE_CACHE:
+            cache.popitem(last=False)
+
+    return cache[key]
+
+
+def power_spectrum(
+    sound_data: np.ndarray, sample_rate: int, dtype: DTypeLike = np.float32
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Function to calculate the single sided power spectrum of sound samples,
+    using a reusable workspace for the current thread.
+    The returned arrays belong to the workspace, and are overwritten by
+    the next call for the same number of samples.
+    Args:
+        sound_data:     Single channel sound samples, integer or floating point.
+        sample_rate:    Sample rate of the sound samples (Hz).
+        dtype:          Floating point type to calculate in.
+    Returns:
+        Tuple of the frequency array (Hz) and the power array (dB).
+    """
+
+    return get_workspace(len(sound_data), dtype).power_spectrum(sound_data, sample_rate)
+
+
+def band_limits(freq_array: np.ndarray, min_hz: float, max_hz: float) -> tuple[int, int]:
+    """
+    Function to find the index range of the frequency array within a band.
+    Args:
+        freq_array: Frequency array (Hz), evenly spaced from 0 Hz.
+        min_hz:     Lower frequency of the band (Hz).
+        max_hz:     Upper frequency of the band (Hz).
+    Returns:
+        Tuple of the lower and upper (exclusive) indexes of the band.
+    """
+
+    # Frequency array is sorted, so search for the band edges.
+    lower = int(np.searchsorted(freq_array, min_hz, side="left"))
+    upper = int(np.searchsorted(freq_array, max_hz, side="right"))
+
+    return lower, upper
+
+
+def moving_average(power: np.ndarray, window: int) -> np.ndarray:
+    """
+    Function to calculate the moving average of a power spectrum.
+    The leading and trailing values where the window is not full are
+    set to the first and last full window averages.
+    Args:
+        power:  Power array (dB).
+        window: Number of points in the averaging window.
+    Returns:
+        Moving average of the power array.
+    """
+
+    # Calculate the moving average of the freq spectrum.
+    kernel = np.ones(window) / window
+    smoothed = np.convolve(power, kernel, "same")
+
+    # Correct moving average until window is full; set to first full window average.
+    # Do the same for the trailing averaging window.
+    # Not possible if the array is too short for a full window at both ends.
+    if len(smoothed) > 2 * window:
+        smoothed[:window] = smoothed[window]
+        smoothed[-window:] = smoothed[-1 - window]
+
+    return smoothed
+
+
+def band_bins(bin_hz: float, num_bins: int, min_hz: float, max_hz: float) -> tuple[int, int]:
+    """
+    Function to find the index range of the spectrum points within a band,
+    from the spacing of the points rather than a frequency array.
+    Args:
+        bin_hz:     Frequency spacing of the spectrum points (Hz), from 0 Hz.
+        num_bins:   Number of spectrum points.
+        min_hz:     Lower frequency of the band (Hz).
+        max_hz:     Upper frequency of the band (Hz).
+    Returns:
+        Tuple of the lower and upper (exclusive) indexes of the band.
+    """
+
+    lower = min(num_bins, max(0, int(ceil(min_hz / bin_hz))))
+    upper = min(num_bins, max(0, int(floor(max_hz / bin_hz)) + 1))
+
+    return lower, max(lower, upper)
+
+
+def bin_spacing(freq_array: np.ndarray) -> float:
+    """
+    Function to get the frequency spacing of the spectrum points.
+    Args:
+        freq_array: Frequency array (Hz), evenly spaced.
+    Returns:
+        Spacing of the points (Hz).
+    """
+
+    return float(freq_array[1] - freq_array[0])
+
+
+def window_bins(bin_hz: float, width_hz: float) -> int:
+    """
+    Function to get the number of spectrum points in a frequency width,
+    so that windows are the same width whatever the spacing of the points.
+    Args:
+        bin_hz:     Frequency spacing of the spectrum points (Hz).
+        width_hz:   Width of the window (Hz).
+    Returns:
+        Number of points in the window, at least 1.
+    """
+
+    return max(1, int(round(width_hz / bin_hz)))
+
+
+def peak_frequency(
+    freq_array: np.ndarray, power: np.ndarray, smoothed: Optional[np.ndarray] = None, window: int = 1
+) -> tuple[float, float]:
+    """
+    Function to find the frequency of the peak power.
+    If the smoothed power is given, the peak is found in the smoothed power,
+    then refined to the peak of the power within the smoothing window.
+    The peak is interpolated between points by fitting a parabola through
+    the peak point and its neighbours.
+    Args:
+        freq_array: Frequency array (Hz), evenly spaced.
+        power:      Power array (dB), same length as the frequency array.
+        smoothed:   Moving average of the power array, or None.
+        window:     Number of points in the moving average window.
+    Returns:
+        Tuple of the peak frequency (Hz) and peak power (dB).
+    """
+
+    # Find peak value.
+    if smoothed is None:
+        max_at = int(np.argmax(power))
+    else:
+        centre = int(np.argmax(smoothed))
+        lower = max(0, centre - window // 2)
+        upper = min(len(power), centre + window // 2 + 1)
+        max_at = lower + int(np.argmax(power[lower:upper]))
+
+    # Interpolate, unless the peak is at either end.
+    if 0 < max_at < len(power) - 1:
+        alpha, beta, gamma = (float(value) for value in power[max_at - 1 : max_at + 2])
+        denom = alpha - 2 * beta + gamma
+        if denom < 0:
+            delta = 0.5 * (alpha - gamma) / denom
+            bin_hz = bin_spacing(freq_array)
+            return float(freq_array[max_at]) + delta * bin_hz, beta - 0.25 * (alpha - gamma) * delta
+
+    return float(freq_array[max_at]), float(power[max_at])
+
+
+def nearest_note(freq: float) -> tuple[str, float]:
+    """
+    Function to find the nearest note to a frequency.
+    Uses well tempered music scale with A4 at 440Hz.
+    Args:
+        freq:   Frequency (Hz).
+    Returns:
+        Tuple of note text including octave (e.g. "A4"), and
+        offset from the note in cents, or no note ("--") for 0Hz or below.
+    """
+
+    # No note for a DC (or negative) frequency.
+    if freq <= 0:
+        return NO_NOTE, 0.0
+
+    # Number of semitones from A4, and nearest whole semitone.
+    semitones = 12 * np.log2(freq / 440.0)
+    nearest = int(round(semitones))
+
+    # Midi note number, used to get the note name and octave.
+    # Octaves start at C, so C4 is midi note 60.
+    midi = 69 + nearest
+    note_text = f"{NOTE_NAMES[midi % 12]}{midi // 12 - 1}"
+
+    return note_text, float(100 * (semitones - nearest))
@@ -4,16 +4,14 @@ Functions to perform various plotting of sounder recordings.
 
 import copy
 import logging
-from math import ceil
-from math import log10
-from typing import Optional
 
 import dotsi  # type: ignore
 import matplotlib.pyplot as plt  # type: ignore
-from numpy import fft  # type: ignore
 import numpy as np  # type: ignore
-from scipy.io import wavfile as wav  # type: ignore
-from scipy.io.wavfile import read  # type: ignore
+
+import sounder.file_analysis as fa
+import sounder.sound_analysis as sa
+import sounder.trim as trim
 
 log = logging.getLogger(__name__)
 
@@ -21,11 +19,12 @@ log = logging.getLogger(__name__)
 def plot_wav_file(s_file: str, settings: dotsi.Dict) -> None:
     """
     Function to plot a sound sample - samples vs rel applitude.
-    Option to burn starting samples to eliminate noise when
-    recording starts.
+    Only the active region of the sample is plotted, trimming leading
+    and trailing silence, or burning starting samples to eliminate
+    noise when recording starts if no active region is found.
     Args:
+        s_file:     Filename of the sound sample file to plot.
         settings:   Application settings.
-        burn:       Number of samples at start to burn (not Plot).
     """
 
     log.info(f"Plotting sound recording of file: {s_file}")
@@ -39,22 +38,21 @@ def plot_wav_file(s_file: str, settings: dotsi.Dict) -> None:
 
     # Read the sound file.
     try:
-        sample_rate, sound_data = read(s_file)
+        sample_rate, sound_data = sa.read_wav(s_file)
     except FileNotFoundError:
         # Sound file could not be found; log a warning.
         log.warning(f"Error opening sound file: {s_file}")
         return
 
-    # Calculate seconds to burn (if any).
-    burn_samples = int(settings.sound.BURN_SECS * sample_rate)
+    # Find the active region of the recording to plot.
+    # This burns samples at the start if no region can be found.
+    start, end = trim.active_region(sa.first_channel(sound_data), sample_rate, settings, sa.has_pre_roll(s_file))
 
     # Convert sample axis to time data so that x-axis can be in seconds.
-    sound_time = []
-    for ss in range (0, len(sound_data)):
-        sound_time.append(ss / sample_rate)
+    sound_time = np.arange(start, end) / sample_rate
 
     # Plot data.
-    plt.plot(sound_time[burn_samples:], sound_data[burn_samples:], linewidth=0.5, color="blue")
+    plt.plot(sound_time, sound_data[start:end], linewidth=0.5, color="blue")
 
     # Set axis labels.
     plt.ylabel("Amplitude")
@@ -70,7 +68,7 @@ def plot_wav_file(s_file: str, settings: dotsi.Dict) -> None:
     plt.show()
 
 
-def analyse_wav_file(s_file: Optional[str], settings: dotsi.Dict) -> None:
+def analyse_wav_file(s_file: str, settings: dotsi.Dict) -> None:
     """
     Function to analyse a sound sample.
     Analysis is FFT so for best results want sound sample
@@ -80,7 +78,10 @@ def analyse_wav_file(s_file: Optional[str], settings: dotsi.Dict) -> None:
         settings:   Application settings.
     """
 
-    log.info(f"Analysing sound recording of file: {s_file}")
+    log.info(f"Plotting analysis of sound recording of file: {s_file}")
+
+    # Analyse the sound file first, so no plot is left open if it can't be analysed.
+    analysis = fa.analyse_file(s_file, settings)
 
     # Specify plot details.
     # Create 2 plots - the main frequency spectrum plot at the bottom,
@@ -96,80 +97,25 @@ def analyse_wav_file(s_file: Optional[str], settings: dotsi.Dict) -> None:
     fig.autolayout = True
     ax2.set_facecolor("#c8c8c8")
 
-    # Read the sound file.
-    sample_rate, sound_data = read(s_file)
-
-    # Convert sound array to float array.
-    sound_data = sound_data / (2.0**15)
-
-    # Burn samples at start of file if required.
-    # Calculate seconds to burn (if any).
-    burn_samples = int(settings.sound.BURN_SECS * sample_rate)
-    sample_data = sound_data[burn_samples:]
-
-    # Determine samples in the sound data.
-    num_samps = len(sample_data)
-
-    # Calculate FFT of the sample data.
-    fft_data = fft.fft(sample_data)
-
-    # Determine unique points, and elimiate negative space.
-    num_unique_pts = ceil((num_samps + 1) / 2.0)
-    fft_data = fft_data[0:num_unique_pts]
-    fft_data = abs(fft_data)
-
-    # Scale by number of points so that magnitude does not depend on duration
-    # of the signal or sampling frequency.
-    # And then square to get the power.
-    fft_data = fft_data / float(num_samps)
-    fft_data = fft_data**2
-
-    # Multiply by 2 to ensure Nyquist frequency included.
-    # Odd number of samples will not include Nyquist frequency.
-    if num_samps % 2 > 0:
-        fft_data[1 : len(fft_data)] = fft_data[1 : len(fft_data)] * 2
-    else:
-        fft_data[1 : len(fft_data) - 1] = fft_data[1 : len(fft_data) - 1] * 2
-
-    # Compose the frequency array.
-    freq_array = np.arange(0, num_unique_pts, 1.0) * (sample_rate / num_samps)
-
-    # Compose frequency spectrum plot.
-    # First change fft data to array of power values.
-    power = np.array([None] * len(freq_array))
-    for idx in range(len(freq_array)):
-        power[idx] = 10.0 * log10(fft_data[idx])
-
-    # Only show portion of the frequency spectrum we're interest in.
-    lower_freq = int(settings.sound.FFT_MIN_HZ * num_unique_pts / settings.sound.SAMPLE_RATE * 2)
-    upper_freq = int(settings.sound.FFT_MAX_HZ * num_unique_pts / settings.sound.SAMPLE_RATE * 2)
-
     # Plot the frequecy spectrum.
-    ax2.plot(freq_array[lower_freq:upper_freq], power[lower_freq:upper_freq], linewidth=0.5, color="cyan", zorder=10)
-
-    # Calculate the moving average of the freq spectrum so that can be plotted too.
-    window = np.ones(settings.sound.FFT_AVG_WIN) / settings.sound.FFT_AVG_WIN
-    moving_average = np.convolve(power[lower_freq:upper_freq], window, "same")
-    # Correct moving average until window is full; set to first full window average.
-    # Do the same for the trailing averaging window.
-    for idx in range(settings.sound.FFT_AVG_WIN):
-        moving_average[idx] = moving_average[settings.sound.FFT_AVG_WIN]
-        moving_average[-1 - idx] = moving_average[-1 - settings.sound.FFT_AVG_WIN]
+    # Only shows portion of the frequency spectrum we're interest in.
+    ax2.plot(analysis.freq_array, analysis.power, linewidth=0.5, color="cyan", zorder=10)
 
     # Plot the moving average of the freq spectrum.
-    ax2.plot(freq_array[lower_freq:upper_freq], moving_average, linewidth=1, color="black", zorder=20)
-
-    # Find peak value.
-    max_value = np.max(moving_average)
-    max_at = np.where(moving_average == max_value)
-    max_freq = freq_array[max_at[0] + lower_freq]
-    max_text = f"{max_freq[0]:.1f}Hz"
-    print(f"Max freq at : {max_at[0] + lower_freq}")
+    ax2.plot(analysis.freq_array, analysis.smoothed, linewidth=1, color="black", zorder=20)
+
+    # Plot the semitone spectrum, lining up with the note annotations.
+    if settings.semitone.PLOT:
+        ax2.step(analysis.semitone_freq, analysis.semitone_power, where="mid", linewidth=1, color="blue", zorder=15)
+
+    # Peak value.
+    max_freq, max_value = analysis.peak_freq, analysis.peak_power
+    max_text = f"{max_freq:.1f}Hz"
     print(f"Max freq : {max_freq}")
 
     # Annotate to plot.
     plt.annotate(max_text,
-        xy = (max_freq[0], max_value),
+        xy = (max_freq, max_value),
         xytext=(0, 5),
         textcoords="offset points",
         ha='center',
@@ -177,6 +123,24 @@ def analyse_wav_file(s_file: Optional[str], settings: dotsi.Dict) -> None:
         color='black'
     )
 
+    # Mark the partials of the peak, within the portion of the spectrum plotted.
+    if analysis.harmonics and analysis.harmonics.partials:
+        partials = np.array(analysis.harmonics.partials)
+        in_band = partials <= settings.sound.FFT_MAX_HZ
+        ax2.plot(
+            partials[in_band],
+            np.array(analysis.harmonics.partial_power)[in_band],
+            linestyle="none",
+            marker="v",
+            markersize=4,
+            color="red",
+            zorder=30,
+        )
+        # Show the inharmonicity and THD in the corner of the plot.
+        harmonic_text = f"B {analysis.harmonics.inharmonicity:.2e}, THD {analysis.harmonics.thd * 100:.1f}%"
+        log.info(f"Harmonics of {analysis.peak_freq:.1f}Hz: {harmonic_text}")
+        ax2.text(0.99, 0.97, harmonic_text, transform=ax2.transAxes, ha="right", va="top", size=7)
+
     # Set minor tick marks on.
     ax2.minorticks_on()
 
@@ -222,6 +186,59 @@ def analyse_wav_file(s_file: Optional[str], settings: dotsi.Dict) -> None:
     plt.show()
 
 
+def plot_comparison(comparisons: list[dotsi.Dict], settings: dotsi.Dict) -> None:
+    """
+    Function to plot the comparison of recordings.
+    The smoothed spectra of the recordings are overlaid on the top plot,
+    and the difference of each from the reference on the semitone grid
+    is shown on the bottom plot.
+    Args:
+        comparisons:    Comparisons of each recording, the first is the reference.
+        settings:       Application settings.
+    """
+
+    log.info("Plotting comparison of sound recordings.")
+
+    # Create 2 plots sharing the frequency axis.
+    fig, (ax1, ax2) = plt.subplots(
+        nrows=2,
+        sharex=True,
+        height_ratios=[3, 2],
+        figsize=(settings.sound.FIG_X_SIZE, settings.sound.FIG_Y_SIZE),
+        layout="tight",
+    )
+    fig.suptitle("Frequency domain comparison")
+
+    # Overlay the smoothed spectra.
+    for comparison in comparisons:
+        analysis = comparison.analysis
+        ax1.plot(analysis.freq_array, analysis.smoothed, linewidth=1, label=comparison.file)
+
+    # Plot the difference spectra from the reference.
+    for comparison in comparisons[1:]:
+        ax2.step(
+            comparison.analysis.semitone_freq,
+            comparison.difference,
+            where="mid",
+            linewidth=1,
+            label=f"{comparison.file} ({comparison.peak_shift:+.1f} cents)",
+        )
+    ax2.axhline(0, linewidth=0.5, color="black")
+
+    # Add axis labels and legends.
+    ax1.set_ylabel("Power (dB)")
+    ax1.legend(fontsize=7)
+    ax2.set_xlabel("Frequency (Hz)")
+    ax2.set_ylabel("Difference (dB)")
+    ax2.legend(fontsize=7)
+
+    # Add grid lines.
+    ax1.grid()
+    ax2.grid()
+
+    plt.show()
+
+
 def note_annotations(first_octave: int, num_octaves: int) -> list[list[dotsi.Dict]]:
     """
     Function to generate all note annotations for plotting against
@@ -26,14 +26,14 @@ class SoundAnalyser:
         """
 
         # Load application settings.
-        self._settings = dotsi.Dict(app_settings.load("./sounder/settings.yaml"))
+        self._settings = dotsi.Dict(app_settings.load())
 
         # Initialise app name and version from settings.
         self._app_name = self._settings.app.APP_NAME
         self._app_version = self._settings.app.APP_VERSION
 
         # Setup the application logger.
-        setup_logging(self._app_name)
+        setup_logging(self._app_name, self._settings)
 
         log.info(f"Starting application: {self._app_name}, version: {self._app_version}")
 
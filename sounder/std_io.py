@@ -182,4 +182,5 @@ class AbstractInputOutput:
         if nline:
             print(msg, file=self._of_handle)
         else:
-            print(msg, file=self._of_handle, end="")
+            # Flush, so partial lines such as prompts and live readouts are shown.
+            print(msg, file=self._of_handle, end="", flush=True)
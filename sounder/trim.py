@@ -0,0 +1,120 @@
+"""
+Functions to find the active (non silent) region of a sounder recording,
+so that leading and trailing silence and noise is not analysed.
+"""
+
+import logging
+
+import dotsi  # type: ignore
+import numpy as np  # type: ignore
+
+import sounder.sound_analysis as sa
+
+log = logging.getLogger(__name__)
+
+# Number of frames converted to floating point at a time.
+BLOCK_FRAMES = 1024
+
+
+def frame_energy_db(sound_data: np.ndarray, frame_size: int) -> np.ndarray:
+    """
+    Function to calculate the energy of consecutive frames of sound data.
+    Any partial frame at the end of the data is ignored.
+    Args:
+        sound_data: Single channel sound samples.
+        frame_size: Number of samples in each frame.
+    Returns:
+        Mean square energy (dB) of each frame.
+    """
+
+    # Split into non overlapping frames, one frame per row.
+    num_frames = len(sound_data) // frame_size
+    frames = sound_data[: num_frames * frame_size].reshape(num_frames, frame_size)
+
+    # Convert a block of frames at a time to limit memory use.
+    energy = np.empty(num_frames)
+    for start in range(0, num_frames, BLOCK_FRAMES):
+        block = sa.to_float(frames[start : start + BLOCK_FRAMES], np.float32)
+        energy[start : start + len(block)] = np.einsum("ij,ij->i", block, block, dtype=np.float64) / frame_size
+
+    # Guard against log of zero for silent frames.
+    np.maximum(energy, np.finfo(np.float64).tiny, out=energy)
+    np.log10(energy, out=energy)
+    energy *= 10.0
+
+    return energy
+
+
+def active_region(
+    sound_data: np.ndarray, sample_rate: int, settings: dotsi.Dict, pre_roll: bool = False
+) -> tuple[int, int]:
+    """
+    Function to find the region of a recording containing sound.
+    Frames are active if their energy is above the noise floor by a margin,
+    and within a range of the loudest frame.
+    The noise floor is taken from the lead-in of the recording, or from the
+    quietest frame if no lead-in is set, and is ignored if it is close
+    to the loudest frame, as then there is no silence to trim.
+    Unless the recording starts with the pre-roll, the region starts no
+    earlier than BURN_SECS, so device start up is not kept.
+    Falls back to burning BURN_SECS from the start if trimming is disabled
+    or no active region is found, unless the recording starts with the
+    armed recorder pre-roll, so has no device start up to burn.
+    If burning would leave less than MIN_SECS, the short active region is
+    used instead, or the whole recording if there is no active region.
+    Args:
+        sound_data:     Single channel sound samples.
+        sample_rate:    Sample rate of the sound samples (Hz).
+        settings:       Application settings.
+        pre_roll:       True if the recording starts with the pre-roll.
+    Returns:
+        Tuple of the start and end (exclusive) sample indexes of the region.
+    """
+
+    # Default region burns samples from the start, but not the pre-roll of armed recordings.
+    # Whole recording if burning leaves too little to analyse.
+    burn_secs = 0 if pre_roll else settings.sound.BURN_SECS
+    burn_start = min(int(burn_secs * sample_rate), len(sound_data))
+    burn_ok = len(sound_data) - burn_start >= settings.trim.MIN_SECS * sample_rate
+    fallback = (burn_start if burn_ok else 0, len(sound_data))
+    if not settings.trim.ENABLED:
+        return fallback
+
+    # Calculate the energy of each frame.
+    frame_size = max(1, int(settings.trim.FRAME_SECS * sample_rate))
+    energy = frame_energy_db(sound_data, frame_size)
+    if len(energy) == 0:
+        return fallback
+
+    # Estimate the noise floor.
+    # Without a lead-in, from the quietest frame, so short silences still set the floor.
+    lead_frames = int(settings.trim.NOISE_SECS * sample_rate) // frame_size
+    if lead_frames > 0:
+        noise_floor = np.median(energy[:lead_frames])
+    else:
+        noise_floor = np.min(energy)
+
+    # Gate the frames on the noise floor and the loudest frame.
+    # Floor is not used if it is within the margin of the loudest frame.
+    peak = np.max(energy)
+    threshold = peak - settings.trim.BELOW_PEAK_DB
+    if noise_floor + settings.trim.ABOVE_NOISE_DB < peak:
+        threshold = max(threshold, noise_floor + settings.trim.ABOVE_NOISE_DB)
+    active = np.flatnonzero(energy > threshold)
+    if len(active) == 0:
+        log.info("No active region found in recording, burning start of recording.")
+        return fallback
+
+    # Region runs from the first to the last active frame, with some padding,
+    # but not from before the burn unless that leaves too little.
+    pad = int(settings.trim.PAD_SECS * sample_rate)
+    start = max(burn_start if burn_ok else 0, active[0] * frame_size - pad)
+    end = min(len(sound_data), (active[-1] + 1) * frame_size + pad)
+
+    # Too short a region to analyse, unless burning would leave even less.
+    if end - start < settings.trim.MIN_SECS * sample_rate and burn_ok:
+        log.info("Active region of recording too short, burning start of recording.")
+        return fallback
+
+    log.info(f"Active region of recording from {start / sample_rate:.2f}s to {end / sample_rate:.2f}s.")
+    return int(start), int(end)
@@ -0,0 +1,304 @@
+"""
+Real time tuner, estimating the pitch of small blocks of live input.
+Pitch is estimated in the input stream callback by the YIN method, with
+the difference function calculated by FFT over a sliding window of the
+most recent samples, so there is an estimate for every block.
+The input is also metered, for the peak level and clipping.
+The callback only keeps the latest estimate; the readout is rendered
+from the main thread at a throttled rate, so terminal writes never hold
+up the audio callback.
+"""
+
+import logging
+from math import ceil
+import time
+from typing import Any, Callable, Optional
+
+import dotsi  # type: ignore
+import numpy as np  # type: ignore
+import scipy.fft as sfft  # type: ignore
+import sounddevice as sd  # type: ignore
+
+from sounder import audio_io
+import sounder.meter as meter
+import sounder.sound_analysis as sa
+
+log = logging.getLogger(__name__)
+
+
+class PitchEstimator:
+    """
+    Pitch estimator over a sliding window of the most recent samples.
+    """
+
+    def __init__(self, sample_rate: int, settings: dotsi.Dict) -> None:
+        """
+        Pitch estimator initialisation.
+        Args:
+            sample_rate:    Sample rate of the sound samples (Hz).
+            settings:       Application settings.
+        """
+
+        self._sample_rate = sample_rate
+        self._settings = settings
+
+        # Range of periods (lags) to search, in samples.
+        self._min_lag = max(2, int(sample_rate / settings.tuner.MAX_HZ))
+        self._max_lag = int(ceil(sample_rate / settings.tuner.MIN_HZ))
+
+        # Window of samples needs a whole longest period after
+        # the integration window of the difference function.
+        self._integration = self._max_lag
+        self._window = np.zeros(self._integration + self._max_lag + 1)
+        self._fft_size = sfft.next_fast_len(len(self._window) + self._integration)
+
+    def push(self, block: np.ndarray) -> tuple[Optional[float], float]:
+        """
+        Function to add a block of samples to the window, and estimate the pitch.
+        Args:
+            block:  Newest sound samples.
+        Returns:
+            Tuple of the pitch (Hz), None if there is no pitch, and
+            the level (dBFS) of the window.
+        """
+
+        # Slide the window along by the block.
+        count = len(block)
+        if count >= len(self._window):
+            self._window[:] = block[-len(self._window) :]
+        else:
+            self._window[:-count] = self._window[count:]
+            self._window[-count:] = block
+
+        return self.estimate()
+
+    def estimate(self) -> tuple[Optional[float], float]:
+        """
+        Function to estimate the pitch of the window.
+        Returns:
+            Tuple of the pitch (Hz), None if there is no pitch, and
+            the level (dBFS) of the window.
+        """
+
+        samples = self._window
+        width = self._integration
+
+        # No pitch if too quiet.
+        energy = np.concatenate((np.zeros(1), np.cumsum(samples * samples)))
+        level = float(10.0 * np.log10(max(energy[-1] / len(samples), np.finfo(np.float64).tiny)))
+        if level < self._settings.tuner.MIN_LEVEL_DB:
+            return None, level
+
+        # Correlation of the integration window with each lag of the window, by FFT.
+        spectrum = sfft.rfft(samples, self._fft_size)
+        spectrum *= np.conj(sfft.rfft(samples[:width], self._fft_size))
+        correlation = sfft.irfft(spectrum, self._fft_size)[: self._max_lag + 1]
+
+        # Difference function from the correlation and the energies of the windows.
+        lags = np.arange(self._max_lag + 1)
+        difference = energy[width] + (energy[lags + width] - energy[lags]) - 2 * correlation
+        difference[0] = 0.0
+
+        # Cumulative mean normalised difference.
+        running = np.cumsum(difference[1:])
+        normalised = np.ones(self._max_lag + 1)
+        np.divide(difference[1:] * lags[1:], running, out=normalised[1:], where=running > 0)
+
+        # First dip below the threshold, then on to the bottom of the dip.
+        below = np.flatnonzero(normalised[self._min_lag : self._max_lag] < self._settings.tuner.THRESHOLD)
+        if len(below) == 0:
+            return None, level
+        lag = int(below[0]) + self._min_lag
+        while lag + 1 < self._max_lag and normalised[lag + 1] < normalised[lag]:
+            lag += 1
+
+        # Refine the lag by fitting a parabola through the dip.
+        alpha, beta, gamma = normalised[lag - 1 : lag + 2]
+        denom = alpha - 2 * beta + gamma
+        shift = 0.5 * (alpha - gamma) / denom if denom > 0 else 0.0
+
+        return float(self._sample_rate / (lag + shift)), level
+
+
+def needle_bar(cents: float, width: int) -> str:
+    """
+    Function to draw the tuner needle bar, with the centre marked.
+    Args:
+        cents:  Offset from the note (cents), -50 to 50 cents across the bar.
+        width:  Number of characters in the bar.
+    Returns:
+        Needle bar text.
+    """
+
+    bar = ["-"] * width
+    bar[width // 2] = "|"
+    position = int(round((min(max(cents, -50.0), 50.0) + 50) / 100 * (width - 1)))
+    bar[position] = "^"
+
+    return "".join(bar)
+
+
+def tuner_text(freq: Optional[float], settings: dotsi.Dict, levels: Optional[dotsi.Dict] = None) -> str:
+    """
+    Function to format the tuner readout for a pitch.
+    Args:
+        freq:       Pitch (Hz), None if there is no pitch.
+        settings:   Application settings.
+        levels:     Latest meter levels, not shown if None.
+    Returns:
+        Tuner readout text, coloured green if in tune or red if not.
+    """
+
+    if freq is None:
+        text = f"{'--':>4} {'':>10} {'':>12} [{' ' * settings.tuner.NEEDLE_WIDTH}]"
+    else:
+        note, cents = sa.nearest_note(freq)
+        colour = "\033[1;32m" if abs(cents) <= settings.tuner.IN_TUNE_CENTS else "\033[1;31m"
+        text = (
+            f"{note:>4} {freq:>8.2f}Hz {cents:>+6.1f} cents "
+            f"[{colour}{needle_bar(cents, settings.tuner.NEEDLE_WIDTH)}\033[0m]"
+        )
+
+    # Peak level, flagging any clipping.
+    if levels is not None:
+        text += f" {levels.peak_db:>6.1f}dBFS"
+        if levels.clips:
+            text += " \033[1;31mCLIP\033[0m"
+
+    return text
+
+
+def in_place(text: str) -> str:
+    """
+    Function to format a line of text to be rendered in place on the terminal,
+    returning to the start of the line and clearing it, without a new line.
+    Args:
+        text:   Text to render.
+    Returns:
+        Text with the terminal control codes.
+    """
+
+    return f"\r{text}\033[K"
+
+
+def render_line(text: str) -> None:
+    """
+    Function to render a line of text in place on the terminal.
+    Args:
+        text:   Text to render.
+    """
+
+    print(in_place(text), sep="", end="", flush=True)
+
+
+class Tuner:
+    """
+    Real time tuner, estimating the pitch of live input.
+    """
+
+    def __init__(self, settings: dotsi.Dict, stream_factory: Callable[..., Any] = sd.InputStream) -> None:
+        """
+        Tuner initialisation.
+        Args:
+            settings:       Application settings.
+            stream_factory: Function to create the input stream, sounddevice
+                            InputStream if not given, or a simulated stream for testing.
+        """
+
+        log.info("Initialising tuner.")
+
+        # Initialise application settings to use.
+        self._settings = settings
+        self._estimator = PitchEstimator(settings.sound.SAMPLE_RATE, settings)
+
+        # Latest estimate and levels, replaced as a whole by the callback.
+        self._latest: Optional[tuple[Optional[float], float]] = None
+        self._levels: Optional[dotsi.Dict] = None
+
+        # Level meter of the input, for the live readout.
+        # Only the blocks for the momentary loudness are kept, so memory is bounded.
+        self.meter = meter.StreamMeter(settings.sound.SAMPLE_RATE, settings, max_blocks=meter.GATE_BLOCKS)
+
+        # Counts of blocks and callbacks with overruns, and slowest callback.
+        self.blocks = 0
+        self.overruns = 0
+        self.max_estimate_secs = 0.0
+
+        # Small blocks from the tuner audio profile, so updates are frequent.
+        kwargs = audio_io.stream_kwargs(settings, settings.tuner.PROFILE)
+        self.block_secs = (kwargs["blocksize"] or 512) / settings.sound.SAMPLE_RATE
+        self._stream = stream_factory(
+            samplerate=settings.sound.SAMPLE_RATE, channels=1, dtype="float32", callback=self._callback, **kwargs
+        )
+
+    def _callback(self, indata: np.ndarray, frames: int, time_info: Any, status: Any) -> None:
+        """
+        Input stream callback, estimating the pitch and metering the block.
+        """
+
+        started = time.perf_counter()
+        if status.input_overflow:
+            self.overruns += 1
+        self._latest = self._estimator.push(indata[:frames, 0])
+        if self.meter.push(indata[:frames, 0]):
+            self._levels = self.meter.latest()
+        self.blocks += 1
+        self.max_estimate_secs = max(self.max_estimate_secs, time.perf_counter() - started)
+
+    def start(self) -> None:
+        """
+        Start estimating the pitch of the input stream.
+        """
+
+        log.info("Starting tuner input stream.")
+        self._stream.start()
+
+    def stop(self) -> None:
+        """
+        Stop estimating, and close the input stream.
+        """
+
+        log.info("Stopping tuner input stream.")
+        self._stream.stop()
+        self._stream.close()
+
+    def __enter__(self) -> "Tuner":
+        self.start()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.stop()
+
+    @property
+    def latest(self) -> Optional[tuple[Optional[float], float]]:
+        """
+        Latest pitch (Hz) and level (dBFS) estimate, None if no blocks yet.
+        """
+
+        return self._latest
+
+    def run(self, secs: float, render: Callable[[str], None] = render_line) -> int:
+        """
+        Function to render the tuner readout until the time is up.
+        Only renders when there is a new estimate, at most at the render rate.
+        Args:
+            secs:   Duration to run for (seconds).
+            render: Function to render a line of readout text.
+        Returns:
+            Number of times the readout was rendered.
+        """
+
+        interval = 1.0 / self._settings.tuner.RENDER_HZ
+        end = time.monotonic() + secs
+        shown = None
+        renders = 0
+
+        while time.monotonic() < end:
+            latest = self._latest
+            if latest is not None and latest is not shown:
+                render(tuner_text(latest[0], self._settings, self._levels))
+                shown = latest
+                renders += 1
+            time.sleep(interval)
+
+        return renders
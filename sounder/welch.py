@@ -0,0 +1,248 @@
+"""
+Functions to calculate the averaged power spectrum of long recordings
+by Welch's method, split across several processes.
+The recording is split into chunks of overlapping segments, each
+process reads only the samples of its chunk from the file and sums the
+power of its segments, and the sums are merged, giving the same result
+as averaging all the segments in one process.
+"""
+
+from concurrent.futures import Executor
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import os
+from typing import Optional
+
+import dotsi  # type: ignore
+import numpy as np  # type: ignore
+from numpy.typing import DTypeLike  # type: ignore
+import scipy.fft as sfft  # type: ignore
+from scipy.signal import get_window  # type: ignore
+import soundfile as sf  # type: ignore
+
+from sounder import app_logging
+import sounder.onsets as onsets
+import sounder.sound_analysis as sa
+
+log = logging.getLogger(__name__)
+
+# Number of segments transformed at a time.
+BLOCK_SEGS = 16
+
+# Pool of processes shared by all the Welch calculations in this process,
+# created when first needed, and the number of processes in it.
+_pool: Optional[Executor] = None
+_pool_workers = 0
+
+# Whether this process is itself a pool worker, so runs the segments serially.
+_serial = False
+
+
+def run_serial() -> None:
+    """
+    Function to run the segments in this process, for worker processes
+    of other pools, so that each worker does not start a pool of its own.
+    """
+
+    global _serial
+
+    _serial = True
+
+
+def num_workers(settings: dotsi.Dict) -> int:
+    """
+    Function to get the number of processes to split the segments across.
+    Args:
+        settings:   Application settings.
+    Returns:
+        Number of processes, 1 if the segments are to be run serially.
+    """
+
+    if _serial:
+        return 1
+
+    return settings.welch.WORKERS or os.cpu_count() or 1
+
+
+def _worker_init(log_args: tuple) -> None:
+    """
+    Function to initialise a Welch worker process, setting up logging.
+    Args:
+        log_args:   Arguments to set up logging in the worker.
+    """
+
+    app_logging.worker_logging(*log_args)
+
+
+def shared_pool(settings: dotsi.Dict) -> Optional[Executor]:
+    """
+    Function to get the pool of processes shared by the Welch calculations,
+    created on first use with the number of workers in the settings, and
+    recreated if that number changes.
+    Args:
+        settings:   Application settings.
+    Returns:
+        Pool of processes, None if the segments are to be run serially.
+    """
+
+    global _pool, _pool_workers
+
+    workers = num_workers(settings)
+    if workers <= 1:
+        return None
+
+    if _pool is not None and _pool_workers != workers:
+        log.info(f"Welch workers changed from {_pool_workers} to {workers}, restarting pool.")
+        _pool.shutdown()
+        _pool = None
+
+    if _pool is None:
+        log.info(f"Starting Welch pool of {workers} processes.")
+        _pool = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_worker_init,
+            initargs=(app_logging.worker_logging_args(),),
+        )
+        _pool_workers = workers
+
+    return _pool
+
+
+def num_segments(num_samps: int, seg_size: int, step: int) -> int:
+    """
+    Function to get the number of whole segments in sound data.
+    Args:
+        num_samps:  Number of sound samples.
+        seg_size:   Number of samples in each segment.
+        step:       Number of samples between the start of each segment.
+    Returns:
+        Number of segments.
+    """
+
+    if num_samps < seg_size:
+        return 0
+    return (num_samps - seg_size) // step + 1
+
+
+def segment_power_sum(
+    sound_data: np.ndarray, first_seg: int, last_seg: int, seg_size: int, step: int, dtype: DTypeLike = np.float32
+) -> np.ndarray:
+    """
+    Function to sum the power of the frequencies of a range of
+    windowed segments of sound data.
+    Args:
+        sound_data: Single channel sound samples.
+        first_seg:  First segment to sum.
+        last_seg:   Last segment to sum (exclusive).
+        seg_size:   Number of samples in each segment.
+        step:       Number of samples between the start of each segment.
+        dtype:      Floating point type to transform in.
+    Returns:
+        Sum of the power of each frequency, not scaled.
+    """
+
+    window = get_window("hann", seg_size).astype(dtype)
+    total = np.zeros(seg_size // 2 + 1)
+
+    # Segments are a view over the sound data.
+    segments = onsets.frame_view(sound_data, seg_size, step)
+
+    # Transform a block of segments at a time to limit memory use.
+    for block_start in range(first_seg, last_seg, BLOCK_SEGS):
+        block = sa.to_float(segments[block_start : min(block_start + BLOCK_SEGS, last_seg)], dtype)
+        block *= window
+        spectrum = sfft.rfft(block, axis=1, overwrite_x=True)
+        total += np.einsum("ij,ij->j", spectrum.real, spectrum.real, dtype=np.float64)
+        total += np.einsum("ij,ij->j", spectrum.imag, spectrum.imag, dtype=np.float64)
+
+    return total
+
+
+def _file_power_sum(
+    s_file: str, start: int, end: int, first_seg: int, last_seg: int, seg_size: int, step: int, dtype: DTypeLike
+) -> np.ndarray:
+    """
+    Function to sum the power of a range of segments of a sound file,
+    run in a worker process.
+    Args:
+        s_file:     Filename of the sound sample file.
+        start:      First sample of the region of the file to use.
+        end:        Last sample of the region of the file to use (exclusive).
+        first_seg:  First segment to sum.
+        last_seg:   Last segment to sum (exclusive).
+        seg_size:   Number of samples in each segment.
+        step:       Number of samples between the start of each segment.
+        dtype:      Floating point type to transform in.
+    Returns:
+        Sum of the power of each frequency, not scaled.
+    """
+
+    log.debug(f"Summing segments {first_seg} to {last_seg} of {s_file}.", extra={"stage": "welch"})
+
+    # Read only the samples of this chunk, so no chunk reads the whole file,
+    # even for files that can't be memory mapped.
+    # Read as floating point, scaled to the range -1 to 1 as when converted.
+    chunk_start = start + first_seg * step
+    chunk_end = min(end, start + (last_seg - 1) * step + seg_size)
+    sound_data, _ = sf.read(s_file, start=chunk_start, stop=chunk_end, dtype=np.dtype(dtype).name, always_2d=True)
+
+    return segment_power_sum(sa.first_channel(sound_data), 0, last_seg - first_seg, seg_size, step, dtype)
+
+
+def welch_power(
+    s_file: str, start: int, end: int, sample_rate: int, settings: dotsi.Dict, pool: Optional[Executor] = None
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Function to calculate the averaged power spectrum of a region of a
+    sound file by Welch's method, with the segments split across processes.
+    Args:
+        s_file:         Filename of the sound sample file.
+        start:          First sample of the region of the file to use.
+        end:            Last sample of the region of the file to use (exclusive).
+        sample_rate:    Sample rate of the sound file (Hz).
+        settings:       Application settings.
+        pool:           Pool of processes to use, the shared pool if None.
+    Returns:
+        Tuple of the frequency array (Hz) and the power array (dB).
+    """
+
+    seg_size = settings.welch.SEG_SIZE
+    step = seg_size - int(seg_size * settings.welch.OVERLAP)
+    total_segs = num_segments(end - start, seg_size, step)
+    if total_segs == 0:
+        raise ValueError(f"Sound file too short for Welch segments of {seg_size} samples.")
+
+    # Split the segments into chunks, a few for each worker to balance the load.
+    # Same number of workers as the shared pool.
+    num_chunks = min(total_segs, num_workers(settings) * settings.welch.CHUNKS_PER_WORKER)
+    bounds = np.linspace(0, total_segs, num_chunks + 1).astype(int)
+    log.info(f"Welch power spectrum of {total_segs} segments in {num_chunks} chunks.")
+
+    # Sum the power of each chunk of segments, and merge the sums.
+    args = [
+        (s_file, start, end, first, last, seg_size, step, settings.sound.FFT_DTYPE)
+        for first, last in zip(bounds[:-1], bounds[1:])
+    ]
+    pool = pool or shared_pool(settings)
+    if pool is not None:
+        total = sum(pool.map(_file_power_sum, *zip(*args)))
+    else:
+        total = sum(_file_power_sum(*arg) for arg in args)
+
+    # Average the segments, scaled to the power of each frequency.
+    window = get_window("hann", seg_size)
+    power = total / (total_segs * np.sum(window) ** 2)
+
+    # Multiply by 2 to ensure Nyquist frequency included.
+    # Odd number of samples will not include Nyquist frequency.
+    if seg_size % 2 > 0:
+        power[1:] *= 2
+    else:
+        power[1:-1] *= 2
+
+    # Change to array of power values.
+    # Guard against log of zero for silent bins.
+    np.maximum(power, np.finfo(np.float64).tiny, out=power)
+    power = 10.0 * np.log10(power)
+
+    return sfft.rfftfreq(seg_size, 1.0 / sample_rate), power
@@ -0,0 +1,78 @@
+"""
+Shared test fixtures.
+Simulated input streams, and recordings of tones written to wav files.
+"""
+
+import functools
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np  # type: ignore
+import pytest  # type: ignore
+from scipy.io.wavfile import write  # type: ignore
+
+
+class SimulatedInputStream:
+    """
+    Simulated input stream, calling back in real time with blocks of a signal.
+    """
+
+    def __init__(self, signal, samplerate, channels, dtype, callback, blocksize, latency, device):
+        self._signal = signal
+        self._callback = callback
+        self._samplerate = samplerate
+        self._blocksize = blocksize or 512
+        self._thread = threading.Thread(target=self._run)
+        self._running = False
+
+    def _run(self):
+        status = SimpleNamespace(input_overflow=False)
+        next_sample = 0
+        while self._running:
+            positions = np.arange(next_sample, next_sample + self._blocksize)
+            indata = self._signal(positions, self._samplerate).astype(np.float32).reshape(-1, 1)
+            self._callback(indata, self._blocksize, None, status)
+            next_sample += self._blocksize
+            time.sleep(self._blocksize / self._samplerate)
+
+    def start(self):
+        self._running = True
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._thread.join()
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def input_stream():
+    """
+    Factory of simulated input streams, for a signal given as a function
+    of the sample positions and the sample rate.
+    """
+
+    def stream_factory(signal):
+        return functools.partial(SimulatedInputStream, signal)
+
+    return stream_factory
+
+
+@pytest.fixture
+def write_tone(tmp_path):
+    """
+    Function to write a recording of a tone, with some noise, to a
+    16 bit wav file in the test directory, returning the file name.
+    """
+
+    def write_file(name, freq, secs, sample_rate, noise=0.001):
+        t = np.arange(int(secs * sample_rate)) / sample_rate
+        noise_data = noise * np.random.default_rng(0).standard_normal(len(t))
+        s_file = str(tmp_path / name)
+        write(s_file, sample_rate, ((0.5 * np.sin(2 * np.pi * freq * t) + noise_data) * 2**15).astype(np.int16))
+        return s_file
+
+    return write_file
@@ -0,0 +1,46 @@
+"""
+Unit test for application logging via the log queue.
+"""
+
+import logging
+
+import dotsi  # type: ignore
+
+from sounder import app_logging
+from sounder import app_settings
+
+
+def test_queued_logging_to_file(tmp_path, monkeypatch):
+
+    settings = dotsi.Dict(app_settings.load())
+    settings.log.SAMPLE_EVERY = {"sampled": 10}
+
+    # Log to a file in the test directory.
+    monkeypatch.chdir(tmp_path)
+    app_logging.setup_logging("sounder_test", settings)
+    log = logging.getLogger("sounder_test.module")
+
+    # Log records for a sampled stage, and without a stage.
+    log.info("Not sampled.")
+    for idx in range(25):
+        log.info(f"Sampled {idx}.", extra={"stage": "sampled"})
+
+    # Stopping the listener writes out all queued records.
+    app_logging.stop_logging()
+
+    contents = (tmp_path / "sounder_test.log").read_text().splitlines()
+
+    # Only 1 in 10 of the sampled stage records are written.
+    assert contents[0].endswith("Not sampled.")
+    assert len(contents) == 1 + 3
+    assert [line.split()[-1] for line in contents[1:]] == ["0.", "10.", "20."]
+
+
+def test_sample_filter():
+
+    # Only 1 in 10 records of the sampled stage pass.
+    sample_filter = app_logging.SampleFilter({"hot": 10})
+    hot = logging.makeLogRecord({"stage": "hot"})
+    cold = logging.makeLogRecord({"stage": "cold"})
+    assert sum(sample_filter.filter(hot) for _ in range(100)) == 10
+    assert all(sample_filter.filter(cold) for _ in range(100))
@@ -0,0 +1,144 @@
+"""
+Unit test for audio profiles, latency measurement and armed capture.
+Using a simulated duplex stream with its output looped back to its input,
+and a simulated input stream of a ramp of samples.
+"""
+
+import threading
+import time
+from types import SimpleNamespace
+
+import dotsi  # type: ignore
+import numpy as np  # type: ignore
+import pytest  # type: ignore
+
+from sounder import app_settings
+from sounder import audio_io
+
+# Delay of the simulated loop back, in samples.
+LOOP_DELAY = 300
+
+
+def ramp(positions, sample_rate):
+    return positions
+
+
+class SimulatedStream:
+    """
+    Simulated duplex stream, calling back with blocks of input
+    that are the output delayed by the loop back delay.
+    """
+
+    def __init__(self, samplerate, channels, dtype, callback, blocksize, latency, device):
+        self._callback = callback
+        self._blocksize = blocksize or 512
+        self._thread = threading.Thread(target=self._run)
+        self._running = False
+        self.latency = (0.005, 0.010)
+
+    def _run(self):
+        # Output is delayed through a buffer before being input.
+        loop = np.zeros(LOOP_DELAY, dtype=np.float32)
+        status = SimpleNamespace(
+            input_underflow=False, output_underflow=False, input_overflow=False, output_overflow=False
+        )
+        while self._running:
+            indata = loop[: self._blocksize].reshape(-1, 1).copy()
+            outdata = np.zeros((self._blocksize, 1), dtype=np.float32)
+            self._callback(indata, outdata, self._blocksize, None, status)
+            loop = np.concatenate((loop[self._blocksize :], outdata[:, 0]))
+
+    def __enter__(self):
+        self._running = True
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._running = False
+        self._thread.join()
+
+
+def test_stream_kwargs():
+
+    settings = dotsi.Dict(app_settings.load())
+    kwargs = audio_io.stream_kwargs(settings, "low")
+    assert kwargs == {"blocksize": 128, "latency": "low", "device": None}
+
+
+def test_measure_latency():
+
+    settings = dotsi.Dict(app_settings.load())
+    results = audio_io.measure_latency(settings, "low", SimulatedStream)
+
+    assert results.round_trip_samples == LOOP_DELAY
+    assert np.isclose(results.round_trip_ms, LOOP_DELAY * 1000 / settings.sound.SAMPLE_RATE)
+    assert results.input_ms == 5.0
+    assert results.underruns == 0
+    assert results.overruns == 0
+
+
+def test_ring_buffer():
+
+    ring = audio_io.RingBuffer(8)
+    ring.write(np.arange(5))
+    ring.write(np.arange(5, 11))
+
+    # Reads across the wrap around the end of the buffer.
+    assert ring.written == 11
+    assert np.array_equal(ring.read(4, 6), np.arange(4, 10))
+
+    # Samples before the buffer are overwritten, and after are not yet written.
+    with pytest.raises(ValueError):
+        ring.read(2, 4)
+    with pytest.raises(ValueError):
+        ring.read(8, 4)
+
+    # Only the newest samples are kept when writing more than the buffer size.
+    ring.write(np.arange(11, 31))
+    assert np.array_equal(ring.read(23, 8), np.arange(23, 31))
+
+    # Oldest samples are rejected while a write over them is in progress.
+    ring._writing = ring.written + 2
+    with pytest.raises(ValueError):
+        ring.read(23, 8)
+
+
+def test_armed_recorder(input_stream):
+
+    settings = dotsi.Dict(app_settings.load())
+    settings.sound.SAMPLE_RATE = 8000
+    settings.audio.PROFILE = "low"
+
+    with audio_io.ArmedRecorder(settings, input_stream(ramp)) as recorder:
+        # Wait for more than the pre-roll to be captured.
+        time.sleep(settings.capture.PRE_ROLL_SECS * 2)
+        recording = recorder.record(0.25)
+
+    # Recording includes the pre-roll, and is contiguous.
+    assert len(recording) == int((settings.capture.PRE_ROLL_SECS + 0.25) * 8000)
+    assert np.all(np.diff(recording) == 1)
+    assert recorder.overruns == 0
+
+
+def test_armed_recorder_limits(input_stream):
+
+    settings = dotsi.Dict(app_settings.load())
+    settings.sound.SAMPLE_RATE = 8000
+    settings.capture.TIMEOUT_SECS = 0.1
+
+    # Stream not started, so nothing is captured.
+    recorder = audio_io.ArmedRecorder(settings, input_stream(ramp))
+
+    # A recording filling the whole buffer leaves no room to read it.
+    with pytest.raises(ValueError):
+        recorder.record(settings.capture.BUFFER_SECS, pre_roll=0)
+
+    # A recording of no samples is rejected, rather than waited for.
+    with pytest.raises(ValueError):
+        recorder.record(0)
+
+    # Waiting for samples that never arrive times out.
+    started = time.monotonic()
+    with pytest.raises(TimeoutError):
+        recorder.record(0.1)
+    assert time.monotonic() - started < 1.0
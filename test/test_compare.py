@@ -0,0 +1,45 @@
+"""
+Unit test for comparing recordings.
+"""
+
+import dotsi  # type: ignore
+import numpy as np  # type: ignore
+from scipy.io.wavfile import write  # type: ignore
+
+from sounder import app_settings
+from sounder import compare
+from sounder import file_analysis
+
+
+def write_notes(s_file: str, freqs: list[float], delay: float, sample_rate: int) -> None:
+
+    # Decaying sine wave for each note, after a delay of noise.
+    rng = np.random.default_rng(0)
+    t = np.arange(sample_rate) / sample_rate
+    notes = [0.5 * np.exp(-3 * t) * np.sin(2 * np.pi * f * t) for f in freqs]
+    sound_data = np.concatenate([np.zeros(int(delay * sample_rate))] + notes)
+    sound_data += 0.001 * rng.standard_normal(len(sound_data))
+    write(s_file, sample_rate, (sound_data * 2**15).astype(np.int16))
+
+
+def test_compare_files(tmp_path):
+
+    settings = dotsi.Dict(app_settings.load())
+    sample_rate = settings.sound.SAMPLE_RATE
+
+    # Same notes, the second recording later and 50 cents sharp.
+    freqs = np.array([220.0, 261.63, 329.63])
+    ref_file = str(tmp_path / "ref.wav")
+    sharp_file = str(tmp_path / "sharp.wav")
+    write_notes(ref_file, list(freqs), 0.2, sample_rate)
+    write_notes(sharp_file, list(freqs * 2 ** (50 / 1200)), 0.5, sample_rate)
+
+    comparisons = compare.compare_files([ref_file, sharp_file], settings, file_analysis.AnalysisPipeline())
+
+    assert len(comparisons) == 2
+    sharp = comparisons[1]
+    assert abs(sharp.offset - 0.3) <= 2 * settings.trim.FRAME_SECS
+    assert [note.ref_note for note in sharp.notes] == ["A3", "C4", "E4"]
+    for note in sharp.notes:
+        assert abs(note.shift - 50) < 15
+    assert len(sharp.difference) == len(comparisons[0].analysis.semitone_freq)
@@ -0,0 +1,80 @@
+"""
+Unit test for the analysis daemon and client.
+"""
+
+import os
+import threading
+
+import dotsi  # type: ignore
+import pytest  # type: ignore
+
+from sounder import app_settings
+from sounder import daemon
+from sounder import file_analysis
+
+
+def test_daemon_jobs(tmp_path, write_tone):
+
+    settings = dotsi.Dict(app_settings.load())
+    settings.daemon.SOCKET = str(tmp_path / "sounder.sock")
+    settings.daemon.WORKERS = 1
+
+    # Write a recording of A4, with some noise.
+    test_file = write_tone("a4.wav", 440, 2, settings.sound.SAMPLE_RATE)
+
+    # Start the daemon serving jobs.
+    server = daemon.AnalysisDaemon(settings)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+
+    try:
+        client = daemon.DaemonClient(settings)
+        assert client.available()
+
+        # A second daemon doesn't take the socket from the running one.
+        with pytest.raises(OSError):
+            daemon.AnalysisDaemon(settings)
+        assert client.available()
+
+        # Analyse the file, same as analysing it locally.
+        result = client.analyse(test_file)
+        assert result.peak_freq == file_analysis.analyse_file(test_file, settings).peak_freq
+        assert result.levels.total_clips == 0
+        assert abs(result.levels.max_peak_db - file_analysis.analyse_levels(test_file, settings).max_peak_db) < 0.01
+        assert [note.note for note in result.notes] == ["A4"]
+
+        # Notes and meter jobs only run that analysis.
+        result = client.file_job("notes", test_file)
+        assert [note.note for note in result.notes] == ["A4"]
+        assert "levels" not in result
+        result = client.file_job("meter", test_file)
+        assert result.levels.total_clips == 0
+        assert "notes" not in result
+
+        # Analysis settings changed on the client are used by the daemon.
+        client_settings = dotsi.Dict(app_settings.load())
+        client_settings.daemon = settings.daemon
+        client_settings.sound.FFT_MAX_HZ = 300
+        result = daemon.DaemonClient(client_settings).analyse(test_file)
+        assert result.peak_freq == file_analysis.analyse_file(test_file, client_settings).peak_freq
+        assert result.peak_freq < 300
+
+        # Daemon settings can't be replaced by a job.
+        results = list(client.request({"job": "analyse", "file": test_file, "settings": {"daemon": {}}}))
+        assert "error" in results[0]
+
+        # Batch with a missing file reports an error for that file only.
+        results = list(client.request({"job": "batch", "files": [test_file, str(tmp_path / "missing.wav")]}))
+        assert len(results) == 2
+        assert sorted("error" in result for result in results) == [False, True]
+
+        # A worker dying fails the job with an error, and the pool is replaced.
+        broken_pool = server._pool
+        broken_pool.submit(os._exit, 1)
+        results = list(client.request({"job": "analyse", "file": test_file}))
+        assert len(results) == 1 and "error" in results[0]
+        assert server._pool is not broken_pool
+        assert client.analyse(test_file).notes[0].note == "A4"
+    finally:
+        server.shutdown()
+        thread.join()
@@ -0,0 +1,149 @@
+"""
+Unit test for the staged analysis pipeline.
+Checks that only stages downstream of a settings change are rerun.
+"""
+
+import tracemalloc
+
+import dotsi  # type: ignore
+import numpy as np  # type: ignore
+import pytest  # type: ignore
+import soundfile as sf  # type: ignore
+
+from sounder import app_settings
+from sounder import file_analysis
+from sounder import sound_analysis as sa
+
+
+def test_settings_change_reruns_downstream_stages(write_tone):
+
+    settings = dotsi.Dict(app_settings.load())
+
+    # Write a recording of A4, with some noise.
+    test_file = write_tone("a4.wav", 440, 2, settings.sound.SAMPLE_RATE)
+
+    pipeline = file_analysis.AnalysisPipeline()
+    first = file_analysis.analyse_file(test_file, settings, pipeline)
+    stages = set(pipeline._cache)
+    assert sorted(key[0] for key in stages) == [
+        "band",
+        "harmonics",
+        "load",
+        "peak",
+        "semitone",
+        "smooth",
+        "spectrum",
+        "trim",
+    ]
+
+    # Spectrum stage only keeps the spacing of the points, and its power
+    # array is not one of the workspaces kept for reuse.
+    _, (bin_hz, power) = pipeline.spectrum(test_file, settings)
+    assert isinstance(bin_hz, float)
+    assert all(workspace._power is not power for workspace in getattr(sa._workspaces, "cache", {}).values())
+
+    # Changing the smoothing only reruns the smooth stage and those after it.
+    settings.sound.FFT_AVG_HZ = 5.0
+    second = file_analysis.analyse_file(test_file, settings, pipeline)
+    assert sorted(key[0] for key in set(pipeline._cache) - stages) == ["harmonics", "peak", "smooth"]
+    assert second.power is first.power
+    assert second.note == "A4"
+
+    # Same settings again reruns nothing.
+    stages = set(pipeline._cache)
+    file_analysis.analyse_file(test_file, settings, pipeline)
+    assert set(pipeline._cache) == stages
+
+
+def test_welch_peak_matches_serial(write_tone):
+
+    settings = dotsi.Dict(app_settings.load())
+    settings.welch.WORKERS = 1
+
+    # Write a recording of a steady low E, long enough for several Welch segments.
+    test_file = write_tone("e2.wav", 82.41, 8, settings.sound.SAMPLE_RATE)
+
+    # Single FFT of the whole recording, and Welch averaged with coarser bins.
+    serial = file_analysis.analyse_file(test_file, settings, file_analysis.AnalysisPipeline())
+    settings.welch.ENABLED = True
+    averaged = file_analysis.analyse_file(test_file, settings, file_analysis.AnalysisPipeline())
+
+    # Peak is found to within a cent of the tone either way.
+    assert serial.note == averaged.note == "E2"
+    assert abs(serial.cents) < 1
+    assert abs(averaged.cents - serial.cents) < 1
+
+
+def test_24_bit_file_is_read_without_memory_map(tmp_path):
+
+    settings = dotsi.Dict(app_settings.load())
+
+    # Write a 24 bit recording of A4, which can't be memory mapped.
+    t = np.arange(2 * settings.sound.SAMPLE_RATE) / settings.sound.SAMPLE_RATE
+    test_file = str(tmp_path / "a4-24bit.wav")
+    sf.write(test_file, 0.5 * np.sin(2 * np.pi * 440 * t), settings.sound.SAMPLE_RATE, subtype="PCM_24")
+
+    # Read into memory as 32 bit instead, scaled the same.
+    sample_rate, sound_data = sa.read_wav(test_file)
+    assert sample_rate == settings.sound.SAMPLE_RATE
+    assert sound_data.dtype == np.int32
+    assert abs(sa.to_float(sound_data).max() - 0.5) < 0.01
+
+    analysis = file_analysis.analyse_file(test_file, settings, file_analysis.AnalysisPipeline())
+    assert analysis.note == "A4"
+
+
+def test_empty_recording_raises_value_error(tmp_path):
+
+    settings = dotsi.Dict(app_settings.load())
+
+    # Recording with no samples leaves nothing to transform.
+    test_file = str(tmp_path / "empty.wav")
+    sf.write(test_file, np.zeros(0), settings.sound.SAMPLE_RATE, subtype="PCM_16")
+
+    with pytest.raises(ValueError):
+        file_analysis.analyse_file(test_file, settings, file_analysis.AnalysisPipeline())
+
+
+def test_armed_recording_start_is_not_burnt(tmp_path):
+
+    settings = dotsi.Dict(app_settings.load())
+    settings.trim.ENABLED = False
+    sample_rate = settings.sound.SAMPLE_RATE
+    recording = (0.1 * np.ones((2 * sample_rate, 1))).astype(np.float32)
+
+    # Start of a recording opening the input stream is burnt.
+    stream_file = str(tmp_path / "stream.wav")
+    sa.write_wav(stream_file, sample_rate, recording)
+    assert not sa.has_pre_roll(stream_file)
+    _, (start, _) = file_analysis.AnalysisPipeline().trim(stream_file, settings)
+    assert start == int(settings.sound.BURN_SECS * sample_rate)
+
+    # Armed recording is tagged, so its pre-roll is kept whatever the current setting.
+    armed_file = str(tmp_path / "armed.wav")
+    sa.write_wav(armed_file, sample_rate, recording, pre_roll=True)
+    assert sa.has_pre_roll(armed_file)
+    _, (start, _) = file_analysis.AnalysisPipeline().trim(armed_file, settings)
+    assert start == 0
+    _, sound_data = sa.read_wav(armed_file)
+    assert np.array_equal(sound_data, recording[:, 0])
+
+
+def test_analyse_file_peak_memory(write_tone):
+
+    settings = dotsi.Dict(app_settings.load())
+    sample_rate = settings.sound.SAMPLE_RATE
+
+    # Write 10s of A4, and analyse it once so caches of the transform are set up.
+    test_file = write_tone("a4-long.wav", 440, 10, sample_rate)
+    file_analysis.analyse_file(test_file, settings, file_analysis.AnalysisPipeline())
+
+    # Analysing through a new pipeline runs every stage again.
+    tracemalloc.start()
+    file_analysis.analyse_file(test_file, settings, file_analysis.AnalysisPipeline())
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # Spectrum stage allocates float32 samples, power and transform output,
+    # less than three float32 copies of the recording, and no float64 copy.
+    assert peak < 3 * 4 * 10 * sample_rate
@@ -0,0 +1,62 @@
+"""
+Unit test for the harmonic partial analysis.
+Uses a synthetic stiff string tone with known inharmonicity.
+"""
+
+import dotsi  # type: ignore
+import numpy as np  # type: ignore
+
+from sounder import app_settings
+from sounder import harmonics
+from sounder import sound_analysis as sa
+
+
+def test_analyse_harmonics():
+
+    settings = dotsi.Dict(app_settings.load())
+    sample_rate = settings.sound.SAMPLE_RATE
+
+    # 1s of A2 with 8 partials, stretched by the inharmonicity,
+    # each partial half the amplitude of the one before.
+    fundamental = 110.0
+    inharmonicity = 4e-4
+    numbers = np.arange(1, 9)
+    partials = numbers * fundamental * np.sqrt(1 + inharmonicity * numbers**2)
+    t = np.arange(sample_rate) / sample_rate
+    tone = sum(0.5**n * np.sin(2 * np.pi * freq * t) for n, freq in zip(numbers, partials))
+    freq_array, power = sa.power_spectrum(tone, sample_rate, np.float64)
+
+    # Analyse from a fundamental that is slightly out.
+    analysis = harmonics.analyse_harmonics(sa.bin_spacing(freq_array), power, 110.5, settings)
+
+    assert np.allclose(analysis.partials, partials, atol=0.25)
+    assert np.isclose(analysis.fit_f0, fundamental, atol=0.1)
+    assert np.isclose(analysis.inharmonicity, inharmonicity, rtol=0.1)
+
+    # Amplitude ratio of the harmonics to the fundamental.
+    expected_thd = np.sqrt(np.sum(0.25 ** numbers[1:]) / 0.25)
+    assert np.isclose(analysis.thd, expected_thd, rtol=0.15)
+
+
+def test_partials_beyond_spectrum():
+
+    # Only the partials within the spectrum are found.
+    # Spectrum of 1Hz points up to 1000Hz.
+    power = np.full(1001, -100.0)
+    numbers, freqs, _ = harmonics.partial_peaks(1.0, power, 300.0, 8, 50)
+    assert list(numbers) == [1, 2, 3]
+    assert len(freqs) == 3
+
+
+def test_silence_has_no_partials():
+
+    settings = dotsi.Dict(app_settings.load())
+    sample_rate = settings.sound.SAMPLE_RATE
+
+    # Silence, and noise, have no partials above the noise floor.
+    for sound_data in (np.zeros(sample_rate), 1e-3 * np.random.default_rng(0).standard_normal(sample_rate)):
+        freq_array, power = sa.power_spectrum(sound_data, sample_rate, np.float64)
+        analysis = harmonics.analyse_harmonics(sa.bin_spacing(freq_array), power, 110.0, settings)
+        assert analysis.partials == []
+        assert analysis.inharmonicity is None
+        assert analysis.thd is None
@@ -0,0 +1,104 @@
+"""
+Unit test for the level and loudness meter.
+"""
+
+import dotsi  # type: ignore
+import numpy as np  # type: ignore
+
+from sounder import app_settings
+from sounder import meter
+
+
+def test_k_weighting_matches_bs1770():
+
+    # Coefficients given in BS.1770 at 48kHz.
+    sos = meter.k_weighting(48000)
+    shelf = [1.53512485958697, -2.69169618940638, 1.19839281085285, 1.0, -1.69065929318241, 0.73248077421585]
+    high_pass = [1.0, -2.0, 1.0, 1.0, -1.99004745483398, 0.99007225036621]
+    assert np.allclose(sos[0], shelf)
+    assert np.allclose(sos[1], high_pass)
+
+
+def test_meter_levels():
+
+    settings = dotsi.Dict(app_settings.load())
+    sample_rate = 48000
+
+    # 3s of a full scale 997Hz tone, then 1s of silence.
+    t = np.arange(3 * sample_rate) / sample_rate
+    tone = np.concatenate((np.sin(2 * np.pi * 997 * t), np.zeros(sample_rate)))
+    sound_data = np.round(tone * 32767).astype(np.int16)
+
+    results = meter.meter_data(sound_data, sample_rate, settings)
+
+    # Blocks of 100ms.
+    assert len(results.peak_db) == 40
+    assert np.isclose(results.max_peak_db, 0.0, atol=0.01)
+    assert np.allclose(results.rms_db[:30], -3.01, atol=0.01)
+    assert np.allclose(results.crest_db[:30], 3.01, atol=0.02)
+    assert np.all(results.peak_db[30:] == meter.MIN_DB)
+
+    # Full scale tone is -3.01 LUFS. The 27 gating blocks of only tone are
+    # averaged with the 3 overlapping the silence, with 3/4, 1/2 and 1/4 of
+    # the power, and the rest of the silence is gated out.
+    assert np.isclose(results.integrated_lufs, -3.01 + 10 * np.log10(28.5 / 30), atol=0.05)
+
+    # Only the peaks of the tone are at full scale.
+    assert results.total_clips > 0
+    assert np.all(results.clips[30:] == 0)
+
+
+def test_chunked_same_as_whole():
+
+    settings = dotsi.Dict(app_settings.load())
+    sample_rate = settings.sound.SAMPLE_RATE
+    sound_data = 0.1 * np.random.default_rng(0).standard_normal(2 * sample_rate + 1234)
+
+    # Whole in one push, or in odd sized chunks as from a live stream.
+    whole = meter.StreamMeter(sample_rate, settings)
+    whole.push(sound_data)
+    whole.flush()
+    chunked = meter.StreamMeter(sample_rate, settings)
+    for start in range(0, len(sound_data), 333):
+        chunked.push(sound_data[start : start + 333])
+    chunked.flush()
+
+    whole_results = whole.results()
+    chunked_results = chunked.results()
+    assert np.allclose(whole_results.rms_db, chunked_results.rms_db)
+    assert np.allclose(whole_results.momentary_lufs, chunked_results.momentary_lufs)
+    assert np.isclose(whole_results.integrated_lufs, chunked_results.integrated_lufs)
+    assert chunked.latest().rms_db == chunked_results.rms_db[-1]
+
+
+def test_bounded_meter_keeps_latest_blocks():
+
+    settings = dotsi.Dict(app_settings.load())
+    sample_rate = settings.sound.SAMPLE_RATE
+    sound_data = 0.1 * np.random.default_rng(0).standard_normal(5 * sample_rate)
+
+    # Live input in small blocks, metered with all blocks kept, or only the latest.
+    unbounded = meter.StreamMeter(sample_rate, settings)
+    bounded = meter.StreamMeter(sample_rate, settings, max_blocks=meter.GATE_BLOCKS)
+    for start in range(0, len(sound_data), 512):
+        unbounded.push(sound_data[start : start + 512])
+        bounded.push(sound_data[start : start + 512])
+
+    # Same live readout, but only the latest blocks are kept.
+    assert bounded.num_blocks == unbounded.num_blocks == 50
+    assert bounded.latest() == unbounded.latest()
+    bounded_results = bounded.results()
+    assert len(bounded_results.rms_db) == meter.GATE_BLOCKS
+    assert np.allclose(bounded_results.rms_db, unbounded.results().rms_db[-meter.GATE_BLOCKS :])
+
+
+def test_silence_at_floor():
+
+    settings = dotsi.Dict(app_settings.load())
+
+    # Digital silence is reported at the lowest level, not the float floor.
+    results = meter.meter_data(np.zeros(48000, dtype=np.int16), 48000, settings)
+    assert results.max_peak_db == meter.MIN_DB
+    assert results.rms_total_db == meter.MIN_DB
+    assert np.all(results.momentary_lufs == meter.MIN_DB)
+    assert results.integrated_lufs is None
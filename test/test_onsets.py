@@ -0,0 +1,48 @@
+"""
+Unit test for note onset detection and per note analysis.
+Using a synthetic recording of plucked notes.
+"""
+
+import dotsi  # type: ignore
+import numpy as np  # type: ignore
+from scipy.io.wavfile import write  # type: ignore
+
+from sounder import app_settings
+from sounder import file_analysis
+from sounder import onsets
+
+
+def make_notes(freqs: list[float], note_secs: float, sample_rate: int) -> np.ndarray:
+
+    # Decaying sine wave for each note, one after the other.
+    t = np.arange(int(note_secs * sample_rate)) / sample_rate
+    envelope = np.exp(-3 * t)
+    return np.concatenate([0.5 * envelope * np.sin(2 * np.pi * f * t) for f in freqs])
+
+
+def test_segments_are_views():
+
+    # Segments must not copy the sound data.
+    sound_data = np.zeros(1000, dtype=np.int16)
+    segments = onsets.segment_views(sound_data, np.array([0, 300, 900]), 200)
+    assert [start for start, _ in segments] == [0, 300]
+    for _, segment in segments:
+        assert np.shares_memory(segment, sound_data)
+
+
+def test_analyse_notes(tmp_path):
+
+    settings = dotsi.Dict(app_settings.load())
+    sample_rate = settings.sound.SAMPLE_RATE
+
+    # Write a recording of 3 notes, A3, C4 and E4.
+    freqs = [220.0, 261.63, 329.63]
+    test_file = str(tmp_path / "notes.wav")
+    write(test_file, sample_rate, (make_notes(freqs, 1.0, sample_rate) * 2**15).astype(np.int16))
+
+    notes = file_analysis.analyse_notes(test_file, settings, file_analysis.AnalysisPipeline())
+
+    assert [note.note for note in notes] == ["A3", "C4", "E4"]
+    for note, freq in zip(notes, freqs):
+        assert abs(note.freq - freq) < 2.0
+        assert abs(note.start - round(note.start)) < 0.05
@@ -0,0 +1,58 @@
+"""
+Unit test for the semitone spectrum.
+"""
+
+import dotsi  # type: ignore
+import numpy as np  # type: ignore
+
+from sounder import app_settings
+from sounder import semitone
+from sounder import sound_analysis as sa
+
+
+def test_semitone_spectrum():
+
+    settings = dotsi.Dict(app_settings.load())
+    settings.semitone.BINS_PER_SEMITONE = 1
+    sample_rate = settings.sound.SAMPLE_RATE
+
+    # 1s of C4 with some noise.
+    t = np.arange(sample_rate) / sample_rate
+    noise = 0.001 * np.random.default_rng(0).standard_normal(len(t))
+    freq_array, power = sa.power_spectrum(0.5 * np.sin(2 * np.pi * 261.63 * t) + noise, sample_rate, np.float64)
+
+    centres, band_power = semitone.semitone_spectrum(sa.bin_spacing(freq_array), power, settings)
+
+    # Bands are on the note grid, and the peak is C4.
+    assert np.allclose(centres[centres.searchsorted(440.0)], 440.0)
+    assert len(centres) < 100
+    assert np.isclose(centres[np.argmax(band_power)], 261.63, atol=0.01)
+
+    # Kernel is reused for spectra of the same length.
+    hits = semitone.semitone_kernel.cache_info().hits
+    semitone.semitone_spectrum(sa.bin_spacing(freq_array), power, settings)
+    assert semitone.semitone_kernel.cache_info().hits == hits + 1
+
+    # Bands are reused for a spectrum of another length, only the kernel is built.
+    _, shorter = sa.power_spectrum(0.5 * np.sin(2 * np.pi * 261.63 * t[:-100]), sample_rate, np.float64)
+    hits = semitone.band_edges.cache_info().hits
+    shorter_centres, _ = semitone.semitone_spectrum(sample_rate / (len(t) - 100), shorter, settings)
+    assert semitone.band_edges.cache_info().hits == hits + 1
+    assert np.array_equal(shorter_centres, centres)
+
+
+def test_semitone_kernel_weights():
+
+    # Every band averages the bins it covers, including low bands
+    # narrower than a bin.
+    centres, kernel, first_bin = semitone.semitone_kernel(22051, 1.0, 25.0, 1700.0, 3)
+    assert np.allclose(kernel.sum(axis=1), 1.0)
+    assert kernel.shape[0] == len(centres)
+    assert first_bin == 25
+
+
+def test_band_centres_from_0hz():
+
+    # Range from 0Hz starts at the lowest note.
+    centres = semitone.band_centres(0.0, 100.0, 1)
+    assert np.isclose(centres[0], semitone.midi_to_freq(0))
@@ -0,0 +1,66 @@
+"""
+Unit test for the power spectrum calculation.
+Checks the float32 workspace results and memory use.
+"""
+
+import tracemalloc
+
+import numpy as np  # type: ignore
+
+from sounder import sound_analysis as sa
+
+
+def reference_spectrum(sample_data: np.ndarray) -> np.ndarray:
+
+    # Double precision power spectrum (dB) using full FFT.
+    num_samps = len(sample_data)
+    fft_data = (np.abs(np.fft.fft(sample_data)[: num_samps // 2 + 1]) / num_samps) ** 2
+    fft_data[1:-1] *= 2
+    return 10.0 * np.log10(fft_data)
+
+
+def test_power_spectrum_matches_reference():
+
+    # 1s of 440Hz tone with some noise, as 16 bit samples.
+    sample_rate = 44100
+    rng = np.random.default_rng(0)
+    t = np.arange(sample_rate) / sample_rate
+    sound_data = (0.5 * np.sin(2 * np.pi * 440 * t) + 0.01 * rng.standard_normal(sample_rate)) * 2**15
+    sound_data = sound_data.astype(np.int16)
+
+    freq_array, power = sa.power_spectrum(sound_data, sample_rate)
+    expected = reference_spectrum(sound_data / 2**15)
+
+    assert power.dtype == np.float32
+    assert freq_array[1] == 1.0
+    assert freq_array[np.argmax(power)] == 440.0
+    assert np.allclose(power, expected, atol=0.01)
+
+
+def test_power_spectrum_reuses_workspace():
+
+    sample_rate = 44100
+    sound_data = np.zeros(5 * sample_rate, dtype=np.int16)
+    sound_data[::100] = 1000
+
+    # Workspace is allocated on the first call, and reused after.
+    _, first = sa.power_spectrum(sound_data, sample_rate)
+    tracemalloc.start()
+    _, second = sa.power_spectrum(sound_data, sample_rate)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # Only the transform output is allocated, which is less than
+    # a float32 copy of the sound data.
+    assert second is first
+    assert peak < 1.1 * 4 * len(sound_data)
+
+
+def test_nearest_note():
+
+    assert sa.nearest_note(440.0) == ("A4", 0.0)
+    note, cents = sa.nearest_note(82.41)
+    assert note == "E2" and abs(cents) < 1
+
+    # No note for a peak at DC.
+    assert sa.nearest_note(0.0) == (sa.NO_NOTE, 0.0)
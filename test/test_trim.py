@@ -0,0 +1,99 @@
+"""
+Unit test for trimming silence from a recording.
+"""
+
+import dotsi  # type: ignore
+import numpy as np  # type: ignore
+
+from sounder import app_settings
+from sounder import trim
+
+
+def test_active_region():
+
+    settings = dotsi.Dict(app_settings.load())
+    sample_rate = settings.sound.SAMPLE_RATE
+
+    # 1s of quiet noise, 2s of tone, then 2s of quiet noise.
+    rng = np.random.default_rng(0)
+    sound_data = 1e-4 * rng.standard_normal(5 * sample_rate)
+    t = np.arange(2 * sample_rate) / sample_rate
+    sound_data[sample_rate : 3 * sample_rate] += 0.5 * np.sin(2 * np.pi * 440 * t)
+
+    start, end = trim.active_region(sound_data, sample_rate, settings)
+    pad = settings.trim.PAD_SECS * sample_rate
+    frame = settings.trim.FRAME_SECS * sample_rate
+    assert abs(start - (sample_rate - pad)) <= frame
+    assert abs(end - (3 * sample_rate + pad)) <= frame
+
+
+def test_active_region_fallback():
+
+    settings = dotsi.Dict(app_settings.load())
+    sample_rate = settings.sound.SAMPLE_RATE
+    burn = int(settings.sound.BURN_SECS * sample_rate)
+
+    # Silence has no active region, so burn the start.
+    sound_data = np.zeros(2 * sample_rate, dtype=np.int16)
+    assert trim.active_region(sound_data, sample_rate, settings) == (burn, len(sound_data))
+
+    # Burn the start if trimming is disabled.
+    settings.trim.ENABLED = False
+    assert trim.active_region(np.ones(len(sound_data)), sample_rate, settings) == (burn, len(sound_data))
+
+    # Recording too short to burn is used whole.
+    short_data = np.ones(burn // 2)
+    assert trim.active_region(short_data, sample_rate, settings) == (0, len(short_data))
+
+    # Nothing is burnt from armed recordings, as the start is the pre-roll.
+    assert trim.active_region(np.ones(len(sound_data)), sample_rate, settings, pre_roll=True) == (0, len(sound_data))
+
+
+def test_short_active_region():
+
+    settings = dotsi.Dict(app_settings.load())
+    sample_rate = settings.sound.SAMPLE_RATE
+
+    # 0.3s pluck in a recording too short to burn, so the pluck is used.
+    rng = np.random.default_rng(0)
+    sound_data = 1e-4 * rng.standard_normal(int(0.6 * sample_rate))
+    t = np.arange(int(0.3 * sample_rate)) / sample_rate
+    sound_data[: len(t)] += 0.5 * np.sin(2 * np.pi * 440 * t)
+
+    start, end = trim.active_region(sound_data, sample_rate, settings)
+    assert start == 0
+    assert 0.3 * sample_rate <= end < len(sound_data)
+
+
+def test_short_silent_tail_is_trimmed():
+
+    settings = dotsi.Dict(app_settings.load())
+    sample_rate = settings.sound.SAMPLE_RATE
+
+    # 4.7s of tone, then a 0.3s quiet tail, so few frames are quiet.
+    rng = np.random.default_rng(0)
+    sound_data = 1e-4 * rng.standard_normal(5 * sample_rate)
+    t = np.arange(int(4.7 * sample_rate)) / sample_rate
+    sound_data[: len(t)] += 0.5 * np.sin(2 * np.pi * 440 * t)
+
+    _, end = trim.active_region(sound_data, sample_rate, settings)
+    pad = settings.trim.PAD_SECS * sample_rate
+    frame = settings.trim.FRAME_SECS * sample_rate
+    assert abs(end - (4.7 * sample_rate + pad)) <= frame
+
+
+def test_loud_start_is_burnt():
+
+    settings = dotsi.Dict(app_settings.load())
+    sample_rate = settings.sound.SAMPLE_RATE
+    burn = int(settings.sound.BURN_SECS * sample_rate)
+
+    # Tone from the very start, then 2s of quiet noise.
+    rng = np.random.default_rng(0)
+    sound_data = 1e-4 * rng.standard_normal(5 * sample_rate)
+    t = np.arange(3 * sample_rate) / sample_rate
+    sound_data[: len(t)] += 0.5 * np.sin(2 * np.pi * 440 * t)
+
+    # Device start up is burnt, but the pre-roll of armed recordings is kept.
+    assert trim.active_region(sound_data, sample_rate, settings)[0] == burn
+    assert trim.active_region(sound_data, sample_rate, settings, pre_roll=True)[0] == 0
@@ -0,0 +1,111 @@
+"""
+Unit test for the real time tuner.
+Using a simulated input stream of a tone.
+"""
+
+import time
+from types import SimpleNamespace
+
+import dotsi  # type: ignore
+import numpy as np  # type: ignore
+
+from sounder import app_settings
+from sounder import std_io
+from sounder import tuner
+
+# Frequency of the simulated tone, G3.
+TONE_HZ = 196.0
+
+
+def tone(positions, sample_rate):
+    return 0.5 * np.sin(2 * np.pi * TONE_HZ * positions / sample_rate)
+
+
+def test_pitch_estimator():
+
+    settings = dotsi.Dict(app_settings.load())
+    sample_rate = settings.sound.SAMPLE_RATE
+    t = np.arange(sample_rate // 4) / sample_rate
+
+    # Low E string, with harmonics, in small blocks.
+    estimator = tuner.PitchEstimator(sample_rate, settings)
+    tone = 0.3 * np.sin(2 * np.pi * 82.41 * t) + 0.2 * np.sin(2 * np.pi * 164.82 * t)
+    for start in range(0, len(tone) - 128, 128):
+        freq, level = estimator.push(tone[start : start + 128])
+    assert abs(1200 * np.log2(freq / 82.41)) < 1.0
+
+    # No pitch for silence.
+    estimator = tuner.PitchEstimator(sample_rate, settings)
+    freq, level = estimator.push(np.zeros(256))
+    assert freq is None
+    assert level < settings.tuner.MIN_LEVEL_DB
+
+
+def test_needle_bar():
+
+    assert tuner.needle_bar(0.0, 11) == "-----^-----"
+    assert tuner.needle_bar(-50.0, 11) == "^----|-----"
+    assert tuner.needle_bar(80.0, 11) == "-----|----^"
+
+
+def test_tuner_run(input_stream):
+
+    settings = dotsi.Dict(app_settings.load())
+    settings.tuner.RENDER_HZ = 10
+    lines = []
+
+    with tuner.Tuner(settings, input_stream(tone)) as live_tuner:
+        renders = live_tuner.run(0.5, lines.append)
+        freq, _ = live_tuner.latest
+
+    # Estimates every block, but renders are throttled.
+    assert abs(1200 * np.log2(freq / TONE_HZ)) < 1.0
+    assert 0 < renders <= 6
+    assert renders == len(lines)
+    assert live_tuner.blocks > renders
+    assert "G3" in lines[-1]
+
+
+def test_tuner_callback_quicker_than_block(input_stream):
+
+    settings = dotsi.Dict(app_settings.load())
+    live_tuner = tuner.Tuner(settings, input_stream(tone))
+    frames = round(live_tuner.block_secs * settings.sound.SAMPLE_RATE)
+    status = SimpleNamespace(input_overflow=False)
+
+    # Blocks of the tone, calling back directly rather than through the stream.
+    blocks = [
+        tone(np.arange(start, start + frames), settings.sound.SAMPLE_RATE).astype(np.float32).reshape(-1, 1)
+        for start in range(0, 200 * frames, frames)
+    ]
+
+    # Warm up first, so the first call costs are not timed.
+    for block in blocks[:20]:
+        live_tuner._callback(block, frames, None, status)
+
+    # Typical callback is quicker than a block, so doesn't hold up the input stream.
+    # Single callbacks can be slowed by garbage collection and scheduling, so the median is checked.
+    times = []
+    for block in blocks[20:]:
+        started = time.perf_counter()
+        live_tuner._callback(block, frames, None, status)
+        times.append(time.perf_counter() - started)
+    assert np.median(times) < live_tuner.block_secs
+
+
+def test_tuner_renders_through_app_output(input_stream, tmp_path, monkeypatch):
+
+    settings = dotsi.Dict(app_settings.load())
+    settings.tuner.RENDER_HZ = 10
+
+    # Readout rendered in place to the application output file.
+    monkeypatch.chdir(tmp_path)
+    app_io = std_io.AbstractInputOutput(None, "tuner.txt", "w")
+    with tuner.Tuner(settings, input_stream(tone)) as live_tuner:
+        live_tuner.run(0.3, lambda text: app_io.app_out(tuner.in_place(text), False))
+    app_io.close_out()
+
+    # Bytes, so the returns to the start of the line are not read as new lines.
+    contents = (tmp_path / "tuner.txt").read_bytes()
+    assert contents.startswith(b"\r")
+    assert b"G3" in contents
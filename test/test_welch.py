@@ -0,0 +1,102 @@
+"""
+Unit test for the Welch averaged power spectrum split across processes.
+"""
+
+import dotsi  # type: ignore
+import numpy as np  # type: ignore
+from scipy.io.wavfile import read  # type: ignore
+from scipy.signal import welch as scipy_welch  # type: ignore
+import soundfile as sf  # type: ignore
+
+from sounder import app_settings
+from sounder import welch
+
+
+def test_parallel_welch_matches_serial(write_tone):
+
+    settings = dotsi.Dict(app_settings.load())
+    settings.welch.SEG_SIZE = 4096
+    settings.sound.FFT_DTYPE = "float64"
+    sample_rate = settings.sound.SAMPLE_RATE
+
+    # Write 10s of a 440Hz tone with noise.
+    test_file = write_tone("long.wav", 440, 10, sample_rate, noise=0.01)
+    _, sound_data = read(test_file)
+
+    # Skip the first second, as an active region would.
+    start, end = sample_rate, len(sound_data)
+
+    # Serial, and split across processes.
+    settings.welch.WORKERS = 1
+    freq_serial, power_serial = welch.welch_power(test_file, start, end, sample_rate, settings)
+    settings.welch.WORKERS = 3
+    freq_parallel, power_parallel = welch.welch_power(test_file, start, end, sample_rate, settings)
+
+    # Same as scipy, without detrending.
+    freq_scipy, power_scipy = scipy_welch(
+        sound_data[start:end] / 2**15,
+        sample_rate,
+        nperseg=4096,
+        noverlap=2048,
+        detrend=False,
+        scaling="spectrum",
+    )
+
+    assert np.array_equal(freq_serial, freq_parallel)
+    assert np.allclose(freq_serial, freq_scipy)
+    assert np.allclose(power_serial, power_parallel, atol=1e-9)
+    assert np.allclose(power_serial, 10 * np.log10(power_scipy), atol=1e-6)
+
+
+def test_shared_pool_follows_workers():
+
+    settings = dotsi.Dict(app_settings.load())
+
+    # Serial for 1 worker, and the pool is replaced when the workers change.
+    settings.welch.WORKERS = 1
+    assert welch.shared_pool(settings) is None
+    settings.welch.WORKERS = 2
+    pool = welch.shared_pool(settings)
+    assert welch.shared_pool(settings) is pool
+    settings.welch.WORKERS = 3
+    assert welch.shared_pool(settings) is not pool
+    assert welch.num_workers(settings) == 3
+
+
+def test_24_bit_chunks_read_only_their_samples(tmp_path, monkeypatch):
+
+    settings = dotsi.Dict(app_settings.load())
+    settings.welch.SEG_SIZE = 4096
+    settings.welch.WORKERS = 1
+    settings.sound.FFT_DTYPE = "float64"
+    sample_rate = settings.sound.SAMPLE_RATE
+
+    # Write 10s of a 440Hz tone as 24 bit, which can't be memory mapped.
+    t = np.arange(10 * sample_rate) / sample_rate
+    test_file = str(tmp_path / "long-24bit.wav")
+    sf.write(test_file, 0.5 * np.sin(2 * np.pi * 440 * t), sample_rate, subtype="PCM_24")
+    sound_data, _ = sf.read(test_file)
+
+    # Record the samples read by each chunk.
+    reads = []
+    sf_read = sf.read
+
+    def read_range(s_file, **kwargs):
+        reads.append((kwargs["start"], kwargs["stop"]))
+        return sf_read(s_file, **kwargs)
+
+    monkeypatch.setattr(welch.sf, "read", read_range)
+
+    start, end = sample_rate, len(sound_data)
+    _, power = welch.welch_power(test_file, start, end, sample_rate, settings)
+
+    # Each chunk only reads its own samples, overlapping by less than a segment.
+    assert len(reads) == settings.welch.CHUNKS_PER_WORKER
+    assert all(start <= first < last <= end for first, last in reads)
+    assert sum(last - first for first, last in reads) < end - start + len(reads) * settings.welch.SEG_SIZE
+
+    # Same as scipy, without detrending.
+    _, power_scipy = scipy_welch(
+        sound_data[start:end], sample_rate, nperseg=4096, noverlap=2048, detrend=False, scaling="spectrum"
+    )
+    assert np.allclose(power, 10 * np.log10(power_scipy), atol=1e-6)